@@ -2,14 +2,27 @@ import os
 import sys
 import datetime
 import hashlib
-from flask import Flask, render_template, request, redirect, url_for, flash, session, send_from_directory
+import hmac
+import time
+from flask import Flask, render_template, request, redirect, url_for, flash, session, send_from_directory, g, abort, Response
 from flask_login import LoginManager, UserMixin, login_user, logout_user, login_required, current_user
 from werkzeug.utils import secure_filename
 from sqlalchemy import func
+from sqlalchemy.orm import selectinload
 
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
-from config.config import ADMIN_USERNAME, ADMIN_PASSWORD, UPLOAD_FOLDER
-from database.models import get_db, Admin, Course, User, Payment, Log, Category, BotSetting, CourseRequest
+from config.config import (
+    ADMIN_USERNAME, ADMIN_PASSWORD, UPLOAD_FOLDER, LOG_RETENTION_DAYS, LOG_RETENTION_WEB_BATCHES, METRICS_TOKEN,
+    STORAGE_CHANNEL_ID
+)
+from database.models import (
+    get_db, Admin, Course, CourseFile, User, Payment, Log, Category, BotSetting, CourseRequest, LogAction,
+    Broadcast, BroadcastDelivery, bump_catalog_version, bump_settings_version, record_change
+)
+from database.retention import run_retention, expired_logs_remain, search_archives, get_rollup_totals
+from database import query_stats
+from utils import metrics, links, settings
+from utils.helpers import log_action, guess_file_kind
 
 # Add method to Payment class for getting associated course
 Payment.get_course = lambda self: get_db().query(Course).filter_by(id=self.course_id).first()
@@ -37,6 +50,48 @@ os.makedirs(UPLOAD_FOLDER, exist_ok=True)
 # Allowed file extensions for security
 ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif', 'webp'}
 
+# Request metrics
+REQUEST_LATENCY = metrics.histogram('admin_request_duration_seconds', 'Admin request latency', ['method', 'route'])
+REQUEST_COUNT = metrics.counter('admin_requests_total', 'Admin requests', ['method', 'route', 'status'])
+REQUEST_ERRORS = metrics.counter('admin_request_errors_total', 'Admin requests that raised an exception', ['method', 'route'])
+REQUESTS_IN_FLIGHT = metrics.gauge('admin_requests_in_flight', 'Admin requests currently being served')
+LINK_OPENS = metrics.counter('admin_course_link_opens_total', 'Course links opened, by outcome', ['result'])
+REQUEST_QUERIES = metrics.counter('admin_request_db_queries_total', 'Database queries run by admin requests', ['method', 'route'])
+
+def request_route():
+    """Route template of the current request, to keep metric labels low-cardinality"""
+    return request.url_rule.rule if request.url_rule else 'unmatched'
+
+# Track the queries and latency of every request (see database/query_stats.py)
+@app.before_request
+def start_request_tracking():
+    REQUESTS_IN_FLIGHT.inc()
+    g.request_start = time.perf_counter()
+    g.query_stats_token = query_stats.start_scope(f"{request.method} {request.endpoint}")
+
+@app.after_request
+def finish_request_tracking(response):
+    token = g.pop('query_stats_token', None)
+    scope = query_stats.finish_scope(token)
+    if scope is not None:
+        REQUEST_QUERIES.labels(request.method, request_route()).inc(scope.count)
+    REQUEST_COUNT.labels(request.method, request_route(), response.status_code).inc()
+    return response
+
+@app.teardown_request
+def end_request_tracking(exception=None):
+    # An open scope here means the request failed before after_request
+    token = g.pop('query_stats_token', None)
+    query_stats.finish_scope(token, raise_errors=False)
+
+    start = g.pop('request_start', None)
+    if start is None:
+        return
+    REQUESTS_IN_FLIGHT.dec()
+    REQUEST_LATENCY.labels(request.method, request_route()).observe(time.perf_counter() - start)
+    if exception is not None:
+        REQUEST_ERRORS.labels(request.method, request_route()).inc()
+
 # Initialize Flask-Login
 login_manager = LoginManager()
 login_manager.init_app(app)
@@ -87,10 +142,14 @@ def get_stats():
         'recent_payments': recent_payments
     }
 
+def log_query(db):
+    """Query logs with the records referenced by their summaries preloaded"""
+    return db.query(Log).options(selectinload(Log.course), selectinload(Log.category))
+
 def get_user_logs(telegram_id):
     """Get logs for a specific user"""
     db = get_db()
-    logs = db.query(Log).filter_by(telegram_id=telegram_id).order_by(Log.timestamp.desc()).limit(50).all()
+    logs = log_query(db).filter_by(telegram_id=telegram_id).order_by(Log.timestamp.desc()).limit(50).all()
     return logs
 
 def allowed_file(filename):
@@ -227,6 +286,7 @@ def add_course():
             demo_video_link=demo_video_link if demo_video_link else None
         )
         db.add(course)
+        bump_catalog_version(db)
         db.commit()
         
         flash('Course added successfully!', 'success')
@@ -296,6 +356,7 @@ def edit_course(course_id):
         course.is_active = 'is_active' in request.form
         # course.updated_date is automatically handled by the model's onupdate
         
+        bump_catalog_version(db)
         db.commit()
         
         flash('Course updated successfully!', 'success')
@@ -322,6 +383,7 @@ def delete_course(course_id):
     
     # If no payments are associated, proceed with deletion
     db.delete(course)
+    bump_catalog_version(db)
     db.commit()
     flash('Course deleted successfully!', 'success')
     
@@ -379,17 +441,18 @@ def approve_payment(payment_id):
     payment = db.query(Payment).filter_by(id=payment_id).first()
     
     if payment:
-        payment.status = 'approved'
-        payment.approval_date = datetime.datetime.now(datetime.UTC)
-        
-        # Record if it's a gift card payment for tracking purposes
-        if payment.payment_method == 'gift' and payment.details:
-            payment.details += " [REDEEMED]"
+        if payment.status != 'approved':
+            payment.status = 'approved'
+            payment.approval_date = datetime.datetime.now(datetime.UTC)
             
+            # Record if it's a gift card payment for tracking purposes
+            if payment.payment_method == 'gift' and payment.details:
+                payment.details += " [REDEEMED]"
+            
+            # The bot sends the course to the user (bot/changes.py)
+            record_change(db, 'payment_approved', payment.id)
         db.commit()
         
-        # TODO: Send notification to user (implement in a production environment)
-        
         flash('Payment approved successfully!', 'success')
     else:
         flash('Payment not found.', 'danger')
@@ -404,11 +467,11 @@ def reject_payment(payment_id):
     payment = db.query(Payment).filter_by(id=payment_id).first()
     
     if payment:
-        payment.status = 'rejected'
+        if payment.status != 'rejected':
+            payment.status = 'rejected'
+            record_change(db, 'payment_rejected', payment.id)
         db.commit()
         
-        # TODO: Send notification to user (implement in a production environment)
-        
         flash('Payment rejected.', 'info')
     else:
         flash('Payment not found.', 'danger')
@@ -436,7 +499,7 @@ def user_detail(user_id):
         return redirect(url_for('users'))
     
     payments = db.query(Payment).filter_by(user_id=user.id).all()
-    logs = db.query(Log).filter_by(telegram_id=user.telegram_id).order_by(Log.timestamp.desc()).limit(50).all()
+    logs = log_query(db).filter_by(telegram_id=user.telegram_id).order_by(Log.timestamp.desc()).limit(50).all()
     
     # Pass the function to the template context
     return render_template(
@@ -459,6 +522,7 @@ def ban_user(user_id):
     if user:
         user.is_banned = True
         user.ban_reason = reason
+        record_change(db, 'user_banned', user.id)
         db.commit()
         
         flash('User banned successfully.', 'success')
@@ -475,6 +539,8 @@ def unban_user(user_id):
     user = db.query(User).filter_by(id=user_id).first()
     
     if user:
+        if user.is_banned:
+            record_change(db, 'user_unbanned', user.id)
         user.is_banned = False
         user.ban_reason = None
         db.commit()
@@ -485,14 +551,183 @@ def unban_user(user_id):
     
     return redirect(url_for('user_detail', user_id=user_id))
 
+# BROADCAST ROUTES
+# Broadcasts are sent by the bot process (bot/broadcast.py); these pages create them and change their status
+@app.route('/broadcasts', methods=['GET', 'POST'])
+@login_required
+def broadcasts():
+    """List broadcasts and start a new one"""
+    db = get_db()
+
+    if request.method == 'POST':
+        text = request.form.get('text', '').strip()
+        course_id = request.form.get('course_id', type=int)
+        if not text:
+            flash('Broadcast message is required.', 'danger')
+            return redirect(url_for('broadcasts'))
+
+        recipients = db.query(func.count(User.id)).filter(User.is_banned.isnot(True), User.is_blocked.isnot(True)).scalar()
+        broadcast = Broadcast(
+            text=text,
+            course_id=course_id or None,
+            status='running',
+            created_by=current_user.username,
+            total_users=recipients
+        )
+        db.add(broadcast)
+        db.flush()
+        record_change(db, 'broadcast', broadcast.id)
+        db.commit()
+        flash(f'Broadcast started to {recipients} users.', 'success')
+        return redirect(url_for('broadcast_detail', broadcast_id=broadcast.id))
+
+    broadcasts_list = db.query(Broadcast).order_by(Broadcast.id.desc()).limit(50).all()
+    courses_list = db.query(Course).filter_by(is_active=True).order_by(Course.title).all()
+    return render_template('broadcasts.html', broadcasts=broadcasts_list, courses=courses_list)
+
+@app.route('/broadcast/<int:broadcast_id>')
+@login_required
+def broadcast_detail(broadcast_id):
+    """Live progress of a broadcast"""
+    db = get_db()
+    broadcast = db.query(Broadcast).filter_by(id=broadcast_id).first()
+    if not broadcast:
+        flash('Broadcast not found.', 'danger')
+        return redirect(url_for('broadcasts'))
+
+    remaining = max(broadcast.total_users - broadcast.processed, 0)
+    eta_seconds = remaining / broadcast.rate if broadcast.status == 'running' and broadcast.rate else None
+    problems = (db.query(BroadcastDelivery)
+                .options(selectinload(BroadcastDelivery.user))
+                .filter(BroadcastDelivery.broadcast_id == broadcast.id, BroadcastDelivery.status != 'sent')
+                .order_by(BroadcastDelivery.id.desc())
+                .limit(50).all())
+    return render_template('broadcast_detail.html', broadcast=broadcast, remaining=remaining,
+                           eta_seconds=eta_seconds, problems=problems)
+
+def set_broadcast_status(broadcast_id, allowed, status, message):
+    db = get_db()
+    broadcast = db.query(Broadcast).filter_by(id=broadcast_id).first()
+    if not broadcast:
+        flash('Broadcast not found.', 'danger')
+        return redirect(url_for('broadcasts'))
+    if broadcast.status not in allowed:
+        flash(f'Broadcast is {broadcast.status}.', 'warning')
+    else:
+        broadcast.status = status
+        if status == 'cancelled':
+            broadcast.finished_date = datetime.datetime.now(datetime.UTC)
+        elif status == 'running':
+            record_change(db, 'broadcast', broadcast.id)
+        db.commit()
+        flash(message, 'success')
+    return redirect(url_for('broadcast_detail', broadcast_id=broadcast_id))
+
+@app.route('/broadcast/pause/<int:broadcast_id>', methods=['POST'])
+@login_required
+def pause_broadcast(broadcast_id):
+    """Pause a broadcast after the batch being sent"""
+    return set_broadcast_status(broadcast_id, ('running',), 'paused', 'Broadcast paused.')
+
+@app.route('/broadcast/resume/<int:broadcast_id>', methods=['POST'])
+@login_required
+def resume_broadcast(broadcast_id):
+    """Continue a paused broadcast where it stopped"""
+    return set_broadcast_status(broadcast_id, ('paused',), 'running', 'Broadcast resumed.')
+
+@app.route('/broadcast/cancel/<int:broadcast_id>', methods=['POST'])
+@login_required
+def cancel_broadcast(broadcast_id):
+    """Stop a broadcast for good"""
+    return set_broadcast_status(broadcast_id, ('running', 'paused'), 'cancelled', 'Broadcast cancelled.')
+
 @app.route('/logs')
 @login_required
 def logs():
     """View system logs"""
+    action_code = request.args.get('action_code', type=int)
+
     db = get_db()
-    logs_list = db.query(Log).order_by(Log.timestamp.desc()).limit(100).all()
+    query = log_query(db)
+    if action_code:
+        query = query.filter(Log.action_code == action_code)
+    logs_list = query.order_by(Log.timestamp.desc()).limit(100).all()
+    actions = db.query(LogAction).order_by(LogAction.name).all()
     
-    return render_template('logs.html', logs=logs_list)
+    return render_template(
+        'logs.html',
+        logs=logs_list,
+        actions=actions,
+        current_action_code=action_code,
+        retention_days=LOG_RETENTION_DAYS
+    )
+
+@app.route('/logs/archive')
+@login_required
+def logs_archive():
+    """Search archived logs"""
+    today = datetime.date.today()
+    try:
+        end_date = datetime.date.fromisoformat(request.args.get('end_date') or today.isoformat())
+        start_date = datetime.date.fromisoformat(request.args.get('start_date') or (end_date - datetime.timedelta(days=7)).isoformat())
+    except ValueError:
+        flash('Invalid date. Please use the YYYY-MM-DD format.', 'danger')
+        return redirect(url_for('logs_archive'))
+
+    filters = {
+        'telegram_id': request.args.get('telegram_id', '').strip(),
+        'action': request.args.get('action', '').strip(),
+        'text': request.args.get('text', '').strip()
+    }
+
+    archived_logs = []
+    rollup_totals = []
+    if request.args.get('search'):
+        archived_logs = search_archives(
+            start_date,
+            end_date,
+            telegram_id=filters['telegram_id'] or None,
+            action=filters['action'] or None,
+            text=filters['text'] or None
+        )
+        rollup_totals = get_rollup_totals(start_date, end_date, telegram_id=filters['telegram_id'] or None)
+
+    return render_template(
+        'logs_archive.html',
+        logs=archived_logs,
+        rollup_totals=rollup_totals,
+        start_date=start_date,
+        end_date=end_date,
+        filters=filters,
+        searched=bool(request.args.get('search'))
+    )
+
+@app.route('/logs/retention', methods=['POST'])
+@login_required
+def run_log_retention():
+    """Archive old logs now instead of waiting for the scheduled job"""
+    try:
+        # A few batches per request; a first run on a large table would outlast the worker timeout
+        archived = run_retention(max_batches=LOG_RETENTION_WEB_BATCHES)
+        if expired_logs_remain():
+            flash(f'Archived {archived} log entries older than {LOG_RETENTION_DAYS} days. More remain: run it again, '
+                  f'or run "python -m database.retention" for all of them.', 'warning')
+        else:
+            flash(f'Archived {archived} log entries older than {LOG_RETENTION_DAYS} days.', 'success')
+    except Exception as e:
+        flash(f'Error archiving logs: {e}', 'danger')
+    return redirect(url_for('logs'))
+
+@app.route('/metrics')
+def metrics_endpoint():
+    """Prometheus metrics of the gunicorn worker that serves the request (exact only with one web worker)"""
+    if METRICS_TOKEN:
+        expected = f"Bearer {METRICS_TOKEN}"
+        if not hmac.compare_digest(request.headers.get('Authorization', ''), expected):
+            abort(401)
+    elif not current_user.is_authenticated:
+        return login_manager.unauthorized()
+    return Response(metrics.render(), content_type=metrics.CONTENT_TYPE)
 
 @app.route('/uploads/<filename>')
 @login_required
@@ -500,6 +735,40 @@ def uploaded_file(filename):
     """Serve uploaded files"""
     return send_from_directory(app.config['UPLOAD_FOLDER'], filename)
 
+@app.route('/l/<token>')
+def open_course_link(token):
+    """Redirect a signed course link from the bot to the course"""
+    if not links.enabled():
+        abort(404)
+    try:
+        link = links.read_token(token)
+    except links.InvalidLink as e:
+        LINK_OPENS.labels(e.reason).inc()
+        if e.reason == 'expired':
+            return "This link has expired. Open the bot and tap \"👤 My Purchases\" for a new one.", 410
+        abort(404)
+
+    db = get_db()
+    course = db.query(Course).filter_by(id=link.course_id).first()
+    user = db.query(User).filter_by(telegram_id=str(link.telegram_id)).first()
+    payment = db.query(Payment).filter_by(id=link.payment_id).first() if link.payment_id else None
+    if link.payment_id:
+        # Rejected later, or the link was made for someone else's payment
+        allowed = (payment is not None and payment.status == 'approved' and
+                   payment.course_id == link.course_id and user is not None and payment.user_id == user.id)
+    else:
+        allowed = course is not None and course.is_free
+    allowed = allowed and course is not None and not (user and user.is_banned)
+
+    log_action(str(link.telegram_id), "course_link_opened" if allowed else "course_link_refused",
+               ip_address=request.remote_addr, course_id=course.id if course else None,
+               payment_id=payment.id if payment else None)
+    if not allowed:
+        LINK_OPENS.labels('refused').inc()
+        abort(403)
+    LINK_OPENS.labels('opened').inc()
+    return redirect(course.file_link)
+
 @app.route('/course/<int:course_id>')
 @login_required
 def course_detail(course_id):
@@ -511,7 +780,70 @@ def course_detail(course_id):
         flash('Course not found.', 'danger')
         return redirect(url_for('courses'))
     
-    return render_template('course_detail.html', course=course)
+    return render_template('course_detail.html', course=course, storage_channel=STORAGE_CHANNEL_ID)
+
+@app.route('/course/<int:course_id>/files/add', methods=['POST'])
+@login_required
+def add_course_file(course_id):
+    """Attach a file to a course, uploaded here or kept in the storage channel"""
+    db = get_db()
+    course = db.query(Course).filter_by(id=course_id).first()
+    
+    if not course:
+        flash('Course not found.', 'danger')
+        return redirect(url_for('courses'))
+    
+    caption = request.form.get('caption') or None
+    position = max([f.position for f in course.files], default=0) + 1
+    upload = request.files.get('file_upload')
+    storage_message = request.form.get('storage_message', '').strip().rstrip('/')
+    
+    if upload and upload.filename:
+        filename = secure_filename(upload.filename)
+        unique_filename = f"{datetime.datetime.now(datetime.UTC).strftime('%Y%m%d%H%M%S')}_{filename}"
+        upload.save(os.path.join(app.config['UPLOAD_FOLDER'], unique_filename))
+        course_file = CourseFile(course_id=course.id, position=position, kind=guess_file_kind(filename),
+                                 file_name=filename, caption=caption, path=unique_filename)
+    elif storage_message:
+        if not STORAGE_CHANNEL_ID:
+            flash('Set STORAGE_CHANNEL_ID to add files from the storage channel.', 'danger')
+            return redirect(url_for('course_detail', course_id=course_id))
+        # A message link (https://t.me/c/1234567890/45) or just the message id
+        message_id = storage_message.rsplit('/', 1)[-1]
+        if not message_id.isdigit():
+            flash('Enter the link or id of a message in the storage channel.', 'danger')
+            return redirect(url_for('course_detail', course_id=course_id))
+        course_file = CourseFile(course_id=course.id, position=position, file_name=f"Message {message_id}",
+                                 caption=caption, storage_message_id=int(message_id))
+    else:
+        flash('Choose a file to upload or enter a storage channel message.', 'danger')
+        return redirect(url_for('course_detail', course_id=course_id))
+    
+    db.add(course_file)
+    db.commit()
+    flash('File added. It is sent to users with the course link.', 'success')
+    return redirect(url_for('course_detail', course_id=course_id))
+
+@app.route('/course/file/delete/<int:file_id>')
+@login_required
+def delete_course_file(file_id):
+    """Remove a file from a course"""
+    db = get_db()
+    course_file = db.query(CourseFile).filter_by(id=file_id).first()
+    
+    if not course_file:
+        flash('File not found.', 'danger')
+        return redirect(url_for('courses'))
+    
+    course_id = course_file.course_id
+    if course_file.path:
+        path = os.path.join(app.config['UPLOAD_FOLDER'], course_file.path)
+        if os.path.isfile(path):
+            os.remove(path)
+    db.delete(course_file)
+    db.commit()
+    flash('File removed from the course.', 'success')
+    return redirect(url_for('course_detail', course_id=course_id))
 
 @app.route('/fix-gift-codes')
 @login_required
@@ -564,6 +896,7 @@ def add_category():
 
         new_category = Category(name=name)
         db.add(new_category)
+        bump_catalog_version(db)
         db.commit()
         flash('Category added successfully!', 'success')
         return redirect(url_for('categories'))
@@ -593,6 +926,7 @@ def edit_category(category_id):
             return render_template('category_form.html', category=category, name=name)
 
         category.name = name
+        bump_catalog_version(db)
         db.commit()
         flash('Category updated successfully!', 'success')
         return redirect(url_for('categories'))
@@ -616,6 +950,7 @@ def delete_category(category_id):
         course.category_id = None
     
     db.delete(category)
+    bump_catalog_version(db)
     db.commit()
     flash('Category deleted successfully! Associated courses have been unassigned.', 'success')
     return redirect(url_for('categories'))
@@ -626,25 +961,28 @@ def delete_category(category_id):
 def bot_settings():
     """Manage bot settings"""
     db = get_db()
-    settings_keys = ['dmca_policy_text'] # Add more keys as needed
-    current_settings = {s.key: s.value for s in db.query(BotSetting).filter(BotSetting.key.in_(settings_keys)).all()}
+    settings_keys = list(settings.DEFAULTS)
 
     if request.method == 'POST':
+        rows = {s.key: s for s in db.query(BotSetting).filter(BotSetting.key.in_(settings_keys)).all()}
         for key in settings_keys:
-            if key in request.form:
-                value = request.form.get(key)
-                setting = db.query(BotSetting).filter_by(key=key).first()
-                if setting:
-                    setting.value = value
-                else:
-                    new_setting = BotSetting(key=key, value=value)
-                    db.add(new_setting)
+            if key not in request.form:
+                continue
+            value = request.form.get(key).strip()
+            if value and key in rows:
+                rows[key].value = value
+            elif value:
+                db.add(BotSetting(key=key, value=value))
+            elif key in rows:
+                # Back to the default from the environment
+                db.delete(rows[key])
+        # The bot reloads its settings when it sees the new version
+        bump_settings_version(db)
         db.commit()
-        flash('Settings updated successfully!', 'success')
-        # Re-fetch to display updated values
-        current_settings = {s.key: s.value for s in db.query(BotSetting).filter(BotSetting.key.in_(settings_keys)).all()}
-    
-    return render_template('settings.html', settings=current_settings)
+        flash('Settings updated successfully! The bot picks them up within a few seconds.', 'success')
+
+    current_settings = {s.key: s.value for s in db.query(BotSetting).filter(BotSetting.key.in_(settings_keys)).all()}
+    return render_template('settings.html', settings=current_settings, defaults=settings.DEFAULTS)
 
 # COURSE REQUEST ROUTES
 @app.route('/course-requests')
@@ -1,7 +1,7 @@
 import os
 import sys
 import asyncio
-from pyrogram import Client, filters
+from pyrogram import filters
 from pyrogram.enums import ParseMode
 from pyrogram.types import (
     InlineKeyboardMarkup, InlineKeyboardButton,
@@ -10,41 +10,95 @@ from pyrogram.types import (
 )
 import datetime
 import time
+from sqlalchemy import func
+from sqlalchemy.orm import joinedload
 
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 from config.config import (
-    API_ID, API_HASH, BOT_TOKEN, WELCOME_MESSAGE,
-    AUTO_DELETE_SECONDS, AUTO_APPROVE, BOT_PASSWORD, PAYMENT_OPTIONS
+    API_ID, API_HASH, BOT_TOKEN,
+    AUTO_DELETE_SECONDS, AUTO_APPROVE, BOT_PASSWORD,
+    BOT_METRICS_HOST, BOT_METRICS_PORT, UPI_QR_REFERENCE, PURCHASES_PAGE_SIZE
 )
-from database.models import get_db, User, Course, Payment, Log, Category, BotSetting, CourseRequest
+from database.models import get_db, User, Course, Payment, Log, Category, CourseRequest
 from utils.helpers import (
     log_action, save_payment_proof, is_valid_image,
-    is_spam, detect_duplicate_payment, format_course_info,
-    shorten_url
+    is_spam, detect_duplicate_payment, format_course_info
 )
+from bot.middleware import instrumented
+from bot.ledger import LedgerClient
+from bot.dispatcher import OrderedDispatcher
+from bot.callbacks import CallbackRouter, InvalidCallback
+from bot import recorder, ledger, diagnostics, broadcast, media, render, views, delivery, changes, outbound
+from utils import metrics, upi_qr, links, shortener, settings
 
-# Initialize the bot
-app = Client(
+# Initialize the bot (LedgerClient counts every outgoing API call, see bot/ledger.py)
+app = LedgerClient(
     "course_delivery_bot",
     api_id=API_ID,
     api_hash=API_HASH,
     bot_token=BOT_TOKEN
 )
+# Each user's updates are handled one at a time, in order (see bot/dispatcher.py)
+app.dispatcher = OrderedDispatcher(app)
 
 # User states dictionary
 user_states = {}
 
-# Callback data prefixes
-CB_COURSE = "course_"
-CB_BUY = "buy_"
-CB_PAYMENT = "payment_"
-CB_ADMIN = "admin_"
-CB_BACK = "back"
-CB_CANCEL = "cancel"
-CB_CATEGORY_SELECT = "cat_select_"       # Select a category
-CB_VIEW_CATEGORY_COURSES = "cat_courses_" # View courses in a category
-CB_BACK_TO_COURSES = "back_courses"       # Go to full course list view
-CB_SHOW_CATEGORIES_MENU = "show_cat_menu" # Go back to category list menu
+# Queue depths, read at scrape time
+metrics.gauge('bot_user_states', 'Entries in the user_states dictionary').set_function(lambda: len(user_states))
+metrics.gauge('bot_updates_queue_depth', 'Updates received but not yet routed to their user').set_function(
+    lambda: app.dispatcher.updates_queue.qsize()
+)
+metrics.gauge('bot_user_queues', 'Users with updates being handled or waiting').set_function(
+    lambda: len(app.dispatcher.user_queues)
+)
+metrics.gauge('bot_user_updates_waiting', "Updates waiting behind an earlier update of the same user").set_function(
+    lambda: app.dispatcher.pending()
+)
+metrics.gauge('bot_pending_tasks', 'Pending asyncio tasks (auto-deletes, background jobs)').set_function(
+    lambda: len(asyncio.all_tasks(app.loop))
+)
+if diagnostics.rss_bytes() is not None:
+    metrics.gauge('process_resident_memory_bytes', 'Resident memory of the bot process').set_function(diagnostics.rss_bytes)
+
+# Structures shown in memory reports (SIGUSR1 or /debug/memory, see bot/diagnostics.py)
+diagnostics.structures.update({
+    'user_states': lambda: user_states,
+    'ledger_user_calls': lambda: ledger.user_calls,
+    'ledger_over_budget': lambda: ledger.over_budget
+})
+
+# Button actions; CB_COURSE(12) gives the callback data of a button (see bot/callbacks.py)
+router = CallbackRouter()
+CB_COURSE = router.op('c', 'course', int)
+CB_BUY = router.op('b', 'buy', int)
+CB_PAYMENT = router.op('p', 'payment', str, int)        # Payment method, course id
+CB_BACK = router.op('m', 'back')
+CB_CANCEL = router.op('x', 'cancel')
+CB_VIEW_CATEGORY_COURSES = router.op('g', 'category', int) # View courses in a category
+CB_BACK_TO_COURSES = router.op('l', 'courses')          # Go to full course list view
+CB_SHOW_CATEGORIES_MENU = router.op('k', 'categories')  # Go back to category list menu
+CB_PURCHASES_AFTER = router.op('n', 'purchases_next', int, int)     # Last payment id shown, number of the next entry
+CB_PURCHASES_BEFORE = router.op('v', 'purchases_prev', int, int)   # First payment id shown, number of the previous page's first entry
+
+# Main menu keyboard rows
+MAIN_MENU_BUTTONS = [
+    ["📚 Browse Courses", "🔍 Search Courses"],
+    ["🗂️ Course Categories", "👤 My Purchases"],
+    ["✍️ Request Course", "📜 DMCA & Policy"],
+    ["❓ Help"]
+]
+MAIN_MENU_MARKUP = ReplyKeyboardMarkup(
+    [[KeyboardButton(text) for text in row] for row in MAIN_MENU_BUTTONS],
+    resize_keyboard=True
+)
+CANCEL_REQUEST_BUTTON = "❌ Cancel Request"
+
+COURSE_LIST_TEXT = "📚 Here are our available courses. Click on any course to view details:"
+
+# Button texts carry no personal data, so the traffic recorder keeps them verbatim
+recorder.known_texts.update(text for row in MAIN_MENU_BUTTONS for text in row)
+recorder.known_texts.add(CANCEL_REQUEST_BUTTON)
 
 # State enum
 class State:
@@ -85,16 +139,15 @@ async def get_or_create_user(user):
         db.add(db_user)
         db.commit()
         
-        log_action(
-            str(user.id),
-            "user_joined",
-            details=f"New user joined: {user.first_name} {user.last_name} (@{user.username})"
-        )
+        log_action(str(user.id), "user_joined")
+    elif db_user.is_blocked:
+        # They are talking to the bot again, so broadcasts can reach them
+        db_user.is_blocked = False
+        db.commit()
     
     return db_user
 
-async def get_course_list_markup():
-    """Get markup for the course list"""
+def build_course_list_markup():
     db = get_db()
     courses = db.query(Course).filter_by(is_active=True).all()
     
@@ -103,66 +156,87 @@ async def get_course_list_markup():
         keyboard.append([
             InlineKeyboardButton(
                 f"{course.title} - ₹{course.price:.2f}",
-                callback_data=f"{CB_COURSE}{course.id}"
+                callback_data=CB_COURSE(course.id)
             )
         ])
     
     # Add back button
-    keyboard.append([InlineKeyboardButton("⬅️ Back to Main Menu", callback_data=CB_BACK)])
+    keyboard.append([InlineKeyboardButton("⬅️ Back to Main Menu", callback_data=CB_BACK())])
     
     return InlineKeyboardMarkup(keyboard)
 
+async def get_course_list_markup():
+    """Get markup for the course list"""
+    return views.cached('course_list', build_course_list_markup)
+
 async def get_payment_options_markup(course_id):
     """Get markup for payment options"""
+    options = settings.payment_options()
     keyboard = []
     
-    if PAYMENT_OPTIONS['UPI']:
+    if options['UPI']:
         keyboard.append([
-            InlineKeyboardButton("UPI Payment", callback_data=f"{CB_PAYMENT}upi_{course_id}")
+            InlineKeyboardButton("UPI Payment", callback_data=CB_PAYMENT("upi", course_id))
         ])
     
-    if PAYMENT_OPTIONS['CRYPTO']:
+    if options['CRYPTO']:
         keyboard.append([
-            InlineKeyboardButton("Cryptocurrency", callback_data=f"{CB_PAYMENT}crypto_{course_id}")
+            InlineKeyboardButton("Cryptocurrency", callback_data=CB_PAYMENT("crypto", course_id))
         ])
     
-    if PAYMENT_OPTIONS['PAYPAL']:
+    if options['PAYPAL']:
         keyboard.append([
-            InlineKeyboardButton("PayPal", callback_data=f"{CB_PAYMENT}paypal_{course_id}")
+            InlineKeyboardButton("PayPal", callback_data=CB_PAYMENT("paypal", course_id))
         ])
     
-    if PAYMENT_OPTIONS['COD']:
+    if options['COD']:
         keyboard.append([
-            InlineKeyboardButton("Cash on Delivery", callback_data=f"{CB_PAYMENT}cod_{course_id}")
+            InlineKeyboardButton("Cash on Delivery", callback_data=CB_PAYMENT("cod", course_id))
         ])
     
-    if PAYMENT_OPTIONS['GIFT_CARD']:
+    if options['GIFT_CARD']:
         keyboard.append([
-            InlineKeyboardButton("Gift Card", callback_data=f"{CB_PAYMENT}gift_{course_id}")
+            InlineKeyboardButton("Gift Card", callback_data=CB_PAYMENT("gift", course_id))
         ])
     
     # Add back buttons
     keyboard.append([
-        InlineKeyboardButton("⬅️ Back to Course", callback_data=f"{CB_COURSE}{course_id}")
+        InlineKeyboardButton("⬅️ Back to Course", callback_data=CB_COURSE(course_id))
     ])
     keyboard.append([
-        InlineKeyboardButton("🏠 Main Menu", callback_data=CB_BACK)
+        InlineKeyboardButton("🏠 Main Menu", callback_data=CB_BACK())
     ])
     
     return InlineKeyboardMarkup(keyboard)
 
+async def get_upi_qr(course, user):
+    """QR code for paying a course by UPI: generated for its exact price, else the course's hand-made PNG"""
+    user_states.pop(f"{user.id}_upi_reference", None)
+    if settings.payment_options()['UPI']:
+        loop = asyncio.get_running_loop()
+        try:
+            if UPI_QR_REFERENCE:
+                reference = f"C{course.id}U{user.id}T{int(time.time())}"
+                user_states[f"{user.id}_upi_reference"] = reference
+                return await loop.run_in_executor(None, upi_qr.qr_with_reference, course.price, reference, course.title)
+            return await loop.run_in_executor(None, upi_qr.qr_file, course.price)
+        except Exception as e:
+            print(f"Error generating UPI QR code: {e}")
+
+    if course.qr_code_image:
+        qr_image_path = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "qr", course.qr_code_image)
+        if os.path.exists(qr_image_path):
+            return qr_image_path
+        print(f"QR Code image not found: {qr_image_path}")
+    return None
+
 async def get_main_menu_markup():
     """Get markup for the main menu"""
-    keyboard = [
-        [KeyboardButton("📚 Browse Courses"), KeyboardButton("🔍 Search Courses")],
-        [KeyboardButton("🗂️ Course Categories"), KeyboardButton("👤 My Purchases")],
-        [KeyboardButton("✍️ Request Course"), KeyboardButton("📜 DMCA & Policy")],
-        [KeyboardButton("❓ Help")]
-    ]
-    return ReplyKeyboardMarkup(keyboard, resize_keyboard=True)
+    return MAIN_MENU_MARKUP
 
 # Command handlers
 @app.on_message(filters.command("start"))
+@instrumented
 async def start_command(client, message):
     """Handle /start command"""
     user = message.from_user
@@ -175,7 +249,7 @@ async def start_command(client, message):
         await message.reply(welcome_msg, quote=True)
     else:
         user_states[user.id] = State.IDLE
-        welcome_msg = f"👋 {WELCOME_MESSAGE}\n\nUse the buttons below to navigate."
+        welcome_msg = f"👋 {settings.get('welcome_message')}\n\nUse the buttons below to navigate."
         reply = await message.reply(
             welcome_msg,
             quote=True,
@@ -185,6 +259,7 @@ async def start_command(client, message):
     log_action(str(user.id), "command_start")
 
 @app.on_message(filters.command("courses"))
+@instrumented
 async def courses_command(client, message):
     """Handle /courses command"""
     user = message.from_user
@@ -197,7 +272,7 @@ async def courses_command(client, message):
     user_states[user.id] = State.VIEWING_COURSES
     
     reply = await message.reply(
-        "📚 Here are our available courses. Click on any course to view details:",
+        COURSE_LIST_TEXT,
         quote=True,
         reply_markup=await get_course_list_markup()
     )
@@ -206,6 +281,7 @@ async def courses_command(client, message):
     asyncio.create_task(delete_after_delay(reply))
 
 @app.on_message(filters.command("help"))
+@instrumented
 async def help_command(client, message):
     """Handle /help command"""
     user = message.from_user
@@ -238,6 +314,7 @@ async def help_command(client, message):
 
 # Add a search command
 @app.on_message(filters.command("search"))
+@instrumented
 async def search_command(client, message):
     """Handle /search command"""
     user = message.from_user
@@ -257,117 +334,98 @@ async def search_command(client, message):
 
 # Callback query handlers
 @app.on_callback_query()
+@instrumented
 async def handle_callback(client, callback_query):
-    """Handle callback queries from inline buttons"""
-    user = callback_query.from_user
-    data = callback_query.data
-    message = callback_query.message
-    
-    # Course selection
-    if data.startswith(CB_COURSE):
-        course_id = int(data[len(CB_COURSE):])
-        await show_course_details(client, message, user, course_id)
-    
-    # View courses in a category (after selecting a category from category list)
-    elif data.startswith(CB_VIEW_CATEGORY_COURSES):
-        category_id = int(data[len(CB_VIEW_CATEGORY_COURSES):])
-        await show_courses_in_category(client, callback_query, user, category_id)
-    
-    # Go back to category menu
-    elif data == CB_SHOW_CATEGORIES_MENU:
-        await callback_query.message.delete()
-        mock_message_for_reply = Message(chat=callback_query.message.chat, from_user=user, message_id=0)
-        await show_categories_menu(client, mock_message_for_reply)
-
-    # Go back to all courses list
-    elif data == CB_BACK_TO_COURSES:
-        await callback_query.message.delete()
-        mock_message_for_reply = Message(chat=callback_query.message.chat, from_user=user, message_id=0)
-        await courses_command(client, mock_message_for_reply)
-    
-    # Buy now
-    elif data.startswith(CB_BUY):
-        course_id = int(data[len(CB_BUY):])
-        await show_payment_options(client, message, user, course_id)
-    
-    # Payment method selection
-    elif data.startswith(CB_PAYMENT):
-        parts = data[len(CB_PAYMENT):].split('_')
-        payment_method = parts[0]
-        course_id = int(parts[1])
-        await handle_payment_selection(client, message, user, payment_method, course_id)
-    
-    # Back to main menu
-    elif data == CB_BACK:
-        # Check if this was a message with an image
-        if message.photo:
-            # If it's a photo message, we need to delete it and send a new text message
-            await message.delete()
-            await client.send_message(
-                chat_id=message.chat.id,
-                text="🏠 Main Menu - Please use the keyboard buttons below to navigate."
-            )
-        else:
-            # Regular text message
-            await message.edit_text(
-                "🏠 Main Menu - Please use the keyboard buttons below to navigate.",
-                reply_markup=None
-            )
-        user_states[user.id] = State.IDLE
-    
-    # Cancel operation
-    elif data == CB_CANCEL:
-        # Check if this was a message with an image
-        if message.photo:
-            # If it's a photo message, we need to delete it and send a new text message
-            await message.delete()
-            await client.send_message(
-                chat_id=message.chat.id,
-                text="❌ Operation cancelled. Use /courses to browse courses or /start to begin again."
-            )
-        else:
-            # Regular text message
-            await message.edit_text(
-                "❌ Operation cancelled. Use /courses to browse courses or /start to begin again.",
-                reply_markup=None
+    """Handle callback queries from inline buttons (already answered by the middleware)"""
+    try:
+        await router.dispatch(client, callback_query)
+    except InvalidCallback as e:
+        if e.reason == 'stale':
+            # A button from before an update changed the callback format
+            await render.show(
+                client, callback_query.message,
+                "⌛ This menu is out of date. Here are our available courses:",
+                reply_markup=await get_course_list_markup()
             )
-        user_states[user.id] = State.IDLE
-    
-    # Admin actions
-    elif data.startswith(CB_ADMIN):
-        # Admin functionality will be implemented separately
-        pass
-    
-    # Acknowledge the callback
-    await callback_query.answer()
 
-async def show_course_details(client, message, user, course_id):
-    """Show course details and buy option"""
+# Course selection
+@router.route(CB_COURSE)
+async def on_course(client, callback_query, course_id):
+    await show_course_details(client, callback_query.message, callback_query.from_user, course_id)
+
+# View courses in a category (after selecting a category from category list)
+@router.route(CB_VIEW_CATEGORY_COURSES)
+async def on_category(client, callback_query, category_id):
+    await show_courses_in_category(client, callback_query, callback_query.from_user, category_id)
+
+# Go back to category menu
+@router.route(CB_SHOW_CATEGORIES_MENU)
+async def on_categories_menu(client, callback_query):
+    user = callback_query.from_user
+    text, reply_markup = await get_categories_menu()
+    if reply_markup is None:
+        # No category has courses; the reply keyboard cannot go on an edited message, so offer the way back
+        reply_markup = InlineKeyboardMarkup([[InlineKeyboardButton("⬅️ Back to Main Menu", callback_data=CB_BACK())]])
+    await render.show(client, callback_query.message, text, reply_markup=reply_markup, parse_mode=ParseMode.MARKDOWN)
+    user_states[user.id] = State.VIEWING_COURSES
+    log_action(str(user.id), "view_categories_menu")
+
+# Go back to all courses list
+@router.route(CB_BACK_TO_COURSES)
+async def on_course_list(client, callback_query):
+    user = callback_query.from_user
+    await render.show(client, callback_query.message, COURSE_LIST_TEXT, reply_markup=await get_course_list_markup())
+    user_states[user.id] = State.VIEWING_COURSES
+    log_action(str(user.id), "command_courses")
+
+# Buy now
+@router.route(CB_PURCHASES_AFTER)
+async def on_purchases_next(client, callback_query, after_id, first_number):
+    await show_purchases_page(client, callback_query, first_number, after_id=after_id)
+
+@router.route(CB_PURCHASES_BEFORE)
+async def on_purchases_previous(client, callback_query, before_id, first_number):
+    await show_purchases_page(client, callback_query, first_number, before_id=before_id)
+
+@router.route(CB_BUY)
+async def on_buy(client, callback_query, course_id):
+    await show_payment_options(client, callback_query.message, callback_query.from_user, course_id)
+
+# Payment method selection
+@router.route(CB_PAYMENT)
+async def on_payment(client, callback_query, payment_method, course_id):
+    await handle_payment_selection(client, callback_query.message, callback_query.from_user, payment_method, course_id)
+
+# Back to main menu
+@router.route(CB_BACK)
+async def on_back(client, callback_query):
+    await render.show(client, callback_query.message, "🏠 Main Menu - Please use the keyboard buttons below to navigate.")
+    user_states[callback_query.from_user.id] = State.IDLE
+
+# Cancel operation
+@router.route(CB_CANCEL)
+async def on_cancel(client, callback_query):
+    # A payment QR code must not stay on screen once the payment is cancelled
+    await render.show(
+        client, callback_query.message,
+        "❌ Operation cancelled. Use /courses to browse courses or /start to begin again.",
+        keep_photo=False
+    )
+    user_states[callback_query.from_user.id] = State.IDLE
+
+def build_course_view(course_id):
+    """Detail and payment screens of an active course, None if there is no such course"""
     db = get_db()
-    course = db.query(Course).filter_by(id=course_id, is_active=True).first()
-    
+    course = db.query(Course).options(joinedload(Course.category_obj)).filter_by(id=course_id, is_active=True).first()
     if not course:
-        if message.photo:
-            await message.delete()
-            new_message = await client.send_message(
-                chat_id=message.chat.id,
-                text="❌ Course not found or no longer available.",
-                reply_markup=await get_course_list_markup()
-            )
-            return
-        else:
-            await message.edit_text(
-                "❌ Course not found or no longer available.",
-                reply_markup=await get_course_list_markup()
-            )
-        return
-    
+        return None
+
     # Create keyboard with Buy Now button and other options
     keyboard = []
     if course.is_free:
-        keyboard.append([InlineKeyboardButton("🎁 Get Now for FREE", callback_data=f"{CB_BUY}{course.id}")])
+        keyboard.append([InlineKeyboardButton("🎁 Get Now for FREE", callback_data=CB_BUY(course.id))])
     else:
-        keyboard.append([InlineKeyboardButton("💲 Buy Now", callback_data=f"{CB_BUY}{course.id}")])
+        keyboard.append([InlineKeyboardButton("💲 Buy Now", callback_data=CB_BUY(course.id))])
     
     keyboard.append([InlineKeyboardButton("👨‍💼 Buy Directly from Admin", url=f"https://t.me/ANONYMOUS_AMIT")])
     
@@ -376,107 +434,32 @@ async def show_course_details(client, message, user, course_id):
         keyboard.append([InlineKeyboardButton("🎬 DEMO VIDEOS ✅", url=course.demo_video_link)])
 
     # Add back button
-    keyboard.append([InlineKeyboardButton("⬅️ Back to Courses", callback_data=CB_BACK)])
-    
-    reply_markup = InlineKeyboardMarkup(keyboard)
+    keyboard.append([InlineKeyboardButton("⬅️ Back to Courses", callback_data=CB_BACK())])
     
     # Format course details
     course_text = format_course_info(course)
-    
-    # Check if the course has an image
-    if course.image_link and not message.photo:
-        try:
-            # For a new image, we need to delete the old message and send a new one
-            chat_id = message.chat.id
-            message_id = message.id
-            
-            # Try to delete the original message
-            try:
-                await message.delete()
-            except Exception as e:
-                print(f"Error deleting message: {e}")
-            
-            # For local development URLs, we need a different approach
-            # Check if the URL is a local URL (contains localhost, 127.0.0.1, or specific patterns)
-            if "localhost" in course.image_link or "127.0.0.1" in course.image_link or "192.168" in course.image_link:
-                # Instead of using the URL directly, just send a message with the course info
-                await client.send_message(
-                    chat_id=chat_id,
-                    text=f"{course_text}\n\n_Note: Course image available on website_",
-                    reply_markup=reply_markup,
-                    parse_mode=ParseMode.MARKDOWN
-                )
-            else:
-                # Try to send the photo using the URL
-                try:
-                    await client.send_photo(
-                        chat_id=chat_id,
-                        photo=course.image_link,
-                        caption=course_text,
-                        reply_markup=reply_markup,
-                        parse_mode=ParseMode.MARKDOWN
-                    )
-                except Exception as e:
-                    print(f"Error sending photo, falling back to text: {e}")
-                    await client.send_message(
-                        chat_id=chat_id,
-                        text=f"{course_text}\n\n_Note: Course image available on website_",
-                        reply_markup=reply_markup,
-                        parse_mode=ParseMode.MARKDOWN
-                    )
-        except Exception as e:
-            print(f"Error in show_course_details: {e}")
-            # If any error occurs, try to update the original message
-            try:
-                await message.edit_text(
-                    course_text,
-                    reply_markup=reply_markup,
-                    parse_mode=ParseMode.MARKDOWN
-                )
-            except Exception as e2:
-                print(f"Secondary error in show_course_details: {e2}")
-    else:
-        # If no image or already showing an image, just update the text
-        try:
-            await message.edit_text(
-                course_text,
-                reply_markup=reply_markup,
-                parse_mode=ParseMode.MARKDOWN
-            )
-        except Exception as e:
-            print(f"Error updating message: {e}")
-    
-    user_states[user.id] = State.VIEWING_COURSES
-    log_action(str(user.id), "view_course", details=f"Viewed course: {course.title}")
+    note_text = f"{course_text}\n\n_Note: Course image available on website_"
+    # Admin uploads are sent from disk and every image only once; later sends
+    # reuse Telegram's file_id (see bot/media.py)
+    photo = course.image_link if course.image_link and media.can_send(course.image_link) else None
+    details = views.Screen(
+        course_text if photo or not course.image_link else note_text,
+        ParseMode.MARKDOWN,
+        InlineKeyboardMarkup(keyboard)
+    )
 
-async def show_payment_options(client, message, user, course_id):
-    """Show payment options for a course"""
-    db = get_db()
-    course = db.query(Course).filter_by(id=course_id, is_active=True).first()
-    
-    if not course:
-        if message.photo:
-            await message.delete()
-            new_message = await client.send_message(
-                chat_id=message.chat.id,
-                text="❌ Course not found or no longer available.",
-                reply_markup=await get_course_list_markup()
-            )
-            return
-        else:
-            await message.edit_text(
-                "❌ Course not found or no longer available.",
-                reply_markup=await get_course_list_markup()
-            )
-        return
-    
-    if course.is_free:
-        # If course is free, directly grant access (or simulate it for now)
-        await send_course_link(client, message, user, course, is_free_course=True)
-        log_action(str(user.id), "get_free_course", details=f"Accessed free course: {course.title}")
-        user_states[user.id] = State.IDLE # Reset state
-        return
+    return views.CourseView(
+        course_id=course.id,
+        title=course.title,
+        price=course.price,
+        is_free=course.is_free,
+        photo=photo,
+        details=details,
+        note_text=note_text,
+        payment=None if course.is_free else build_payment_screen(course)
+    )
 
+def build_payment_screen(course):
     # Get course-specific payment options if available
     payment_options = []
     if course.payment_options:
@@ -484,43 +467,45 @@ async def show_payment_options(client, message, user, course_id):
     
     # If no course-specific options, use global options
     if not payment_options:
-        if PAYMENT_OPTIONS['UPI']:
+        options = settings.payment_options()
+        if options['UPI']:
             payment_options.append('upi')
-        if PAYMENT_OPTIONS['CRYPTO']:
+        if options['CRYPTO']:
             payment_options.append('crypto')
-        if PAYMENT_OPTIONS['PAYPAL']:
+        if options['PAYPAL']:
             payment_options.append('paypal')
-        if PAYMENT_OPTIONS['COD']:
+        if options['COD']:
             payment_options.append('cod')
-        if PAYMENT_OPTIONS['GIFT_CARD']:
+        if options['GIFT_CARD']:
             payment_options.append('gift')
     
+    course_id = course.id
     # Create keyboard with payment options
     keyboard = []
     
     if 'upi' in payment_options:
         keyboard.append([
-            InlineKeyboardButton("UPI Payment", callback_data=f"{CB_PAYMENT}upi_{course_id}")
+            InlineKeyboardButton("UPI Payment", callback_data=CB_PAYMENT("upi", course_id))
         ])
     
     if 'crypto' in payment_options:
         keyboard.append([
-            InlineKeyboardButton("Cryptocurrency", callback_data=f"{CB_PAYMENT}crypto_{course_id}")
+            InlineKeyboardButton("Cryptocurrency", callback_data=CB_PAYMENT("crypto", course_id))
         ])
     
     if 'paypal' in payment_options:
         keyboard.append([
-            InlineKeyboardButton("PayPal", callback_data=f"{CB_PAYMENT}paypal_{course_id}")
+            InlineKeyboardButton("PayPal", callback_data=CB_PAYMENT("paypal", course_id))
         ])
     
     if 'cod' in payment_options:
         keyboard.append([
-            InlineKeyboardButton("Cash on Delivery", callback_data=f"{CB_PAYMENT}cod_{course_id}")
+            InlineKeyboardButton("Cash on Delivery", callback_data=CB_PAYMENT("cod", course_id))
         ])
     
     if 'gift' in payment_options:
         keyboard.append([
-            InlineKeyboardButton("Gift Card", callback_data=f"{CB_PAYMENT}gift_{course_id}")
+            InlineKeyboardButton("Gift Card", callback_data=CB_PAYMENT("gift", course_id))
         ])
     
     # Add direct admin purchase option
@@ -530,38 +515,79 @@ async def show_payment_options(client, message, user, course_id):
     
     # Add back buttons
     keyboard.append([
-        InlineKeyboardButton("⬅️ Back to Course", callback_data=f"{CB_COURSE}{course_id}")
+        InlineKeyboardButton("⬅️ Back to Course", callback_data=CB_COURSE(course_id))
     ])
     keyboard.append([
-        InlineKeyboardButton("🏠 Main Menu", callback_data=CB_BACK)
+        InlineKeyboardButton("🏠 Main Menu", callback_data=CB_BACK())
     ])
     
-    reply_markup = InlineKeyboardMarkup(keyboard)
-    
     payment_text = (
         f"💰 **Payment for: {course.title}**\n\n"
         f"💵 Amount: ₹{course.price:.2f}\n\n"
         f"Please select your preferred payment method:\n\n"
         f"_Note: For faster processing, you can buy directly from our admin._"
     )
+    return views.Screen(payment_text, ParseMode.MARKDOWN, InlineKeyboardMarkup(keyboard))
+
+def get_course_view(course_id):
+    return views.cached(('course', course_id), lambda: build_course_view(course_id))
+
+async def show_course_details(client, message, user, course_id):
+    """Show course details and buy option"""
+    view = get_course_view(course_id)
     
-    if message.photo:
-        await message.delete()
-        new_message = await client.send_message(
-            chat_id=message.chat.id,
-            text=payment_text,
-            reply_markup=reply_markup,
-            parse_mode=ParseMode.MARKDOWN
+    if not view:
+        await render.show(
+            client, message,
+            "❌ Course not found or no longer available.",
+            reply_markup=await get_course_list_markup()
         )
-    else:
-        await message.edit_text(
-            payment_text,
-            reply_markup=reply_markup,
-            parse_mode=ParseMode.MARKDOWN
+        return
+    
+    try:
+        await render.show(
+            client, message,
+            view.details.text,
+            photo=view.photo,
+            reply_markup=view.details.reply_markup,
+            parse_mode=view.details.parse_mode,
+            fallback_text=view.note_text
+        )
+    except Exception as e:
+        print(f"Error in show_course_details: {e}")
+    
+    user_states[user.id] = State.VIEWING_COURSES
+    log_action(str(user.id), "view_course", course_id=view.course_id)
+
+async def show_payment_options(client, message, user, course_id):
+    """Show payment options for a course"""
+    view = get_course_view(course_id)
+    
+    if not view:
+        await render.show(
+            client, message,
+            "❌ Course not found or no longer available.",
+            reply_markup=await get_course_list_markup()
         )
+        return
+    
+    if view.is_free:
+        # If course is free, directly grant access (or simulate it for now)
+        course = get_db().query(Course).filter_by(id=course_id).first()
+        await send_course_link(client, message, user, course, is_free_course=True)
+        log_action(str(user.id), "get_free_course", course_id=course.id)
+        user_states[user.id] = State.IDLE # Reset state
+        return
+
+    await render.show(
+        client, message,
+        view.payment.text,
+        reply_markup=view.payment.reply_markup,
+        parse_mode=view.payment.parse_mode
+    )
     
     user_states[user.id] = State.SELECTING_PAYMENT
-    log_action(str(user.id), "select_payment", details=f"Selected payment for: {course.title}")
+    log_action(str(user.id), "select_payment", course_id=view.course_id)
 
 async def handle_payment_selection(client, message, user, payment_method, course_id):
     """Handle payment method selection"""
@@ -569,79 +595,51 @@ async def handle_payment_selection(client, message, user, payment_method, course
     course = db.query(Course).filter_by(id=course_id, is_active=True).first()
     
     if not course:
-        if message.photo:
-            await message.delete()
-            await client.send_message(
-                chat_id=message.chat.id,
-                text="❌ Course not found or no longer available.",
-                reply_markup=await get_course_list_markup()
-            )
-        else:
-            await message.edit_text(
-                "❌ Course not found or no longer available.",
-                reply_markup=await get_course_list_markup()
-            )
+        await render.show(
+            client, message,
+            "❌ Course not found or no longer available.",
+            reply_markup=await get_course_list_markup()
+        )
         return
     
     # Get payment details based on method
+    options = settings.payment_options()
     payment_details = ""
-    qr_image_path = None
+    qr_image = None
 
     if payment_method == "upi":
-        payment_details = f"UPI ID: {PAYMENT_OPTIONS['UPI']}"
-        if course.qr_code_image:
-            qr_image_path = os.path.join("qr", course.qr_code_image) # Assuming qr codes are in qr/ directory relative to bot.py
-            if not os.path.exists(qr_image_path):
-                qr_image_path = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "qr", course.qr_code_image) # adjust path if bot.py is in a subdir
-                if not os.path.exists(qr_image_path):
-                    print(f"QR Code image not found: {qr_image_path}") # Log if not found
-                    qr_image_path = None # Reset if still not found
+        payment_details = f"UPI ID: {options['UPI']}"
+        qr_image = await get_upi_qr(course, user)
     elif payment_method == "crypto":
-        payment_details = f"Crypto Address: {PAYMENT_OPTIONS['CRYPTO']}"
+        payment_details = f"Crypto Address: {options['CRYPTO']}"
     elif payment_method == "paypal":
-        payment_details = f"PayPal: {PAYMENT_OPTIONS['PAYPAL']}"
+        payment_details = f"PayPal: {options['PAYPAL']}"
     elif payment_method == "cod":
         payment_details = f"Cash on Delivery: Please provide your address."
     elif payment_method == "gift":
         # Special handling for gift cards
-        if message.photo:
-            await message.delete()
-            await client.send_message(
-                chat_id=message.chat.id,
-                text=f"💳 **Gift Card Redemption**\n\n"
-                     f"You've selected to pay with a gift card for: **{course.title}**\n\n"
-                     f"💰 **Amount:** ₹{course.price:.2f}\n\n"
-                     f"Please enter your gift card code. We accept Amazon, Google Play, and other popular gift cards.\n\n"
-                     f"_Note: Gift card redemption is subject to manual verification and may take up to 24 hours._",
-                reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("❌ Cancel", callback_data=CB_CANCEL)]]),
-                parse_mode=ParseMode.MARKDOWN
-            )
-        else:
-            await message.edit_text(
-                f"💳 **Gift Card Redemption**\n\n"
-                f"You've selected to pay with a gift card for: **{course.title}**\n\n"
-                f"💰 **Amount:** ₹{course.price:.2f}\n\n"
-                f"Please enter your gift card code. We accept Amazon, Google Play, and other popular gift cards.\n\n"
-                f"_Note: Gift card redemption is subject to manual verification and may take up to 24 hours._",
-                reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("❌ Cancel", callback_data=CB_CANCEL)]]),
-                parse_mode=ParseMode.MARKDOWN
-            )
+        await render.show(
+            client, message,
+            f"💳 **Gift Card Redemption**\n\n"
+            f"You've selected to pay with a gift card for: **{course.title}**\n\n"
+            f"💰 **Amount:** ₹{course.price:.2f}\n\n"
+            f"Please enter your gift card code. We accept Amazon, Google Play, and other popular gift cards.\n\n"
+            f"_Note: Gift card redemption is subject to manual verification and may take up to 24 hours._",
+            reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("❌ Cancel", callback_data=CB_CANCEL())]]),
+            parse_mode=ParseMode.MARKDOWN
+        )
         
         # Set user state for awaiting gift code
         user_states[user.id] = State.ENTERING_GIFT_CODE
         user_states[f"{user.id}_course"] = course_id
         user_states[f"{user.id}_payment_method"] = payment_method
         
-        log_action(
-            str(user.id),
-            "gift_card_selected",
-            details=f"Selected gift card payment for course: {course.title}"
-        )
+        log_action(str(user.id), "gift_card_selected", course_id=course.id)
         return
     
     # Create keyboard with cancel button
     keyboard = [
-        [InlineKeyboardButton("❌ Cancel", callback_data=CB_CANCEL)]
+        [InlineKeyboardButton("❌ Cancel", callback_data=CB_CANCEL())]
     ]
     reply_markup = InlineKeyboardMarkup(keyboard)
     
@@ -659,52 +657,18 @@ async def handle_payment_selection(client, message, user, payment_method, course
         f"Once verified, you'll receive access to the course."
     )
     
-    if message.photo:
-        await message.delete()
-        # Send QR code first if available
-        if qr_image_path:
-            try:
-                await client.send_photo(
-                    chat_id=message.chat.id,
-                    photo=qr_image_path,
-                    caption=f"Scan this QR Code for UPI Payment (₹{course.price:.2f})"
-                )
-            except Exception as e:
-                print(f"Error sending QR photo: {e}")
-                # Fallback to text if photo send fails
-                payment_instructions = f"{payment_instructions}\n\n(QR code image for {course.price:.2f} was intended here but failed to send)"
-
-        await client.send_message(
-            chat_id=message.chat.id,
-            text=payment_instructions,
-            reply_markup=reply_markup,
-            parse_mode=ParseMode.MARKDOWN
-        )
-    else:
-        # Send QR code first if available
-        if qr_image_path:
-            try:
-                await client.send_photo(
-                    chat_id=message.chat.id,
-                    photo=qr_image_path,
-                    caption=f"Scan this QR Code for UPI Payment (₹{course.price:.2f})"
-                )
-            except Exception as e:
-                print(f"Error sending QR photo: {e}")
-                # Fallback to text if photo send fails
-                payment_instructions = f"{payment_instructions}\n\n(QR code image for {course.price:.2f} was intended here but failed to send)"
-
-        await message.edit_text(
-            payment_instructions,
-            reply_markup=reply_markup,
-            parse_mode=ParseMode.MARKDOWN
-        )
-    
-    log_action(
-        str(user.id),
-        "payment_method_selected",
-        details=f"Selected {payment_method} for course: {course.title}"
+    # The QR code and the instructions are one photo message, so coming from
+    # the course's photo it replaces the photo in a single call
+    await render.show(
+        client, message,
+        f"{payment_instructions}\n\n📷 Scan this QR code to pay ₹{course.price:.2f} by UPI." if qr_image else payment_instructions,
+        photo=qr_image,
+        reply_markup=reply_markup,
+        parse_mode=ParseMode.MARKDOWN,
+        fallback_text=f"{payment_instructions}\n\n(QR code image for {course.price:.2f} was intended here but failed to send)"
     )
+    
+    log_action(str(user.id), "payment_method_selected", details=payment_method, course_id=course.id)
 
 async def handle_gift_code(client, message, user, gift_code):
     """Handle gift card code submission"""
@@ -778,14 +742,11 @@ async def handle_gift_code(client, message, user, gift_code):
     if f"{user.id}_payment_method" in user_states:
         del user_states[f"{user.id}_payment_method"]
     
-    log_action(
-        str(user.id),
-        "gift_card_submitted",
-        details=f"Submitted gift card for course: {course.title}"
-    )
+    log_action(str(user.id), "gift_card_submitted", course_id=course.id, payment_id=payment.id)
 
 # Handle text messages (for password and other text inputs)
 @app.on_message(filters.text)
+@instrumented
 async def handle_text(client, message):
     """Handle text messages"""
     user = message.from_user
@@ -799,7 +760,7 @@ async def handle_text(client, message):
     if user.id in user_states and user_states[user.id] == State.AWAITING_PASSWORD:
         if text == BOT_PASSWORD:
             user_states[user.id] = State.IDLE
-            welcome_msg = f"✅ Password correct!\n\n👋 {WELCOME_MESSAGE}\n\nUse the buttons below to navigate."
+            welcome_msg = f"✅ Password correct!\n\n👋 {settings.get('welcome_message')}\n\nUse the buttons below to navigate."
             await message.reply(
                 welcome_msg,
                 quote=True,
@@ -862,40 +823,79 @@ async def handle_text(client, message):
             quote=True
         )
 
+async def show_purchases_page(client, callback_query, first_number, after_id=0, before_id=None):
+    """Turn the purchases message into another page"""
+    page = await build_purchases_page(callback_query.from_user.id, first_number, after_id, before_id)
+    if page is None:
+        return
+    text, reply_markup = page
+    # Edited directly rather than through render.show, which does not turn off link previews
+    await callback_query.message.edit_text(text, reply_markup=reply_markup, disable_web_page_preview=True)
+
+def load_purchases_page(telegram_id, after_id=0, before_id=None):
+    """One page of a user's approved purchases, oldest first, from a single joined query.
+
+    Pages are keyed by payment id (the rows after after_id, or before
+    before_id) instead of an offset, so later pages are as cheap as the first.
+    Returns (rows, has_previous, has_next).
+    """
+    query = get_db().query(
+        Payment.id.label('payment_id'), Payment.amount, Payment.approval_date,
+        Course.id.label('course_id'), Course.title, Course.file_link
+    ).join(Course, Payment.course_id == Course.id).join(User, Payment.user_id == User.id).filter(
+        User.telegram_id == str(telegram_id),
+        Payment.status == 'approved'
+    )
+    if before_id is not None:
+        rows = query.filter(Payment.id < before_id).order_by(Payment.id.desc()).limit(PURCHASES_PAGE_SIZE + 1).all()
+        return rows[:PURCHASES_PAGE_SIZE][::-1], len(rows) > PURCHASES_PAGE_SIZE, True
+    rows = query.filter(Payment.id > after_id).order_by(Payment.id).limit(PURCHASES_PAGE_SIZE + 1).all()
+    return rows[:PURCHASES_PAGE_SIZE], after_id > 0, len(rows) > PURCHASES_PAGE_SIZE
+
+async def build_purchases_page(telegram_id, first_number=1, after_id=0, before_id=None):
+    """(text, reply_markup) of a page of purchases numbered from first_number, or None if it is empty"""
+    rows, has_previous, has_next = load_purchases_page(telegram_id, after_id, before_id)
+    if not rows:
+        return None
+    course_links = await get_course_links(telegram_id, rows)
+    
+    entries = [
+        f"{number}. **{row.title}**\n"
+        f"   💰 Price: ₹{row.amount:.2f}\n"
+        f"   📅 Purchased: {row.approval_date.strftime('%Y-%m-%d')}\n"
+        f"   🔗 [Access Course]({link})\n"
+        for number, (row, link) in enumerate(zip(rows, course_links), first_number)
+    ]
+    text = "🛒 **Your Purchases:**\n\n" + "\n".join(entries)
+    
+    buttons = []
+    if has_previous:
+        buttons.append(InlineKeyboardButton(
+            "◀️ Previous", callback_data=CB_PURCHASES_BEFORE(rows[0].payment_id, max(first_number - PURCHASES_PAGE_SIZE, 1))
+        ))
+    if has_next:
+        buttons.append(InlineKeyboardButton(
+            "Next ▶️", callback_data=CB_PURCHASES_AFTER(rows[-1].payment_id, first_number + len(rows))
+        ))
+    return text, InlineKeyboardMarkup([buttons]) if buttons else None
+
 async def show_purchases(client, message):
-    """Show user's purchases"""
+    """Show the first page of the user's purchases"""
     user = message.from_user
-    db = get_db()
-    db_user = await get_or_create_user(user)
-    
-    # Get approved payments
-    payments = db.query(Payment).filter_by(
-        user_id=db_user.id,
-        status='approved'
-    ).all()
+    page = await build_purchases_page(user.id)
     
-    if not payments:
+    if page is None:
         await message.reply(
             "You haven't purchased any courses yet. Use /courses to browse available courses.",
             quote=True
         )
         return
     
-    purchases_text = "🛒 **Your Purchases:**\n\n"
-    
-    for i, payment in enumerate(payments, 1):
-        course = db.query(Course).filter_by(id=payment.course_id).first()
-        if course:
-            purchases_text += (
-                f"{i}. **{course.title}**\n"
-                f"   💰 Price: ₹{payment.amount:.2f}\n"
-                f"   📅 Purchased: {payment.approval_date.strftime('%Y-%m-%d')}\n"
-                f"   🔗 [Access Course]({shorten_url(course.file_link)})\n\n"
-            )
-    
+    text, reply_markup = page
     await message.reply(
-        purchases_text,
+        text,
         quote=True,
+        reply_markup=reply_markup,
         disable_web_page_preview=True
     )
     
@@ -903,6 +903,7 @@ async def show_purchases(client, message):
 
 # Handle photo messages (payment proofs)
 @app.on_message(filters.photo)
+@instrumented
 async def handle_photo(client, message):
     """Handle photo uploads (payment proofs)"""
     user = message.from_user
@@ -966,6 +967,7 @@ async def handle_photo(client, message):
         return
     
     # Create payment record
+    upi_reference = user_states.pop(f"{user.id}_upi_reference", None)
     payment = Payment(
         user_id=db_user.id,
         course_id=course.id,
@@ -974,7 +976,8 @@ async def handle_photo(client, message):
         amount=course.price,
         status='pending',
         submission_date=datetime.datetime.now(datetime.UTC),
-        ip_address=None  # We don't have IP in Telegram
+        ip_address=None,  # We don't have IP in Telegram
+        details=f"UPI reference: {upi_reference}" if upi_reference else None
     )
     db.add(payment)
     db.commit()
@@ -987,13 +990,9 @@ async def handle_photo(client, message):
         db.commit()
         
         # Send course link
-        await send_course_link(client, message, user, course)
+        await send_course_link(client, message, user, course, payment_id=payment.id)
         
-        log_action(
-            str(user.id),
-            "payment_auto_approved",
-            details=f"Auto-approved payment for course: {course.title}"
-        )
+        log_action(str(user.id), "payment_auto_approved", course_id=course.id, payment_id=payment.id)
     else:
         # Manual verification needed
         await message.reply(
@@ -1002,11 +1001,7 @@ async def handle_photo(client, message):
             quote=True
         )
         
-        log_action(
-            str(user.id),
-            "payment_submitted",
-            details=f"Submitted payment for course: {course.title}"
-        )
+        log_action(str(user.id), "payment_submitted", course_id=course.id, payment_id=payment.id)
     
     # Reset user state
     user_states[user.id] = State.IDLE
@@ -1015,10 +1010,30 @@ async def handle_photo(client, message):
     if f"{user.id}_payment_method" in user_states:
         del user_states[f"{user.id}_payment_method"]
 
-async def send_course_link(client, message, user, course, is_free_course=False):
-    """Send course link to the user"""
-    # Shorten the link for security
-    short_link = shorten_url(course.file_link)
+async def get_course_link(telegram_id, course, payment_id=None):
+    """Link the bot hands out for a course: signed and expiring when the dashboard serves /l/ links"""
+    if links.enabled():
+        return links.course_url(telegram_id, course.id, payment_id)
+    # Shorten the link for security; falls back to the link itself if the shortener is slow or down
+    return await shortener.shorten(course.file_link)
+
+async def get_course_links(telegram_id, purchases):
+    """Links for purchase rows (payment_id, course_id, file_link), in order, resolved in one batch"""
+    if links.enabled():
+        return [links.course_url(telegram_id, row.course_id, row.payment_id) for row in purchases]
+    short = await shortener.shorten_many([row.file_link for row in purchases])
+    return [short[row.file_link] for row in purchases]
+
+async def send_course_link(client, message, user, course, is_free_course=False, payment_id=None):
+    """Send course link to the user in reply to message, followed by the course's files if it has any"""
+    await deliver_course(client, message.chat.id, user.id, course, is_free_course, payment_id, reply_to_message_id=message.id)
+
+async def deliver_course(client, chat_id, telegram_id, course, is_free_course=False, payment_id=None, reply_to_message_id=None):
+    """Send a course's link and files to a chat, also outside of a conversation (approvals from the dashboard)"""
+    short_link = await get_course_link(telegram_id, course, payment_id)
+    # Only promise files that can actually be sent
+    files = [f for f in delivery.course_files(course.id) if delivery.deliverable(f)]
+    files_note = "📎 The course files follow below.\n\n" if files else ""
     
     if is_free_course:
         course_access_message = (
@@ -1026,6 +1041,7 @@ async def send_course_link(client, message, user, course, is_free_course=False):
             f"You now have access to: **{course.title}**\n\n"
             f"🔗 **Access your course here:**\n"
             f"[Course Link]({short_link})\n\n"
+            f"{files_note}"
             f"Enjoy your learning!"
         )
     else:
@@ -1034,14 +1050,26 @@ async def send_course_link(client, message, user, course, is_free_course=False):
             f"You now have access to: **{course.title}**\n\n"
             f"🔗 **Access your course here:**\n"
             f"[Course Link]({short_link})\n\n"
+            f"{files_note}"
             f"Thank you for your purchase! If you have any questions or issues, please contact support."
         )
     
-    await message.reply(
+    await client.send_message(
+        chat_id,
         course_access_message,
-        quote=True,
+        reply_to_message_id=reply_to_message_id,
         disable_web_page_preview=True
     )
+    
+    if files:
+        try:
+            await delivery.send_files(client, chat_id, files)
+        except Exception as e:
+            print(f"Error sending files of course {course.id}: {e}")
+            await client.send_message(
+                chat_id,
+                "⚠️ The course files could not be sent right now. Please use the course link above or contact support."
+            )
 
 async def handle_course_search(client, message, user, query):
     """Handle course search by name or category"""
@@ -1070,12 +1098,12 @@ async def handle_course_search(client, message, user, query):
         keyboard.append([
             InlineKeyboardButton(
                 f"{course.title} - ₹{course.price:.2f}",
-                callback_data=f"{CB_COURSE}{course.id}"
+                callback_data=CB_COURSE(course.id)
             )
         ])
     
     # Add back button
-    keyboard.append([InlineKeyboardButton("🏠 Main Menu", callback_data=CB_BACK)])
+    keyboard.append([InlineKeyboardButton("🏠 Main Menu", callback_data=CB_BACK())])
     
     reply_markup = InlineKeyboardMarkup(keyboard)
     
@@ -1088,42 +1116,40 @@ async def handle_course_search(client, message, user, query):
     user_states[user.id] = State.VIEWING_COURSES
     log_action(str(user.id), "search_courses", details=f"Searched for: {query}, Found: {len(courses)} courses")
 
-async def show_categories_menu(client, message: Message):
-    """Display a menu of course categories."""
-    user = message.from_user
+def build_categories_menu():
+    """Category menu as (text, markup); cached per catalog version by get_categories_menu()"""
     db = get_db()
-    # Only show categories that have at least one active course associated with them
-    categories = db.query(Category).join(Category.courses).filter(Course.is_active == True).group_by(Category.id).order_by(Category.name).all()
+    # Categories with at least one active course and their active course counts, in one aggregate query
+    categories = db.query(Category.id, Category.name, func.count(Course.id)).join(
+        Course, Course.category_id == Category.id
+    ).filter(Course.is_active == True).group_by(Category.id, Category.name).order_by(Category.name).all()
 
     if not categories:
-        await message.reply(
-            "😔 No course categories are currently available. Please check back later or browse all courses.",
-            quote=True,
-            reply_markup=await get_main_menu_markup()
-        )
-        return
+        return "😔 No course categories are currently available. Please check back later or browse all courses.", None
 
-    keyboard = []
-    for cat in categories:
-        # Query count of active courses for this category
-        active_courses_count = db.query(Course).filter(Course.category_id == cat.id, Course.is_active == True).count()
-        if active_courses_count > 0: # Ensure we only show categories with active courses
-            keyboard.append([InlineKeyboardButton(f"{cat.name} ({active_courses_count})", callback_data=f"{CB_VIEW_CATEGORY_COURSES}{cat.id}")])
+    keyboard = [
+        [InlineKeyboardButton(f"{name} ({active_courses_count})", callback_data=CB_VIEW_CATEGORY_COURSES(category_id))]
+        for category_id, name, active_courses_count in categories
+    ]
+    keyboard.append([InlineKeyboardButton("📚 All Courses", callback_data=CB_BACK_TO_COURSES())])
+    keyboard.append([InlineKeyboardButton("🏠 Main Menu", callback_data=CB_BACK())])
+    return "🗂️ **Course Categories**\n\nSelect a category to view its courses:", InlineKeyboardMarkup(keyboard)
 
-    if not keyboard: # If all categories ended up having 0 active courses after filtering
-        await message.reply(
-            "😔 No courses are currently available in any category. Please check back later or browse all courses.",
-            quote=True,
-            reply_markup=await get_main_menu_markup()
-        )
-        return
+async def get_categories_menu():
+    """Text and markup of the category menu; the markup is None when no category has active courses"""
+    return views.cached('categories', build_categories_menu)
 
-    keyboard.append([InlineKeyboardButton("📚 All Courses", callback_data=CB_BACK_TO_COURSES)])
-    keyboard.append([InlineKeyboardButton("🏠 Main Menu", callback_data=CB_BACK)])
-    reply_markup = InlineKeyboardMarkup(keyboard)
+async def show_categories_menu(client, message: Message):
+    """Display a menu of course categories."""
+    user = message.from_user
+    text, reply_markup = await get_categories_menu()
+
+    if reply_markup is None:
+        await message.reply(text, quote=True, reply_markup=await get_main_menu_markup())
+        return
 
     await message.reply(
-        "🗂️ **Course Categories**\n\nSelect a category to view its courses:",
+        text,
         quote=True,
         reply_markup=reply_markup,
         parse_mode=ParseMode.MARKDOWN
@@ -1131,28 +1157,25 @@ async def show_categories_menu(client, message: Message):
     user_states[user.id] = State.VIEWING_COURSES 
     log_action(str(user.id), "view_categories_menu")
 
-async def show_courses_in_category(client, callback_query: CallbackQuery, user, category_id):
-    """Display courses within a selected category."""
-    message = callback_query.message # Get message from callback_query
+def build_category_screen(category_id):
+    """Course list of a category, None if there is no such category"""
     db = get_db()
     category = db.query(Category).filter_by(id=category_id).first()
     
     if not category:
-        await message.edit_text("❌ Category not found.", reply_markup=await get_main_menu_markup())
-        return
+        return None
 
     courses = db.query(Course).filter_by(category_id=category_id, is_active=True).order_by(Course.title).all()
 
     if not courses:
-        await message.edit_text(
+        return views.Screen(
             f"😔 No active courses found in the category: **{category.name}**.",
-            reply_markup=InlineKeyboardMarkup([
-                [InlineKeyboardButton("⬅️ Back to Categories", callback_data=CB_SHOW_CATEGORIES_MENU)],
-                [InlineKeyboardButton("🏠 Main Menu", callback_data=CB_BACK)]
-            ]),
-            parse_mode=ParseMode.MARKDOWN
+            ParseMode.MARKDOWN,
+            InlineKeyboardMarkup([
+                [InlineKeyboardButton("⬅️ Back to Categories", callback_data=CB_SHOW_CATEGORIES_MENU())],
+                [InlineKeyboardButton("🏠 Main Menu", callback_data=CB_BACK())]
+            ])
         )
-        return
 
     keyboard = []
     for course in courses:
@@ -1160,31 +1183,36 @@ async def show_courses_in_category(client, callback_query: CallbackQuery, user,
         keyboard.append([
             InlineKeyboardButton(
                 f"{course.title} - {price_display}",
-                callback_data=f"{CB_COURSE}{course.id}"
+                callback_data=CB_COURSE(course.id)
             )
         ])
     
-    keyboard.append([InlineKeyboardButton("⬅️ Back to Categories", callback_data=CB_SHOW_CATEGORIES_MENU)])
-    keyboard.append([InlineKeyboardButton("🏠 Main Menu", callback_data=CB_BACK)])
-    reply_markup = InlineKeyboardMarkup(keyboard)
+    keyboard.append([InlineKeyboardButton("⬅️ Back to Categories", callback_data=CB_SHOW_CATEGORIES_MENU())])
+    keyboard.append([InlineKeyboardButton("🏠 Main Menu", callback_data=CB_BACK())])
 
-    await message.edit_text(
+    return views.Screen(
         f"📚 Courses in **{category.name}**:\n\nTap on a course to view details:",
-        reply_markup=reply_markup,
-        parse_mode=ParseMode.MARKDOWN
+        ParseMode.MARKDOWN,
+        InlineKeyboardMarkup(keyboard)
     )
+
+async def show_courses_in_category(client, callback_query: CallbackQuery, user, category_id):
+    """Display courses within a selected category."""
+    message = callback_query.message # Get message from callback_query
+    screen = views.cached(('category', category_id), lambda: build_category_screen(category_id))
+    
+    if not screen:
+        await render.show(client, message, "❌ Category not found.", reply_markup=await get_main_menu_markup())
+        return
+
+    await render.show(client, message, screen.text, reply_markup=screen.reply_markup, parse_mode=screen.parse_mode)
     user_states[user.id] = State.VIEWING_COURSES
-    log_action(str(user.id), "view_category_courses", details=f"Category: {category.name}")
+    log_action(str(user.id), "view_category_courses", category_id=category_id)
 
 async def show_dmca_policy(client, message: Message):
     """Display the DMCA & Copyright Policy."""
     user = message.from_user
-    db = get_db()
-    policy_setting = db.query(BotSetting).filter_by(key='dmca_policy_text').first()
-
-    policy_text = "No DMCA/Policy text has been set by the admin yet."
-    if policy_setting and policy_setting.value:
-        policy_text = policy_setting.value
+    policy_text = settings.get('dmca_policy_text') or "No DMCA/Policy text has been set by the admin yet."
 
     await message.reply(
         f"📜 **DMCA Copyright & Policy**\n\n{policy_text}",
@@ -1203,7 +1231,7 @@ async def handle_request_course_button(client, message: Message):
     await message.reply(
         "✍️ Please describe the course you would like to request. Include as much detail as possible (e.g., name, instructor, topics).",
         quote=True,
-        reply_markup=ReplyKeyboardMarkup([[KeyboardButton("❌ Cancel Request")]], resize_keyboard=True, one_time_keyboard=True)
+        reply_markup=ReplyKeyboardMarkup([[KeyboardButton(CANCEL_REQUEST_BUTTON)]], resize_keyboard=True, one_time_keyboard=True)
     )
     user_states[user.id] = State.AWAITING_COURSE_REQUEST
     log_action(str(user.id), "pressed_request_course_button")
@@ -1212,7 +1240,7 @@ async def save_course_request(client, message: Message, user_pyrogram, request_t
     """Saves the user's course request to the database."""
     db_user = await get_or_create_user(user_pyrogram) # Ensure user is in our DB
     
-    if request_text.lower() == "❌ cancel request":
+    if request_text.lower() == CANCEL_REQUEST_BUTTON.lower():
         await message.reply(
             "✅ Course request cancelled.",
             quote=True,
@@ -1239,6 +1267,104 @@ async def save_course_request(client, message: Message, user_pyrogram, request_t
     user_states[user_pyrogram.id] = State.IDLE
     log_action(str(user_pyrogram.id), "submitted_course_request", details=request_text[:200])
 
+def prewarm_upi_qr():
+    """Render the UPI QR codes of every course price so no buyer waits for one"""
+    db = get_db()
+    try:
+        prices = [price for (price,) in db.query(Course.price).filter(Course.is_active == True, Course.is_free != True).distinct()]
+    finally:
+        db.close()
+    rendered = upi_qr.prewarm(prices)
+    if rendered:
+        print(f"Pre-rendered {rendered} UPI QR codes")
+
+def broadcast_markup(course_id):
+    """Button under a broadcast that announces a course"""
+    return InlineKeyboardMarkup([[InlineKeyboardButton("📖 View Course", callback_data=CB_COURSE(course_id))]])
+
+# Changes made on the admin dashboard, handled within about a second (see bot/changes.py)
+@changes.feed.on('catalog')
+async def on_catalog_changed(client, entity_id):
+    views.invalidate()
+
+@changes.feed.on('settings')
+async def on_settings_changed(client, entity_id):
+    settings.invalidate()
+    views.invalidate()
+
+@changes.feed.on('payment_approved')
+async def on_payment_approved(client, payment_id):
+    """Send the course to the buyer of a payment approved by an admin"""
+    db = get_db()
+    try:
+        payment = db.query(Payment).options(joinedload(Payment.user), joinedload(Payment.course)).filter_by(id=payment_id).first()
+        # Rejected again since, or deleted
+        if payment is None or payment.status != 'approved':
+            return
+        telegram_id = int(payment.user.telegram_id)
+        with outbound.lane(outbound.NOTIFICATION):
+            await deliver_course(client, telegram_id, telegram_id, payment.course, payment_id=payment.id)
+        log_action(str(telegram_id), "payment_approved", course_id=payment.course_id, payment_id=payment.id)
+    finally:
+        db.close()
+
+@changes.feed.on('payment_rejected')
+async def on_payment_rejected(client, payment_id):
+    db = get_db()
+    try:
+        payment = db.query(Payment).options(joinedload(Payment.user), joinedload(Payment.course)).filter_by(id=payment_id).first()
+        if payment is None or payment.status != 'rejected':
+            return
+        with outbound.lane(outbound.NOTIFICATION):
+            await client.send_message(
+                int(payment.user.telegram_id),
+                f"❌ Your payment for **{payment.course.title}** could not be verified. "
+                "Please contact support if you think this is a mistake."
+            )
+    finally:
+        db.close()
+
+@changes.feed.on('user_banned')
+async def on_user_banned(client, user_id):
+    """Drop whatever a banned user was in the middle of"""
+    db = get_db()
+    try:
+        user = db.query(User.telegram_id).filter_by(id=user_id).first()
+    finally:
+        db.close()
+    if user is not None:
+        telegram_id = int(user.telegram_id)
+        for key in (telegram_id, f"{telegram_id}_course", f"{telegram_id}_payment_method", f"{telegram_id}_upi_reference"):
+            user_states.pop(key, None)
+
+@changes.feed.on('user_unbanned')
+async def on_user_unbanned(client, user_id):
+    """Tell a user they can use the bot again"""
+    db = get_db()
+    try:
+        user = db.query(User.telegram_id, User.is_banned).filter_by(id=user_id).first()
+    finally:
+        db.close()
+    # Banned again since
+    if user is None or user.is_banned:
+        return
+    with outbound.lane(outbound.NOTIFICATION):
+        await client.send_message(int(user.telegram_id), "✅ Your access to the bot has been restored. Send /start to continue.")
+
+@changes.feed.on('broadcast')
+async def on_broadcast_started(client, broadcast_id):
+    broadcast.wake()
+
+def run():
+    """Start the bot's background services and run the bot"""
+    if BOT_METRICS_PORT:
+        metrics.start_http_server(BOT_METRICS_PORT, BOT_METRICS_HOST)
+    diagnostics.install(app.loop)
+    broadcast.install(app, broadcast_markup)
+    changes.install(app)
+    app.loop.run_in_executor(None, prewarm_upi_qr)
+    app.run()
+
 # Main function to run the bot
 async def main():
     await app.start()
@@ -1250,4 +1376,5 @@ async def main():
     await app.stop()
 
 if __name__ == "__main__":
-    app.run() 
+    run()
+
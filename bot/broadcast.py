@@ -0,0 +1,167 @@
+import os
+import sys
+import time
+import asyncio
+import datetime
+from collections import namedtuple
+from pyrogram.enums import ParseMode
+from pyrogram.errors import UserIsBlocked, InputUserDeactivated
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from config.config import BROADCAST_BATCH_SIZE, BROADCAST_CONCURRENCY, BROADCAST_POLL_SECONDS
+from database.models import get_db, session_scope, User, Broadcast, BroadcastDelivery
+from utils import metrics
+from bot import outbound
+
+# Errors meaning the user can no longer be messaged at all. PeerIdInvalid is not
+# one of them: it also comes up when the bot's session lost the user's access hash
+UNREACHABLE_ERRORS = (UserIsBlocked, InputUserDeactivated)
+
+DELIVERIES = metrics.counter('bot_broadcast_messages_total', 'Broadcast messages by outcome', ['status'])
+
+# A batch as sent: broadcast text and course, (user id, telegram id) of each recipient, last user id covered
+Batch = namedtuple('Batch', ['text', 'course_id', 'recipients', 'last_id'])
+
+# Set by wake() to look for running broadcasts before the next poll
+_wakeup = None
+
+def recipients_query(db):
+    """Users a broadcast goes to: not banned and not known to have blocked the bot"""
+    return db.query(User).filter(User.is_banned.isnot(True), User.is_blocked.isnot(True))
+
+def next_batch(db, broadcast, batch_size=BROADCAST_BATCH_SIZE):
+    """Next recipients after the broadcast's cursor, without those already delivered to"""
+    users = recipients_query(db).filter(User.id > broadcast.last_user_id).order_by(User.id).limit(batch_size).all()
+    if not users:
+        return users, None
+    last_id = users[-1].id
+    # Only after a crash between sending and recording a batch can some have deliveries already
+    done = {user_id for (user_id,) in db.query(BroadcastDelivery.user_id).filter(
+        BroadcastDelivery.broadcast_id == broadcast.id,
+        BroadcastDelivery.user_id > broadcast.last_user_id,
+        BroadcastDelivery.user_id <= last_id
+    )}
+    return [user for user in users if user.id not in done], last_id
+
+async def send_one(client, text, telegram_id, reply_markup, semaphore):
+    """Send the broadcast to one user; returns (status, error)"""
+    async with semaphore:
+        try:
+            with outbound.lane(outbound.BROADCAST):
+                await client.send_message(
+                    chat_id=int(telegram_id),
+                    text=text,
+                    reply_markup=reply_markup,
+                    parse_mode=ParseMode.MARKDOWN
+                )
+            return 'sent', None
+        except UNREACHABLE_ERRORS as e:
+            return 'blocked', type(e).__name__
+        except Exception as e:
+            return 'failed', str(e)[:255]
+
+def load_batch(broadcast_id):
+    """Next batch of a running broadcast; None when it is done, paused or cancelled.
+
+    Only plain values leave the session, so no connection is held while the
+    batch is sent.
+    """
+    with session_scope():
+        db = get_db()
+        broadcast = db.query(Broadcast).filter_by(id=broadcast_id).first()
+        if broadcast is None or broadcast.status != 'running':
+            return None
+        users, last_id = next_batch(db, broadcast)
+        if last_id is None:
+            broadcast.status = 'completed'
+            broadcast.finished_date = datetime.datetime.now(datetime.UTC)
+            db.commit()
+            print(f"[broadcast] Broadcast {broadcast.id} completed: {broadcast.sent_count} sent, "
+                  f"{broadcast.failed_count} failed, {broadcast.blocked_count} blocked")
+            return None
+        return Batch(broadcast.text, broadcast.course_id, [(user.id, user.telegram_id) for user in users], last_id)
+
+def record_batch(broadcast_id, batch, results, elapsed):
+    """Store the outcome of a sent batch and move the broadcast's cursor past it"""
+    now = datetime.datetime.now(datetime.UTC)
+    deliveries = []
+    blocked_ids = []
+    for (user_id, _), (status, error) in zip(batch.recipients, results):
+        deliveries.append({'broadcast_id': broadcast_id, 'user_id': user_id, 'status': status, 'error': error, 'sent_date': now})
+        if status == 'blocked':
+            blocked_ids.append(user_id)
+        DELIVERIES.labels(status).inc()
+
+    with session_scope():
+        db = get_db()
+        # Deliveries, blocked users and the cursor are committed together so a resumed broadcast picks up right here
+        if deliveries:
+            db.execute(BroadcastDelivery.__table__.insert(), deliveries)
+        if blocked_ids:
+            db.query(User).filter(User.id.in_(blocked_ids)).update({User.is_blocked: True}, synchronize_session=False)
+        broadcast = db.query(Broadcast).filter_by(id=broadcast_id).first()
+        broadcast.last_user_id = batch.last_id
+        broadcast.sent_count += sum(1 for status, _ in results if status == 'sent')
+        broadcast.failed_count += sum(1 for status, _ in results if status == 'failed')
+        broadcast.blocked_count += len(blocked_ids)
+        broadcast.updated_date = now
+        broadcast.rate = len(results) / elapsed if results and elapsed > 0 else broadcast.rate
+        db.commit()
+
+async def deliver_batch(client, broadcast_id, course_markup, semaphore):
+    """Send one batch and record it; returns False when the broadcast is done, paused or cancelled"""
+    batch = load_batch(broadcast_id)
+    if batch is None:
+        return False
+
+    reply_markup = course_markup(batch.course_id) if course_markup and batch.course_id else None
+    start = time.monotonic()
+    results = await asyncio.gather(*[
+        send_one(client, batch.text, telegram_id, reply_markup, semaphore) for _, telegram_id in batch.recipients
+    ])
+    record_batch(broadcast_id, batch, results, time.monotonic() - start)
+    return True
+
+async def run_broadcast(client, broadcast_id, course_markup=None):
+    """Deliver a broadcast batch by batch until it is done, paused or cancelled"""
+    semaphore = asyncio.Semaphore(BROADCAST_CONCURRENCY)
+    while await deliver_batch(client, broadcast_id, course_markup, semaphore):
+        pass
+
+async def run_broadcasts(client, course_markup=None, poll_seconds=BROADCAST_POLL_SECONDS):
+    """Background job of the bot: deliver running broadcasts, oldest first.
+
+    The admin panel only creates broadcasts and flips their status; pausing
+    takes effect after the current batch, and a broadcast interrupted by a
+    restart continues from its cursor.
+    """
+    global _wakeup
+    _wakeup = asyncio.Event()
+    while not client.is_connected:
+        await asyncio.sleep(1)
+    while True:
+        try:
+            with session_scope():
+                db = get_db()
+                broadcast = db.query(Broadcast).filter_by(status='running').order_by(Broadcast.id).first()
+                broadcast_id = broadcast.id if broadcast else None
+            if broadcast_id is not None:
+                print(f"[broadcast] Sending broadcast {broadcast_id}")
+                await run_broadcast(client, broadcast_id, course_markup)
+                continue
+        except Exception as e:
+            print(f"Error sending broadcast: {e}")
+        try:
+            await asyncio.wait_for(_wakeup.wait(), poll_seconds)
+        except asyncio.TimeoutError:
+            pass
+        _wakeup.clear()
+
+def wake():
+    """Look for running broadcasts now, e.g. when the admin started or resumed one"""
+    if _wakeup is not None:
+        _wakeup.set()
+
+def install(client, course_markup=None):
+    """Start the broadcast job on the client's loop"""
+    return client.loop.create_task(run_broadcasts(client, course_markup))
@@ -0,0 +1,148 @@
+import os
+import sys
+import base64
+import binascii
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from utils import metrics
+
+# First character of every payload; bump it when the meaning of opcodes or
+# arguments changes so buttons left in old messages are recognised as stale
+VERSION = '1'
+# Telegram rejects callback data longer than this (in bytes)
+MAX_DATA_BYTES = 64
+
+REJECTED = metrics.counter('bot_callbacks_rejected_total', 'Button presses whose callback data was not accepted', ['reason'])
+
+class InvalidCallback(ValueError):
+    """Callback data that is not a current, well-formed payload; reason is 'stale' or 'malformed'"""
+
+    def __init__(self, reason, data):
+        super().__init__(f"{reason} callback data: {data!r}")
+        self.reason = reason
+
+def pack_varint(value, out):
+    if value < 0:
+        raise ValueError("Callback arguments must not be negative")
+    while value >= 0x80:
+        out.append((value & 0x7f) | 0x80)
+        value >>= 7
+    out.append(value)
+
+def unpack_varint(payload, position):
+    value = shift = 0
+    while True:
+        byte = payload[position]  # IndexError on truncated payloads
+        position += 1
+        value |= (byte & 0x7f) << shift
+        if byte < 0x80:
+            return value, position
+        shift += 7
+        if shift > 63:
+            raise ValueError("Varint too long")
+
+def pack(types, args):
+    """Arguments as bytes: ints as varints, strings as length-prefixed UTF-8"""
+    if len(args) != len(types):
+        raise TypeError(f"Expected {len(types)} callback arguments, got {len(args)}")
+    out = bytearray()
+    for kind, value in zip(types, args):
+        if kind is int:
+            pack_varint(int(value), out)
+        else:
+            encoded = str(value).encode()
+            pack_varint(len(encoded), out)
+            out += encoded
+    return bytes(out)
+
+def unpack(types, payload):
+    args = []
+    position = 0
+    for kind in types:
+        value, position = unpack_varint(payload, position)
+        if kind is not int:
+            end = position + value
+            if end > len(payload):
+                raise ValueError("Truncated string")
+            value, position = payload[position:end].decode(), end
+        args.append(value)
+    if position != len(payload):
+        raise ValueError("Trailing bytes")
+    return tuple(args)
+
+class Op:
+    """A button action: one-character opcode plus the types of its arguments.
+
+    Calling it gives the callback data for a button, e.g. CB_COURSE(12).
+    """
+    __slots__ = ('code', 'name', 'types')
+
+    def __init__(self, code, name, types):
+        self.code = code
+        self.name = name
+        self.types = types
+
+    def __call__(self, *args):
+        data = VERSION + self.code
+        if self.types:
+            data += base64.urlsafe_b64encode(pack(self.types, args)).rstrip(b'=').decode()
+        if len(data.encode()) > MAX_DATA_BYTES:
+            raise ValueError(f"Callback data for {self.name} is over {MAX_DATA_BYTES} bytes: {data}")
+        return data
+
+    def __repr__(self):
+        return f"<Op {self.name}>"
+
+class CallbackRouter:
+    """Table of button actions and their handlers, looked up by opcode.
+
+    Handlers are called as handler(client, callback_query, *args) with the
+    arguments decoded to the types the op was registered with.
+    """
+
+    def __init__(self):
+        self.ops = {}
+        self.handlers = {}
+
+    def op(self, code, name, *types):
+        if len(code) != 1 or code in self.ops:
+            raise ValueError(f"Opcode {code!r} for {name} must be one unused character")
+        op = self.ops[code] = Op(code, name, types)
+        return op
+
+    def route(self, op):
+        """Decorator registering the handler of an op"""
+        def decorator(handler):
+            self.handlers[op.code] = handler
+            return handler
+        return decorator
+
+    def decode(self, data):
+        """(op, args) of callback data; raises InvalidCallback"""
+        if not data or data[0] != VERSION:
+            raise InvalidCallback('stale', data)
+        op = self.ops.get(data[1:2])
+        if op is None or len(data) > MAX_DATA_BYTES:
+            raise InvalidCallback('malformed', data)
+        if not op.types:
+            if len(data) != 2:
+                raise InvalidCallback('malformed', data)
+            return op, ()
+        encoded = data[2:]
+        try:
+            payload = base64.urlsafe_b64decode(encoded + '=' * (-len(encoded) % 4))
+            return op, unpack(op.types, payload)
+        except (binascii.Error, ValueError, IndexError, UnicodeDecodeError):
+            raise InvalidCallback('malformed', data)
+
+    async def dispatch(self, client, callback_query):
+        """Run the handler of a button press; raises InvalidCallback for data it cannot use"""
+        try:
+            op, args = self.decode(callback_query.data)
+            handler = self.handlers.get(op.code)
+            if handler is None:
+                raise InvalidCallback('malformed', callback_query.data)
+        except InvalidCallback as e:
+            REJECTED.labels(e.reason).inc()
+            raise
+        return await handler(client, callback_query, *args)
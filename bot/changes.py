@@ -0,0 +1,202 @@
+import os
+import sys
+import time
+import asyncio
+import datetime
+from sqlalchemy import func
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from config.config import (
+    CHANGE_FEED_POLL_SECONDS, CHANGE_FEED_LISTEN_SECONDS, CHANGE_FEED_BATCH_SIZE,
+    CHANGE_FEED_MAX_ATTEMPTS, CHANGE_FEED_RETRY_SECONDS
+)
+from database.models import get_db, session_scope, engine, BotSetting, ChangeEvent, CHANGE_CHANNEL
+from utils import metrics
+
+# bot_settings key of the id of the last change event handled
+CURSOR_KEY = 'change_feed_cursor'
+# How long a missing id may hold the feed back: a transaction that got an
+# earlier id can commit after a later one, or roll back and leave a gap for good
+GAP_WAIT_SECONDS = 2.0
+# Handled events older than this are deleted
+RETENTION = datetime.timedelta(days=7)
+PRUNE_INTERVAL = 3600
+
+EVENTS = metrics.counter('bot_change_events_total', 'Change events from the admin dashboard handled by the bot', ['topic', 'result'])
+LAG = metrics.histogram('bot_change_event_lag_seconds', 'Time from an admin change to the bot handling it')
+
+class ChangeFeed:
+    """Tails the change_events outbox written by the admin dashboard.
+
+    Handlers are registered per topic (@feed.on('payment_approved')) and
+    called as handler(client, entity_id) in id order. An event whose handler
+    raises is tried again later, up to CHANGE_FEED_MAX_ATTEMPTS times. On
+    Postgres the feed waits for NOTIFY on a LISTEN connection and only polls
+    as a fallback; elsewhere it polls every CHANGE_FEED_POLL_SECONDS. The
+    cursor is stored in bot_settings, so changes made while the bot was down
+    are handled when it starts.
+    """
+
+    def __init__(self):
+        self.handlers = {}
+        self.cursor = None
+        self.gap_since = None
+        self.wakeup = None
+        self.listen_connection = None
+        self.pruned = 0.0
+
+    def on(self, topic):
+        """Decorator registering the handler of a topic"""
+        def decorator(handler):
+            self.handlers[topic] = handler
+            return handler
+        return decorator
+
+    def load_cursor(self, db):
+        setting = db.query(BotSetting).filter_by(key=CURSOR_KEY).first()
+        if setting is not None:
+            return int(setting.value)
+        # First start: history is not replayed
+        return db.query(func.max(ChangeEvent.id)).scalar() or 0
+
+    def save_cursor(self, db):
+        if not db.query(BotSetting).filter_by(key=CURSOR_KEY).update({'value': str(self.cursor)}):
+            db.add(BotSetting(key=CURSOR_KEY, value=str(self.cursor)))
+        db.commit()
+
+    def listen(self):
+        """Get NOTIFYs of new events on a dedicated connection; False when the database cannot send them"""
+        if engine.dialect.name != 'postgresql' or self.listen_connection is not None:
+            return self.listen_connection is not None
+        try:
+            raw = engine.raw_connection()
+            raw.detach()  # Never handed back to the pool
+            connection = raw.driver_connection
+            connection.autocommit = True
+            with connection.cursor() as cursor:
+                cursor.execute(f"LISTEN {CHANGE_CHANNEL}")
+            asyncio.get_running_loop().add_reader(connection.fileno(), self.notified)
+            self.listen_connection = connection
+            return True
+        except Exception as e:
+            print(f"[changes] LISTEN failed, polling instead: {e}")
+            return False
+
+    def notified(self):
+        try:
+            self.listen_connection.poll()
+            self.listen_connection.notifies.clear()
+        except Exception as e:
+            print(f"[changes] Lost the LISTEN connection: {e}")
+            asyncio.get_running_loop().remove_reader(self.listen_connection.fileno())
+            self.listen_connection = None
+        self.wakeup.set()
+
+    async def handle(self, client, event):
+        """Run the handler of an event; False when it failed and the event should be tried again"""
+        handler = self.handlers.get(event.topic)
+        if handler is None:
+            EVENTS.labels(event.topic, 'ignored').inc()
+            return True
+        try:
+            await handler(client, event.entity_id)
+        except Exception as e:
+            # One failed notification must not hold up the rest of the feed; it is retried later
+            print(f"[changes] Error handling {event.topic} {event.entity_id}: {e}")
+            EVENTS.labels(event.topic, 'failed').inc()
+            return False
+        EVENTS.labels(event.topic, 'handled' if not event.attempts else 'retried').inc()
+        if event.created_date is not None and not event.attempts:
+            now = datetime.datetime.now(datetime.UTC).replace(tzinfo=None)
+            LAG.observe(max((now - event.created_date.replace(tzinfo=None)).total_seconds(), 0))
+        return True
+
+    def read(self):
+        """(new events after the cursor, failed events due for a retry)"""
+        with session_scope():
+            db = get_db()
+            if self.cursor is None:
+                self.cursor = self.load_cursor(db)
+            columns = (ChangeEvent.id, ChangeEvent.topic, ChangeEvent.entity_id, ChangeEvent.created_date, ChangeEvent.attempts)
+            events = db.query(*columns).filter(
+                ChangeEvent.id > self.cursor
+            ).order_by(ChangeEvent.id).limit(CHANGE_FEED_BATCH_SIZE).all()
+            retries = db.query(*columns).filter(
+                ChangeEvent.id <= self.cursor,
+                ChangeEvent.retry_date <= datetime.datetime.now(datetime.UTC)
+            ).order_by(ChangeEvent.id).limit(CHANGE_FEED_BATCH_SIZE).all()
+            return events, retries
+
+    def save(self, start, results):
+        """Store the cursor and schedule the retries of the events whose handler failed"""
+        with session_scope():
+            db = get_db()
+            for event, ok in results:
+                attempts = (event.attempts or 0) + (0 if ok else 1)
+                retry_date = None
+                if not ok and attempts < CHANGE_FEED_MAX_ATTEMPTS:
+                    delay = CHANGE_FEED_RETRY_SECONDS * 2 ** (attempts - 1)
+                    retry_date = datetime.datetime.now(datetime.UTC) + datetime.timedelta(seconds=delay)
+                elif not ok:
+                    print(f"[changes] Giving up on {event.topic} {event.entity_id} after {attempts} attempts")
+                    EVENTS.labels(event.topic, 'abandoned').inc()
+                db.query(ChangeEvent).filter_by(id=event.id).update({'attempts': attempts, 'retry_date': retry_date})
+            if self.cursor != start:
+                self.save_cursor(db)
+            if time.monotonic() - self.pruned >= PRUNE_INTERVAL:
+                self.pruned = time.monotonic()
+                cutoff = datetime.datetime.now(datetime.UTC) - RETENTION
+                db.query(ChangeEvent).filter(
+                    # The row at the cursor is kept so ids never go back below it
+                    ChangeEvent.id < self.cursor, ChangeEvent.created_date < cutoff, ChangeEvent.retry_date.is_(None)
+                ).delete(synchronize_session=False)
+            db.commit()
+
+    async def poll(self, client):
+        """Handle due retries and the events after the cursor; True when there may be more to handle right away"""
+        events, retries = self.read()
+        # Handlers send to Telegram; no database connection is held while they wait
+        start = self.cursor
+        results = []
+        for event in retries:
+            results.append((event, await self.handle(client, event)))
+        waiting = False
+        for event in events:
+            if event.id != self.cursor + 1:
+                self.gap_since = self.gap_since or time.monotonic()
+                if time.monotonic() - self.gap_since < GAP_WAIT_SECONDS:
+                    waiting = True
+                    break
+            self.gap_since = None
+            if not await self.handle(client, event):
+                results.append((event, False))
+            self.cursor = event.id
+        self.save(start, results)
+        return waiting or len(events) == CHANGE_FEED_BATCH_SIZE or len(retries) == CHANGE_FEED_BATCH_SIZE
+
+    async def run(self, client):
+        """Background job of the bot: handle admin changes within about a second of their commit"""
+        while not client.is_connected:
+            await asyncio.sleep(1)
+        self.wakeup = asyncio.Event()
+        while True:
+            listening = self.listen()
+            self.wakeup.clear()
+            try:
+                more = await self.poll(client)
+            except Exception as e:
+                print(f"[changes] Error reading change events: {e}")
+                more = False
+            if more:
+                await asyncio.sleep(0.2 if self.gap_since else 0)
+                continue
+            try:
+                await asyncio.wait_for(self.wakeup.wait(), CHANGE_FEED_LISTEN_SECONDS if listening else CHANGE_FEED_POLL_SECONDS)
+            except asyncio.TimeoutError:
+                pass
+
+feed = ChangeFeed()
+
+def install(client):
+    """Start the change feed on the client's loop"""
+    return client.loop.create_task(feed.run(client))
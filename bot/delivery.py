@@ -0,0 +1,124 @@
+import os
+import sys
+from pyrogram.types import InputMediaDocument, InputMediaVideo, InputMediaAudio, InputMediaPhoto
+from sqlalchemy.orm import object_session
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from config.config import UPLOAD_FOLDER, STORAGE_CHANNEL_ID
+from database.models import get_db, CourseFile
+from bot.media import STALE_FILE_ERRORS
+from utils import metrics
+
+INPUT_MEDIA = {
+    'document': InputMediaDocument,
+    'video': InputMediaVideo,
+    'audio': InputMediaAudio,
+    'photo': InputMediaPhoto,
+}
+SEND_METHODS = {
+    'document': 'send_document',
+    'video': 'send_video',
+    'audio': 'send_audio',
+    'photo': 'send_photo',
+}
+# Telegram albums mix photos and videos, but documents and audio only group with their own kind
+ALBUM_KINDS = {'document': 'document', 'video': 'visual', 'audio': 'audio', 'photo': 'visual'}
+ALBUM_SIZE = 10
+
+FILES_SENT = metrics.counter('bot_course_files_sent_total', 'Course files sent, by how they reached Telegram', ['source'])
+
+def course_files(course_id):
+    return get_db().query(CourseFile).filter_by(course_id=course_id).order_by(CourseFile.position, CourseFile.id).all()
+
+def message_media(message):
+    """(kind, file_id) of the file in a message, or (None, None)"""
+    for kind in INPUT_MEDIA:
+        media = getattr(message, kind, None)
+        if media is not None:
+            return kind, media.file_id
+    return None, None
+
+def source(course_file):
+    """file_id, or a local path to upload from the first time"""
+    if course_file.file_id:
+        return course_file.file_id
+    if course_file.path:
+        path = os.path.join(UPLOAD_FOLDER, course_file.path)
+        if os.path.isfile(path):
+            return path
+    return None
+
+def deliverable(course_file):
+    """Whether a file can be sent, without asking Telegram: it has a file_id, a local file or a storage message"""
+    return bool(source(course_file) or (course_file.storage_message_id and STORAGE_CHANNEL_ID))
+
+def albums(files):
+    """Files split into media groups Telegram accepts, keeping their order"""
+    groups = []
+    for course_file in files:
+        group = groups[-1] if groups else None
+        if (group is None or len(group) == ALBUM_SIZE or
+                ALBUM_KINDS[group[0].kind] != ALBUM_KINDS[course_file.kind]):
+            groups.append([course_file])
+        else:
+            group.append(course_file)
+    return groups
+
+async def resolve_storage(client, files):
+    """Fill in the file_ids of files kept in the storage channel, with one call for all of them"""
+    missing = [f for f in files if not f.file_id and f.storage_message_id]
+    if not missing or not STORAGE_CHANNEL_ID:
+        return
+    messages = await client.get_messages(STORAGE_CHANNEL_ID, [f.storage_message_id for f in missing])
+    for course_file, message in zip(missing, messages):
+        kind, file_id = message_media(message) if message and not message.empty else (None, None)
+        if file_id is None:
+            print(f"Storage message {course_file.storage_message_id} of course {course_file.course_id} has no file")
+            continue
+        course_file.kind = kind
+        course_file.file_id = file_id
+
+async def send_album(client, chat_id, album):
+    if len(album) == 1:
+        course_file = album[0]
+        send = getattr(client, SEND_METHODS[course_file.kind])
+        return [await send(chat_id, source(course_file), caption=course_file.caption or "")]
+    return await client.send_media_group(chat_id, [
+        INPUT_MEDIA[f.kind](source(f), caption=f.caption or "") for f in album
+    ])
+
+async def send_files(client, chat_id, files):
+    """Send course files as media groups by file_id, uploading each file only the first time.
+
+    Files from the storage channel are looked up once; the file_ids Telegram
+    returns for uploaded files are stored after each album so later
+    deliveries upload nothing. Returns the number of files sent.
+    """
+    if not files:
+        return 0
+    # Held here so the rows can still be refreshed after a commit below
+    db = object_session(files[0])
+    await resolve_storage(client, files)
+    sendable = [f for f in files if source(f)]
+    for album in albums(sendable):
+        uploads = {f.id for f in album if not f.file_id}
+        try:
+            messages = await send_album(client, chat_id, album)
+        except STALE_FILE_ERRORS as e:
+            print(f"Stored file_ids of course {album[0].course_id} no longer work ({e}), fetching them again")
+            for course_file in album:
+                course_file.file_id = None
+            await resolve_storage(client, album)
+            album = [f for f in album if source(f)]
+            if not album:
+                continue
+            uploads = {f.id for f in album}
+            messages = await send_album(client, chat_id, album)
+        for course_file, message in zip(album, messages):
+            if not course_file.file_id:
+                course_file.file_id = message_media(message)[1]
+            FILES_SENT.labels('upload' if course_file.id in uploads else 'file_id').inc()
+        # Keep the file_ids learned so far even if a later album fails
+        if db.dirty:
+            db.commit()
+    return len(sendable)
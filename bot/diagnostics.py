@@ -0,0 +1,169 @@
+import os
+import gc
+import sys
+import hmac
+import json
+import signal
+import asyncio
+import tracemalloc
+from collections import Counter, deque
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from config.config import DIAGNOSTICS_TOKEN, TRACEMALLOC_FRAMES
+from utils import metrics
+
+# In-process structures to report on: name -> function returning the object
+structures = {}
+
+# Allocation sites shown per section of the report
+TOP_ALLOCATIONS = 15
+
+# Objects visited when estimating the size of one structure
+MAX_SIZE_OBJECTS = 200000
+
+_previous_snapshot = None
+
+def start_tracing(frames=1):
+    """Start tracemalloc if it is not already running"""
+    if not tracemalloc.is_tracing():
+        tracemalloc.start(frames)
+
+def deep_size(obj, limit=MAX_SIZE_OBJECTS):
+    """Approximate memory held by a container and everything it references.
+
+    Returns (bytes, complete); complete is False when the walk stopped at the limit.
+    """
+    seen = set()
+    stack = [obj]
+    total = 0
+    while stack:
+        if len(seen) >= limit:
+            return total, False
+        current = stack.pop()
+        if id(current) in seen:
+            continue
+        seen.add(id(current))
+        total += sys.getsizeof(current)
+        if isinstance(current, dict):
+            stack.extend(current.keys())
+            stack.extend(current.values())
+        elif isinstance(current, (list, tuple, set, frozenset, deque)):
+            stack.extend(current)
+        elif hasattr(current, '__dict__'):
+            stack.append(vars(current))
+    return total, True
+
+def rss_bytes():
+    """Resident set size of this process, None where /proc is not available"""
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        return None
+
+def allocation_stats(stats, size_attribute='size', count_attribute='count'):
+    return [{
+        'site': str(stat.traceback[0]) if stat.traceback else '?',
+        'bytes': getattr(stat, size_attribute),
+        'count': getattr(stat, count_attribute)
+    } for stat in stats[:TOP_ALLOCATIONS]]
+
+def allocation_report():
+    """Top allocation sites now and their growth since the previous report"""
+    global _previous_snapshot
+    if not tracemalloc.is_tracing():
+        start_tracing()
+        return {'tracing': 'started now; the next report shows allocation sites and growth'}
+
+    snapshot = tracemalloc.take_snapshot().filter_traces((
+        tracemalloc.Filter(False, tracemalloc.__file__),
+        tracemalloc.Filter(False, '<frozen importlib._bootstrap>'),
+        tracemalloc.Filter(False, '<frozen importlib._bootstrap_external>'),
+    ))
+    current, peak = tracemalloc.get_traced_memory()
+    report = {
+        'traced_bytes': current,
+        'traced_peak_bytes': peak,
+        'top': allocation_stats(snapshot.statistics('lineno'))
+    }
+    if _previous_snapshot is not None:
+        report['growth'] = allocation_stats(
+            snapshot.compare_to(_previous_snapshot, 'lineno'), 'size_diff', 'count_diff'
+        )
+    _previous_snapshot = snapshot
+    return report
+
+def task_report():
+    """Live asyncio tasks of the running loop grouped by coroutine name"""
+    names = Counter()
+    for task in asyncio.all_tasks():
+        coro = task.get_coro()
+        names[getattr(coro, '__qualname__', type(coro).__name__)] += 1
+    return {'total': sum(names.values()), 'by_coroutine': dict(names.most_common())}
+
+def structure_report():
+    """Length and approximate deep size of each registered structure"""
+    report = {}
+    for name, get in structures.items():
+        obj = get()
+        size, complete = deep_size(obj)
+        report[name] = {
+            'length': len(obj) if hasattr(obj, '__len__') else None,
+            'bytes': size if complete else f">{size}"
+        }
+    return report
+
+def object_report(top=20):
+    """Most common object types tracked by the garbage collector"""
+    counts = Counter(type(obj).__name__ for obj in gc.get_objects())
+    return dict(counts.most_common(top))
+
+async def collect():
+    """Build the full report; runs on the bot's event loop so nothing changes underneath it"""
+    return {
+        'rss_bytes': rss_bytes(),
+        'tasks': task_report(),
+        'structures': structure_report(),
+        'objects': object_report(),
+        'allocations': allocation_report()
+    }
+
+def format_report(report):
+    """Human readable version of a report, for the signal handler"""
+    lines = [f"[diagnostics] RSS: {report['rss_bytes']} bytes"]
+    lines.append(f"[diagnostics] tasks: {report['tasks']['total']} {report['tasks']['by_coroutine']}")
+    for name, info in report['structures'].items():
+        lines.append(f"[diagnostics] {name}: {info['length']} entries, {info['bytes']} bytes")
+    lines.append(f"[diagnostics] objects: {report['objects']}")
+    allocations = report['allocations']
+    if 'tracing' in allocations:
+        lines.append(f"[diagnostics] tracemalloc {allocations['tracing']}")
+    else:
+        lines.append(f"[diagnostics] traced: {allocations['traced_bytes']} bytes (peak {allocations['traced_peak_bytes']})")
+        for section in ('top', 'growth'):
+            for stat in allocations.get(section, []):
+                lines.append(f"[diagnostics] {section}: {stat['bytes']:>+12} B {stat['count']:>+8} {stat['site']}")
+    return "\n".join(lines)
+
+def install(loop):
+    """Enable the SIGUSR1 report and the /debug/memory route for the bot's loop"""
+    if TRACEMALLOC_FRAMES:
+        start_tracing(TRACEMALLOC_FRAMES)
+
+    if hasattr(signal, 'SIGUSR1'):
+        def on_signal():
+            task = loop.create_task(collect())
+            task.add_done_callback(lambda done: print(format_report(done.result())))
+        loop.add_signal_handler(signal.SIGUSR1, on_signal)
+
+    if DIAGNOSTICS_TOKEN:
+        def memory_route(request):
+            auth = request.headers.get('Authorization', '')
+            if not hmac.compare_digest(auth, f"Bearer {DIAGNOSTICS_TOKEN}"):
+                raise PermissionError()
+            # The metrics server runs in its own thread; collect on the loop
+            report = asyncio.run_coroutine_threadsafe(collect(), loop).result(timeout=60)
+            return 'application/json', json.dumps(report, indent=2, default=str)
+        metrics.http_routes['/debug/memory'] = memory_route
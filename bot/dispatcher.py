@@ -0,0 +1,179 @@
+import os
+import sys
+import asyncio
+import inspect
+import logging
+from collections import deque
+import pyrogram
+from pyrogram.dispatcher import Dispatcher
+from pyrogram.handlers import RawUpdateHandler
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from config.config import UPDATE_CONCURRENCY, UPDATE_QUEUE_DEPTH
+from utils import metrics
+
+log = logging.getLogger(__name__)
+
+DROPPED = metrics.counter('bot_updates_dropped_total', "Updates dropped because their user's queue was full")
+
+def peer_id(peer):
+    for attribute in ('user_id', 'chat_id', 'channel_id'):
+        value = getattr(peer, attribute, None)
+        if value is not None:
+            return value
+    return None
+
+def update_key(update):
+    """User (or chat) a raw update comes from, None for updates that need no ordering"""
+    user_id = getattr(update, 'user_id', None)
+    if user_id is not None:
+        return user_id
+    message = getattr(update, 'message', None)
+    if message is None or isinstance(message, (bytes, str)):
+        return None
+    from_id = getattr(message, 'from_id', None)
+    if from_id is not None:
+        return peer_id(from_id)
+    peer = getattr(message, 'peer_id', None)
+    return peer_id(peer) if peer is not None else None
+
+class OrderedDispatcher(Dispatcher):
+    """pyrogram Dispatcher that handles each user's updates strictly in order.
+
+    pyrogram hands updates to a pool of workers, so two quick messages from
+    one user can run at the same time and race on user_states (two photos
+    could create two payments). Here a single router puts each raw update on
+    the queue of the user it comes from, before parsing so nothing can
+    reorder it; one task per user drains that queue, started when the first
+    update arrives and finished when it runs dry. Different users run in
+    parallel, up to `concurrency` handlers at once. A user whose queue already
+    holds `max_depth` updates has further ones dropped.
+    """
+
+    def __init__(self, client, concurrency=UPDATE_CONCURRENCY, max_depth=UPDATE_QUEUE_DEPTH):
+        super().__init__(client)
+        self.concurrency = concurrency
+        self.max_depth = max_depth
+        self.user_queues = {}
+        self.tasks = set()
+        self._slots = None
+
+    async def start(self):
+        if self.client.no_updates:
+            return
+        # Each slot is a lock so add_handler/remove_handler, which take every
+        # lock in locks_list, still wait for running handlers
+        self.locks_list.clear()
+        self._slots = asyncio.Queue()
+        for _ in range(self.concurrency or self.client.workers):
+            lock = asyncio.Lock()
+            self.locks_list.append(lock)
+            self._slots.put_nowait(lock)
+        self.handler_worker_tasks.append(self.loop.create_task(self.router()))
+        log.info("Started ordered dispatcher with %s slots", len(self.locks_list))
+
+    async def stop(self):
+        if self.client.no_updates:
+            return
+        self.updates_queue.put_nowait(None)
+        for task in self.handler_worker_tasks:
+            await task
+        self.handler_worker_tasks.clear()
+        if self.tasks:
+            await asyncio.gather(*self.tasks, return_exceptions=True)
+        self.groups.clear()
+        log.info("Stopped ordered dispatcher")
+
+    async def router(self):
+        while True:
+            packet = await self.updates_queue.get()
+            if packet is None:
+                break
+            self.submit(update_key(packet[0]), packet)
+
+    def spawn(self, coro):
+        task = self.loop.create_task(coro)
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+        return task
+
+    def submit(self, key, packet):
+        """Queue a packet behind the other updates of its user; False if it was dropped"""
+        if key is None:
+            self.spawn(self.process(packet))
+            return True
+
+        queue = self.user_queues.get(key)
+        if queue is None:
+            queue = self.user_queues[key] = deque()
+            self.spawn(self.drain(key, queue))
+        elif len(queue) >= self.max_depth:
+            DROPPED.inc()
+            return False
+        queue.append(packet)
+        return True
+
+    async def drain(self, key, queue):
+        try:
+            while queue:
+                await self.process(queue.popleft())
+        finally:
+            if self.user_queues.get(key) is queue:
+                del self.user_queues[key]
+
+    async def process(self, packet):
+        lock = await self._slots.get()
+        try:
+            async with lock:
+                await self.handle(packet)
+        finally:
+            self._slots.put_nowait(lock)
+
+    async def handle(self, packet):
+        """Parse a packet and run the first matching handler of each group, like pyrogram's workers"""
+        try:
+            update, users, chats = packet
+            parser = self.update_parsers.get(type(update), None)
+            parsed_update, handler_type = (
+                await parser(update, users, chats)
+                if parser is not None
+                else (None, type(None))
+            )
+
+            for group in self.groups.values():
+                for handler in group:
+                    args = None
+
+                    if isinstance(handler, handler_type):
+                        try:
+                            if await handler.check(self.client, parsed_update):
+                                args = (parsed_update,)
+                        except Exception as e:
+                            log.exception(e)
+                            continue
+                    elif isinstance(handler, RawUpdateHandler):
+                        args = (update, users, chats)
+
+                    if args is None:
+                        continue
+
+                    try:
+                        if inspect.iscoroutinefunction(handler.callback):
+                            await handler.callback(self.client, *args)
+                        else:
+                            await self.loop.run_in_executor(self.client.executor, handler.callback, self.client, *args)
+                    except pyrogram.StopPropagation:
+                        raise
+                    except pyrogram.ContinuePropagation:
+                        continue
+                    except Exception as e:
+                        log.exception(e)
+
+                    break
+        except pyrogram.StopPropagation:
+            pass
+        except Exception as e:
+            log.exception(e)
+
+    def pending(self):
+        return sum(len(queue) for queue in self.user_queues.values())
@@ -0,0 +1,218 @@
+import os
+import sys
+import time
+import random
+import asyncio
+import datetime
+import itertools
+from io import BytesIO
+from collections import defaultdict
+from PIL import Image
+from pyrogram import enums
+from pyrogram.handlers import MessageHandler, CallbackQueryHandler
+from pyrogram.types import Message, CallbackQuery, Chat, User, Photo, InlineKeyboardMarkup
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from bot import ledger
+
+class FakeMe:
+    """Minimal stand-in for Client.me, used by filters.command"""
+    id = 1
+    username = "fake_course_bot"
+    is_bot = True
+
+class FakeClient:
+    """In-process stand-in for pyrogram.Client.
+
+    Implements the high-level methods the handlers (and the bound methods of
+    Message/CallbackQuery they call) use, records every outgoing call with its
+    simulated latency and keeps the last state of each sent message so a
+    simulated user can read the reply and press its buttons. Calls are also
+    counted in the Telegram call ledger like the real LedgerClient does.
+    """
+
+    def __init__(self, latency=0.0, jitter=0.0, seed=None):
+        self.me = FakeMe()
+        self.latency = latency
+        self.jitter = jitter
+        self.random = random.Random(seed)
+        self.calls = []  # (method, chat_id, seconds)
+        self.messages = {}  # (chat_id, message_id) -> Message
+        self.last_message = {}  # chat_id -> last message id the bot sent or edited
+        self._message_counters = defaultdict(lambda: itertools.count(1))
+        self._file_ids = itertools.count(1)
+        self.proof_image = make_image_bytes()
+
+    async def _call(self, method, raw_method, chat_id):
+        delay = max(0.0, self.random.gauss(self.latency, self.jitter)) if self.latency or self.jitter else 0.0
+        ledger.record_call(raw_method)
+        if delay:
+            await asyncio.sleep(delay)
+        self.calls.append((method, chat_id, delay))
+
+    def new_message(self, chat_id, text=None, caption=None, photo=None, reply_markup=None):
+        message = Message(
+            client=self,
+            id=next(self._message_counters[chat_id]),
+            chat=Chat(id=chat_id, type=enums.ChatType.PRIVATE),
+            from_user=User(id=self.me.id, is_bot=True, first_name="Bot", username=self.me.username),
+            date=datetime.datetime.now(),
+            text=text,
+            caption=caption,
+            photo=photo,
+            reply_markup=reply_markup
+        )
+        self.messages[(chat_id, message.id)] = message
+        self.last_message[chat_id] = message.id
+        return message
+
+    def new_photo(self, file_id=None):
+        number = next(self._file_ids)
+        return Photo(
+            file_id=file_id or f"fake-photo-{number}",
+            file_unique_id=f"fake-unique-{number}",
+            width=512,
+            height=512,
+            file_size=1024,
+            date=datetime.datetime.now()
+        )
+
+    async def send_message(self, chat_id, text, reply_markup=None, **kwargs):
+        await self._call('send_message', 'SendMessage', chat_id)
+        return self.new_message(chat_id, text=text, reply_markup=reply_markup)
+
+    async def send_photo(self, chat_id, photo, caption=None, reply_markup=None, **kwargs):
+        await self._call('send_photo', 'SendMedia', chat_id)
+        file_id = photo if isinstance(photo, str) and photo.startswith('fake-photo-') else None
+        return self.new_message(chat_id, caption=caption, photo=self.new_photo(file_id), reply_markup=reply_markup)
+
+    async def edit_message_text(self, chat_id, message_id, text, reply_markup=None, **kwargs):
+        await self._call('edit_message_text', 'EditMessage', chat_id)
+        message = self.messages.get((chat_id, message_id)) or self.new_message(chat_id)
+        message.text = text
+        message.reply_markup = reply_markup
+        self.last_message[chat_id] = message.id
+        return message
+
+    async def edit_message_caption(self, chat_id, message_id, caption, reply_markup=None, **kwargs):
+        await self._call('edit_message_caption', 'EditMessage', chat_id)
+        message = self.messages.get((chat_id, message_id)) or self.new_message(chat_id)
+        message.caption = caption
+        message.reply_markup = reply_markup
+        self.last_message[chat_id] = message.id
+        return message
+
+    async def edit_message_media(self, chat_id, message_id, media, reply_markup=None, **kwargs):
+        await self._call('edit_message_media', 'EditMessage', chat_id)
+        message = self.messages.get((chat_id, message_id)) or self.new_message(chat_id)
+        file_id = media.media if isinstance(media.media, str) and media.media.startswith('fake-photo-') else None
+        message.photo = self.new_photo(file_id)
+        message.caption = media.caption
+        message.reply_markup = reply_markup
+        self.last_message[chat_id] = message.id
+        return message
+
+    async def edit_message_reply_markup(self, chat_id, message_id, reply_markup=None, **kwargs):
+        await self._call('edit_message_reply_markup', 'EditMessage', chat_id)
+        message = self.messages.get((chat_id, message_id)) or self.new_message(chat_id)
+        message.reply_markup = reply_markup
+        self.last_message[chat_id] = message.id
+        return message
+
+    async def delete_messages(self, chat_id, message_ids, revoke=True):
+        await self._call('delete_messages', 'DeleteMessages', chat_id)
+        ids = message_ids if isinstance(message_ids, (list, tuple, set)) else [message_ids]
+        for message_id in ids:
+            self.messages.pop((chat_id, message_id), None)
+        return len(ids)
+
+    async def answer_callback_query(self, callback_query_id, text=None, show_alert=None, **kwargs):
+        await self._call('answer_callback_query', 'SetBotCallbackAnswer', None)
+        return True
+
+    async def download_media(self, message, in_memory=False, **kwargs):
+        await self._call('download_media', 'GetFile', None)
+        data = BytesIO(self.proof_image)
+        data.name = "proof.png"
+        return data
+
+    def last_reply(self, chat_id):
+        """Last message the bot sent or edited in a chat"""
+        message_id = self.last_message.get(chat_id)
+        return self.messages.get((chat_id, message_id)) if message_id else None
+
+def make_image_bytes(size=64):
+    """A small valid PNG, used as the payment proof screenshot"""
+    buffer = BytesIO()
+    Image.new('RGB', (size, size), color=(30, 120, 200)).save(buffer, format='PNG')
+    return buffer.getvalue()
+
+def make_user(user_id):
+    """A Telegram user as the handlers receive it"""
+    return User(
+        id=user_id,
+        is_bot=False,
+        first_name=f"User{user_id}",
+        last_name="Test",
+        username=f"user{user_id}"
+    )
+
+def make_text_message(client, user, text, message_id=0):
+    """An incoming text message (commands included) from a user"""
+    return Message(
+        client=client,
+        id=message_id,
+        chat=Chat(id=user.id, type=enums.ChatType.PRIVATE),
+        from_user=user,
+        date=datetime.datetime.now(),
+        text=text
+    )
+
+def make_photo_message(client, user, message_id=0):
+    """An incoming photo message (payment proof) from a user"""
+    return Message(
+        client=client,
+        id=message_id,
+        chat=Chat(id=user.id, type=enums.ChatType.PRIVATE),
+        from_user=user,
+        date=datetime.datetime.now(),
+        photo=client.new_photo()
+    )
+
+def make_callback_query(client, user, message, data):
+    """A button press on one of the bot's messages"""
+    return CallbackQuery(
+        client=client,
+        id=str(next(client._file_ids)),
+        from_user=user,
+        chat_instance=str(user.id),
+        message=message,
+        data=data
+    )
+
+def button_rows(message):
+    """Inline keyboard rows of a message, empty if it has none"""
+    if message is None or not isinstance(message.reply_markup, InlineKeyboardMarkup):
+        return []
+    return message.reply_markup.inline_keyboard
+
+def find_buttons(message, predicate):
+    """Inline callback buttons of a message whose text matches a predicate"""
+    return [button for row in button_rows(message) for button in row
+            if button.callback_data and predicate(button.text)]
+
+async def dispatch(bot_app, client, update):
+    """Run an update through the handlers registered on the real bot app.
+
+    Mirrors pyrogram's dispatcher: in each group the first handler whose
+    filters match runs. Returns the name of the handler that ran and its
+    duration in seconds, or (None, 0) if nothing matched.
+    """
+    handler_type = CallbackQueryHandler if isinstance(update, CallbackQuery) else MessageHandler
+    for group in bot_app.dispatcher.groups.values():
+        for handler in group:
+            if isinstance(handler, handler_type) and await handler.check(client, update):
+                start = time.perf_counter()
+                await handler.callback(client, update)
+                return handler.callback.__name__, time.perf_counter() - start
+    return None, 0.0
@@ -0,0 +1,156 @@
+import os
+import sys
+import json
+import time
+import asyncio
+import contextvars
+from collections import Counter, OrderedDict, deque
+from contextlib import contextmanager
+from pyrogram import Client
+from pyrogram.errors import FloodWait
+from pyrogram.session import Session
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from config.config import TELEGRAM_CALL_BUDGET
+from utils import metrics
+from bot import outbound
+
+API_CALLS = metrics.counter('telegram_api_calls_total', 'Telegram API calls', ['method', 'handler'])
+API_LATENCY = metrics.histogram('telegram_api_call_duration_seconds', 'Telegram API call latency', ['method'])
+API_ERRORS = metrics.counter('telegram_api_errors_total', 'Telegram API calls that failed', ['method'])
+FLOOD_WAITS = metrics.counter('telegram_flood_waits_total', 'FloodWait errors returned by Telegram', ['method'])
+FLOOD_WAIT_SECONDS = metrics.counter('telegram_flood_wait_seconds_total', 'Seconds Telegram asked us to wait', ['method'])
+OVER_BUDGET = metrics.counter('telegram_call_budget_exceeded_total', 'Interactions exceeding the API call budget', ['handler'])
+
+# Users tracked individually; the least recently active are dropped first
+MAX_TRACKED_USERS = 10000
+
+class Interaction:
+    """Telegram API calls made while handling one update"""
+
+    def __init__(self, handler, user_id):
+        self.handler = handler
+        self.user_id = user_id
+        self.calls = Counter()
+        self.closed = False
+
+    @property
+    def total(self):
+        return sum(self.calls.values())
+
+_current_interaction = contextvars.ContextVar('telegram_interaction', default=None)
+
+# Per-user call counts and the most recent over-budget interactions
+user_calls = OrderedDict()
+over_budget = deque(maxlen=100)
+
+@contextmanager
+def interaction(handler, user_id):
+    """Attribute the Telegram API calls made inside the block to a handler and user"""
+    if _current_interaction.get() is not None:
+        yield _current_interaction.get()
+        return
+
+    current = Interaction(handler, user_id)
+    token = _current_interaction.set(current)
+    try:
+        yield current
+    finally:
+        _current_interaction.reset(token)
+        # Tasks spawned by the handler (e.g. delete_after_delay) still see this
+        # interaction; closing it keeps their calls out of the budget
+        current.closed = True
+        check_budget(current)
+
+def check_budget(current):
+    """Flag interactions that made more API calls than the budget allows"""
+    if current.total <= TELEGRAM_CALL_BUDGET:
+        return
+    OVER_BUDGET.labels(current.handler).inc()
+    over_budget.append({
+        'handler': current.handler,
+        'user_id': current.user_id,
+        'calls': dict(current.calls),
+        'time': time.time()
+    })
+    print(f"[telegram-ledger] {current.handler} made {current.total} API calls "
+          f"(budget {TELEGRAM_CALL_BUDGET}): {dict(current.calls)}")
+
+def record_call(method):
+    """Count one outgoing API call against the current interaction"""
+    current = _current_interaction.get()
+    if current is None or current.closed:
+        API_CALLS.labels(method, 'background').inc()
+        return
+
+    current.calls[method] += 1
+    API_CALLS.labels(method, current.handler).inc()
+
+    if current.user_id is not None:
+        counts = user_calls.pop(current.user_id, None) or Counter()
+        counts[method] += 1
+        user_calls[current.user_id] = counts
+        if len(user_calls) > MAX_TRACKED_USERS:
+            user_calls.popitem(last=False)
+
+def snapshot(top=20):
+    """Summary of the ledger for the diagnostics endpoint"""
+    top_users = sorted(user_calls.items(), key=lambda item: sum(item[1].values()), reverse=True)[:top]
+    return {
+        'budget': TELEGRAM_CALL_BUDGET,
+        'top_users': [{'user_id': user_id, 'calls': dict(counts)} for user_id, counts in top_users],
+        'over_budget': list(over_budget)
+    }
+
+metrics.http_routes['/ledger'] = lambda request: ('application/json', json.dumps(snapshot(), indent=2))
+
+class LedgerClient(Client):
+    """pyrogram Client that records every outgoing API call.
+
+    All high-level methods (send_message, edit_message_text, Message.reply, ...)
+    end up in Client.invoke, so this is the single place to count calls per raw
+    method (SendMessage, EditMessage, SendMedia, ...). File chunks uploaded by
+    send_photo/send_document go through a separate media session and are not
+    counted, only the final SendMedia call is.
+
+    FloodWaits are handled here rather than inside the session so that every
+    one is recorded. Messages (sends and edits) first wait for a slot from the
+    outbound scheduler, which keeps them within Telegram's rate limits and
+    serves interactive replies before notifications and broadcasts (see
+    bot/outbound.py); after a FloodWait they are queued again behind the
+    requested pause. Replies wait out FloodWaits up to sleep_threshold and
+    background lanes up to OUTBOUND_MAX_FLOOD_WAIT; longer ones raise as before.
+    """
+
+    async def invoke(self, query, retries=Session.MAX_RETRIES, timeout=Session.WAIT_TIMEOUT, sleep_threshold=None):
+        method = type(query).__name__
+        if sleep_threshold is None:
+            sleep_threshold = self.sleep_threshold
+        scheduled = outbound.is_scheduled(query)
+        lane = outbound.current_lane()
+        chat = outbound.peer_key(query) if scheduled else None
+        max_wait = outbound.scheduler.max_wait(lane, sleep_threshold) if scheduled else sleep_threshold
+
+        while True:
+            if scheduled:
+                await outbound.scheduler.acquire(chat, lane)
+            record_call(method)
+            start = time.perf_counter()
+            try:
+                return await super().invoke(query, retries, timeout, sleep_threshold=0)
+            except FloodWait as e:
+                FLOOD_WAITS.labels(method).inc()
+                FLOOD_WAIT_SECONDS.labels(method).inc(e.value)
+                if e.value > max_wait:
+                    raise
+                print(f"[telegram-ledger] FloodWait of {e.value}s on {method}, retrying")
+                if scheduled:
+                    outbound.RETRIES.labels(lane).inc()
+                    outbound.scheduler.flood_wait(chat, e.value, lane)
+                else:
+                    await asyncio.sleep(e.value)
+            except Exception:
+                API_ERRORS.labels(method).inc()
+                raise
+            finally:
+                API_LATENCY.labels(method).observe(time.perf_counter() - start)
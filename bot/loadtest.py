@@ -0,0 +1,268 @@
+"""Offline load test of the bot handlers.
+
+Drives the real handlers in bot/bot.py through FakeClient (bot/fake_client.py)
+against a seeded SQLite database, simulating users walking the
+browse -> course -> pay -> proof flow. No Telegram connection is made.
+
+    python -m bot.loadtest --users 2000 --concurrency 200 --latency 0.05
+"""
+import os
+import sys
+import json
+import time
+import random
+import asyncio
+import argparse
+import tempfile
+from collections import defaultdict
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Simulated users get ids far above real Telegram test accounts
+FIRST_USER_ID = 900000000
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Offline load test of the bot handlers")
+    parser.add_argument('--users', type=int, default=1000, help="Simulated users, each walking the purchase flow once")
+    parser.add_argument('--concurrency', type=int, default=500, help="Users active at the same time")
+    parser.add_argument('--workers', type=int, default=None,
+                        help="Updates handled at the same time, like pyrogram's workers (default: the bot's setting). "
+                             "More than the SQLAlchemy pool allows (5 + 10 overflow) blocks the event loop")
+    parser.add_argument('--courses', type=int, default=50, help="Courses in the seeded catalog")
+    parser.add_argument('--categories', type=int, default=8, help="Categories in the seeded catalog")
+    parser.add_argument('--latency', type=float, default=0.0, help="Mean simulated Telegram API latency in seconds")
+    parser.add_argument('--jitter', type=float, default=0.0, help="Standard deviation of the simulated latency")
+    parser.add_argument('--think', type=float, default=0.0, help="Mean pause between a user's steps in seconds")
+    parser.add_argument('--seed', type=int, default=1, help="Random seed for the catalog, user choices and latency")
+    parser.add_argument('--database', default=None, help="Database URL (default: a fresh temporary SQLite file)")
+    parser.add_argument('--json', dest='json_path', default=None, help="Also write the results as JSON to this file")
+    return parser.parse_args(argv)
+
+def configure_environment(args, workdir):
+    """Point the project at a throwaway database and upload folder before it is imported"""
+    os.environ['DATABASE_URL'] = args.database or f"sqlite:///{os.path.join(workdir, 'loadtest.db')}"
+    os.environ['UPLOAD_FOLDER'] = os.path.join(workdir, 'uploads')
+    os.environ['LOG_ARCHIVE_DIR'] = os.path.join(workdir, 'log_archive')
+    os.environ['QR_CACHE_DIR'] = os.path.join(workdir, 'qr_cache')
+    os.environ['AUTO_DELETE_SECONDS'] = '0'
+    os.environ['AUTO_APPROVE'] = 'false'
+    os.environ['BOT_METRICS_PORT'] = '0'
+    os.environ['TRAFFIC_RECORD_DIR'] = ''
+    os.environ.setdefault('UPI_ID', 'loadtest@upi')
+    # No calls to TinyURL; point it at a local stub server to include the shortener
+    os.environ.setdefault('SHORTENER_URL', '')
+    # Handlers are expected to exceed the call budget here and there; keep the output readable
+    os.environ.setdefault('TELEGRAM_CALL_BUDGET', '1000')
+    # Simulated users tap without pausing; measure the handlers rather than the rate limiter
+    os.environ.setdefault('THROTTLE_USER_RATE', '1000')
+    os.environ.setdefault('THROTTLE_USER_BURST', '1000')
+
+def seed_catalog(db, courses, categories, rng):
+    """Create categories and paid courses, half of them with a cover image"""
+    from database.models import Category, Course
+
+    category_rows = [Category(name=f"Load Test Category {i + 1}") for i in range(categories)]
+    db.add_all(category_rows)
+    db.flush()
+
+    for i in range(courses):
+        db.add(Course(
+            title=f"Load Test Course {i + 1}",
+            description="Seeded by bot/loadtest.py. " * rng.randint(1, 20),
+            price=float(rng.choice([199, 299, 499, 999, 1499])),
+            file_link=f"https://example.com/courses/{i + 1}",
+            category_id=category_rows[i % categories].id if category_rows else None,
+            image_link=f"https://example.com/images/{i + 1}.jpg" if i % 2 else None,
+            is_active=True
+        ))
+    db.commit()
+
+def percentile(sorted_values, fraction):
+    """Nearest-rank percentile of an already sorted list"""
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, int(round(fraction * len(sorted_values) + 0.5)) - 1))
+    return sorted_values[index]
+
+class Results:
+    """Handler timings and completed flows of one run"""
+
+    def __init__(self):
+        self.timings = defaultdict(list)
+        self.responses = []
+        self.unhandled = 0
+        self.completed = 0
+        self.failed = 0
+
+    def summary(self, elapsed, users):
+        from bot import ledger, middleware
+
+        api_calls = defaultdict(int)
+        for (method, handler), child in list(ledger.API_CALLS._children.items()):
+            api_calls[handler] += child.value
+        queries = {values[0]: child.value for values, child in list(middleware.HANDLER_QUERIES._children.items())}
+        errors = {values[0]: child.value for values, child in list(middleware.HANDLER_ERRORS._children.items())}
+
+        updates = sum(len(values) for values in self.timings.values())
+        responses = sorted(self.responses)
+        handlers = {}
+        for name, values in sorted(self.timings.items()):
+            values = sorted(values)
+            handlers[name] = {
+                'updates': len(values),
+                'errors': int(errors.get(name, 0)),
+                'p50_ms': percentile(values, 0.50) * 1000,
+                'p95_ms': percentile(values, 0.95) * 1000,
+                'p99_ms': percentile(values, 0.99) * 1000,
+                'max_ms': values[-1] * 1000,
+                'api_calls_per_update': api_calls.get(name, 0) / len(values),
+                'queries_per_update': queries.get(name, 0) / len(values)
+            }
+        return {
+            'users': users,
+            'completed_flows': self.completed,
+            'failed_flows': self.failed,
+            'unhandled_updates': self.unhandled,
+            'elapsed_seconds': elapsed,
+            'updates': updates,
+            'updates_per_second': updates / elapsed if elapsed else 0.0,
+            'flows_per_second': self.completed / elapsed if elapsed else 0.0,
+            'response_p50_ms': percentile(responses, 0.50) * 1000,
+            'response_p95_ms': percentile(responses, 0.95) * 1000,
+            'response_p99_ms': percentile(responses, 0.99) * 1000,
+            'background_api_calls': api_calls.get('background', 0),
+            'handlers': handlers
+        }
+
+async def send(bot_app, client, update, results, workers):
+    """Dispatch one update on a free worker and record how long its handler took"""
+    from bot.fake_client import dispatch
+
+    queued = time.perf_counter()
+    async with workers:
+        waited = time.perf_counter() - queued
+        try:
+            name, duration = await dispatch(bot_app, client, update)
+        except Exception as e:
+            # The handler's error is counted by the middleware (bot_handler_errors_total)
+            print(f"Handler failed for user {update.from_user.id}: {e!r}")
+            return False
+    if name is None:
+        results.unhandled += 1
+        return False
+    results.timings[name].append(duration)
+    results.responses.append(waited + duration)
+    return True
+
+async def press(bot_app, client, user, results, workers, rng, predicate):
+    """Press a random inline button of the bot's last message whose label matches"""
+    from bot.fake_client import find_buttons, make_callback_query
+
+    message = client.last_reply(user.id)
+    buttons = find_buttons(message, predicate)
+    if not buttons:
+        return False
+    button = rng.choice(buttons)
+    update = make_callback_query(client, user, message, button.callback_data)
+    return await send(bot_app, client, update, results, workers)
+
+async def simulate_user(bot_app, client, user_id, args, results, active_users, workers):
+    """Walk one user through /start -> browse -> course -> buy -> UPI -> payment proof"""
+    from bot.fake_client import make_user, make_text_message, make_photo_message
+
+    rng = random.Random(args.seed * 1000003 + user_id)
+    user = make_user(user_id)
+
+    async def think():
+        if args.think:
+            await asyncio.sleep(rng.expovariate(1 / args.think))
+
+    async with active_users:
+        try:
+            steps = [
+                lambda: send(bot_app, client, make_text_message(client, user, "/start"), results, workers),
+                lambda: send(bot_app, client, make_text_message(client, user, "📚 Browse Courses"), results, workers),
+                lambda: press(bot_app, client, user, results, workers, rng, lambda text: " - ₹" in text),
+                lambda: press(bot_app, client, user, results, workers, rng, lambda text: "Buy Now" in text),
+                lambda: press(bot_app, client, user, results, workers, rng, lambda text: text == "UPI Payment"),
+                lambda: send(bot_app, client, make_photo_message(client, user), results, workers)
+            ]
+            for step in steps:
+                if not await step():
+                    results.failed += 1
+                    return
+                await think()
+            results.completed += 1
+        except Exception as e:
+            results.failed += 1
+            print(f"Simulated user {user_id} failed: {e}")
+
+async def run_load_test(bot_app, client, args):
+    """Simulate all users and return the results with the wall time taken"""
+    # Let the handler registrations scheduled by @app.on_message run
+    await asyncio.sleep(0)
+
+    results = Results()
+    active_users = asyncio.Semaphore(args.concurrency)
+    workers = asyncio.Semaphore(args.workers or bot_app.workers)
+    start = time.perf_counter()
+    await asyncio.gather(*[
+        simulate_user(bot_app, client, FIRST_USER_ID + i, args, results, active_users, workers)
+        for i in range(args.users)
+    ])
+    elapsed = time.perf_counter() - start
+
+    # Auto-delete tasks and the like are not part of the measurement
+    pending = [task for task in asyncio.all_tasks() if task is not asyncio.current_task()]
+    for task in pending:
+        task.cancel()
+    await asyncio.gather(*pending, return_exceptions=True)
+    return results, elapsed
+
+def print_report(summary):
+    if summary['completed_flows'] or summary['failed_flows']:
+        print(f"\nUsers: {summary['users']}  completed flows: {summary['completed_flows']}  "
+              f"failed: {summary['failed_flows']}  unhandled updates: {summary['unhandled_updates']}")
+        print(f"Elapsed: {summary['elapsed_seconds']:.2f}s  updates/s: {summary['updates_per_second']:.1f}  "
+              f"flows/s: {summary['flows_per_second']:.1f}")
+    else:
+        print(f"\nUsers: {summary['users']}  updates: {summary['updates']}  "
+              f"unhandled updates: {summary['unhandled_updates']}")
+        print(f"Elapsed: {summary['elapsed_seconds']:.2f}s  updates/s: {summary['updates_per_second']:.1f}")
+    print(f"Response time incl. waiting for a worker: p50 {summary['response_p50_ms']:.2f}ms  "
+          f"p95 {summary['response_p95_ms']:.2f}ms  p99 {summary['response_p99_ms']:.2f}ms")
+    print(f"\n{'handler':<18}{'updates':>9}{'errors':>8}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}"
+          f"{'max ms':>10}{'calls/upd':>11}{'queries/upd':>13}")
+    for name, stats in summary['handlers'].items():
+        print(f"{name:<18}{stats['updates']:>9}{stats['errors']:>8}{stats['p50_ms']:>10.2f}{stats['p95_ms']:>10.2f}"
+              f"{stats['p99_ms']:>10.2f}{stats['max_ms']:>10.2f}{stats['api_calls_per_update']:>11.2f}"
+              f"{stats['queries_per_update']:>13.2f}")
+    if summary['background_api_calls']:
+        print(f"\nAPI calls outside handlers: {summary['background_api_calls']:.0f}")
+
+def main(argv=None):
+    args = parse_args(argv)
+    workdir = tempfile.mkdtemp(prefix='bot-loadtest-')
+    configure_environment(args, workdir)
+
+    # Project modules read the environment at import time
+    from database.models import get_db
+    from bot.bot import app
+    from bot.fake_client import FakeClient
+
+    seed_catalog(get_db(), args.courses, args.categories, random.Random(args.seed))
+    client = FakeClient(latency=args.latency, jitter=args.jitter, seed=args.seed)
+
+    print(f"Simulating {args.users} users ({args.concurrency} concurrent, {args.workers or app.workers} workers) "
+          f"against {os.environ['DATABASE_URL']}")
+    results, elapsed = app.loop.run_until_complete(run_load_test(app, client, args))
+    summary = results.summary(elapsed, args.users)
+    print_report(summary)
+
+    if args.json_path:
+        with open(args.json_path, 'w') as f:
+            json.dump(summary, f, indent=2)
+        print(f"\nResults written to {args.json_path}")
+
+if __name__ == "__main__":
+    main()
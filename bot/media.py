@@ -0,0 +1,169 @@
+import os
+import sys
+import asyncio
+import hashlib
+from urllib.parse import urlparse
+from sqlalchemy.exc import IntegrityError
+from pyrogram.errors import FileReferenceExpired, FileReferenceInvalid, FileIdInvalid, MediaEmpty
+from pyrogram.types import InputMediaPhoto
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from config.config import BASE_DIR, UPLOAD_FOLDER
+from database.models import get_db, MediaCache
+from utils import metrics
+
+# Errors meaning a cached file_id can no longer be used and the asset must be uploaded again
+STALE_FILE_ERRORS = (FileReferenceExpired, FileReferenceInvalid, FileIdInvalid, MediaEmpty)
+
+# Hosts that only the admin dashboard can reach; Telegram cannot fetch from them
+LOCAL_HOSTS = ('localhost', '127.0.0.1', '0.0.0.0')
+
+MEDIA_SENDS = metrics.counter('bot_media_sends_total', 'Photos sent by how the file reached Telegram', ['source'])
+
+# (asset, content_hash) -> file_id, in front of the media_cache table
+_file_ids = {}
+# path -> ((mtime, size), sha256), so unchanged files are not hashed again
+_hashes = {}
+# Assets being uploaded; concurrent first sends wait for the file_id instead of uploading again
+_uploads = {}
+
+def uploaded_path(link):
+    """Local file behind an image URL served by the admin dashboard's /uploads/ route, if it exists"""
+    path = urlparse(link).path
+    if not path.startswith('/uploads/'):
+        return None
+    local = os.path.join(UPLOAD_FOLDER, os.path.basename(path))
+    return local if os.path.isfile(local) else None
+
+def file_hash(path):
+    stat = os.stat(path)
+    version = (stat.st_mtime_ns, stat.st_size)
+    cached = _hashes.get(path)
+    if cached is not None and cached[0] == version:
+        return cached[1]
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(65536), b''):
+            digest.update(chunk)
+    _hashes[path] = (version, digest.hexdigest())
+    return digest.hexdigest()
+
+def resolve(asset):
+    """(source to upload from, cache key, content hash) of a local path or image URL.
+
+    Returns None for images Telegram cannot get: missing files and URLs on
+    local hosts that are not admin uploads.
+    """
+    if not asset:
+        return None
+    if asset.startswith(('http://', 'https://')):
+        local = uploaded_path(asset)
+        if local is None:
+            host = urlparse(asset).hostname or ''
+            if host in LOCAL_HOSTS or host.startswith('192.168.'):
+                return None
+            return asset, asset, ''
+        asset = local
+    if not os.path.isfile(asset):
+        return None
+    path = os.path.abspath(asset)
+    upload_folder = os.path.abspath(UPLOAD_FOLDER)
+    if path.startswith(upload_folder + os.sep):
+        key = 'uploads/' + os.path.relpath(path, upload_folder)
+    elif path.startswith(BASE_DIR + os.sep):
+        key = os.path.relpath(path, BASE_DIR)
+    else:
+        key = path
+    return path, key, file_hash(path)
+
+def cached_file_id(key, content_hash):
+    file_id = _file_ids.get((key, content_hash))
+    if file_id is None:
+        entry = get_db().query(MediaCache).filter_by(asset=key, content_hash=content_hash).first()
+        if entry is not None:
+            file_id = _file_ids[(key, content_hash)] = entry.file_id
+    return file_id
+
+def store_file_id(key, content_hash, file_id):
+    _file_ids[(key, content_hash)] = file_id
+    db = get_db()
+    entry = db.query(MediaCache).filter_by(asset=key, content_hash=content_hash).first()
+    if entry is None:
+        db.add(MediaCache(asset=key, content_hash=content_hash, file_id=file_id))
+    else:
+        entry.file_id = file_id
+    try:
+        db.commit()
+    except IntegrityError:
+        # Another process stored it first; either file_id works
+        db.rollback()
+
+def forget(key, content_hash):
+    _file_ids.pop((key, content_hash), None)
+    db = get_db()
+    db.query(MediaCache).filter_by(asset=key, content_hash=content_hash).delete()
+    db.commit()
+
+def can_send(asset):
+    """Whether send_photo can deliver an asset at all"""
+    return resolve(asset) is not None
+
+async def with_photo(asset, call):
+    """Run call(photo) with the cached file_id of an asset, uploading it the first time.
+
+    The first call uploads the file from disk (or lets Telegram fetch the URL)
+    and records the file_id Telegram returns; later calls for the same asset
+    and content go out by file_id without any upload. call must return the
+    message showing the photo.
+    """
+    if not isinstance(asset, str):
+        # In-memory images (one-off QR codes) are always unique
+        MEDIA_SENDS.labels('upload').inc()
+        return await call(asset)
+
+    resolved = resolve(asset)
+    if resolved is None:
+        raise FileNotFoundError(f"Image not available to Telegram: {asset}")
+    source, key, content_hash = resolved
+
+    file_id = cached_file_id(key, content_hash)
+    if file_id is not None:
+        try:
+            message = await call(file_id)
+            MEDIA_SENDS.labels('file_id').inc()
+            return message
+        except STALE_FILE_ERRORS as e:
+            print(f"Cached file_id for {key} no longer works ({e}), uploading again")
+            forget(key, content_hash)
+
+    pending = _uploads.get((key, content_hash))
+    if pending is not None:
+        # Wait for the upload of the same asset, then use its file_id
+        await asyncio.shield(pending)
+        if cached_file_id(key, content_hash) is not None:
+            return await with_photo(asset, call)
+
+    pending = _uploads[(key, content_hash)] = asyncio.get_running_loop().create_future()
+    try:
+        message = await call(source)
+        MEDIA_SENDS.labels('url' if source.startswith(('http://', 'https://')) else 'upload').inc()
+        if message is not None and message.photo is not None:
+            store_file_id(key, content_hash, message.photo.file_id)
+        return message
+    finally:
+        if _uploads.get((key, content_hash)) is pending:
+            del _uploads[(key, content_hash)]
+        pending.set_result(None)
+
+async def send_photo(client, chat_id, asset, **kwargs):
+    """Send a local image, image URL or file object, reusing the file_id of an earlier send"""
+    return await with_photo(asset, lambda photo: client.send_photo(chat_id=chat_id, photo=photo, **kwargs))
+
+async def edit_photo(client, message, asset, caption=None, parse_mode=None, reply_markup=None):
+    """Replace the photo and caption of a photo message in one call, reusing cached file_ids"""
+    return await with_photo(asset, lambda photo: client.edit_message_media(
+        chat_id=message.chat.id,
+        message_id=message.id,
+        media=InputMediaPhoto(photo, caption=caption or "", parse_mode=parse_mode),
+        reply_markup=reply_markup
+    ))
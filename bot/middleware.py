@@ -0,0 +1,84 @@
+import os
+import sys
+import time
+import functools
+from pyrogram.types import CallbackQuery
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from database import query_stats
+from database.models import session_scope
+from utils import metrics
+from bot import ledger, recorder, throttle
+
+HANDLER_LATENCY = metrics.histogram('bot_handler_duration_seconds', 'Time spent in bot handlers', ['handler'])
+HANDLER_ERRORS = metrics.counter('bot_handler_errors_total', 'Bot handlers that raised an exception', ['handler'])
+HANDLERS_IN_FLIGHT = metrics.gauge('bot_handlers_in_flight', 'Bot handlers currently running', ['handler'])
+HANDLER_QUERIES = metrics.counter('bot_handler_db_queries_total', 'Database queries run by bot handlers', ['handler'])
+THROTTLED = metrics.counter('bot_updates_throttled_total', 'Updates dropped by rate limiting or coalescing', ['handler', 'reason'])
+
+async def answer_callback(callback_query, text=None):
+    """Stop the button's loading spinner; failures (e.g. an expired query) are not fatal"""
+    try:
+        await callback_query.answer(text)
+    except Exception as e:
+        print(f"Error answering callback query: {e}")
+
+async def reject(update, name, verdict):
+    """Answer an update that is not handled because of rate limiting or coalescing"""
+    THROTTLED.labels(name, verdict).inc()
+    if isinstance(update, CallbackQuery):
+        await answer_callback(update, throttle.LIMITED_NOTICE if verdict == throttle.LIMITED else None)
+    elif verdict == throttle.LIMITED and throttle.should_notify(update.from_user.id):
+        try:
+            await update.reply(throttle.LIMITED_NOTICE, quote=True)
+        except Exception as e:
+            print(f"Error sending rate limit notice: {e}")
+
+def instrumented(func):
+    """Wrap a pyrogram handler with query tracking, Telegram call accounting and latency metrics.
+
+    Database sessions opened by the handler are closed when it returns, and the
+    update is written to the traffic log when recording is enabled. Updates
+    over the per-user/per-chat rate limit and repeated taps on the same button
+    are dropped (see bot/throttle.py); callback queries are answered before the
+    handler runs so the button's spinner stops right away.
+
+    Handlers that call each other directly (e.g. handle_text -> courses_command)
+    are counted towards the outermost handler.
+    """
+    name = func.__name__
+    latency = HANDLER_LATENCY.labels(name)
+    errors = HANDLER_ERRORS.labels(name)
+    in_flight = HANDLERS_IN_FLIGHT.labels(name)
+    queries = HANDLER_QUERIES.labels(name)
+
+    @functools.wraps(func)
+    async def wrapper(client, update, *args, **kwargs):
+        if query_stats.current_scope() is not None:
+            return await func(client, update, *args, **kwargs)
+
+        recorder.record(update)
+        verdict = throttle.admit(update)
+        if verdict != throttle.ADMIT:
+            await reject(update, name, verdict)
+            return None
+
+        user_id = update.from_user.id if getattr(update, 'from_user', None) else None
+        in_flight.inc()
+        start = time.perf_counter()
+        try:
+            with session_scope(), query_stats.track(name) as scope, ledger.interaction(name, user_id):
+                if isinstance(update, CallbackQuery):
+                    await answer_callback(update)
+                result = await func(client, update, *args, **kwargs)
+            queries.inc(scope.count)
+            return result
+        except Exception:
+            errors.inc()
+            raise
+        finally:
+            throttle.finished(update)
+            latency.observe(time.perf_counter() - start)
+            in_flight.dec()
+
+    return wrapper
@@ -0,0 +1,180 @@
+import os
+import sys
+import time
+import asyncio
+import contextvars
+from collections import deque
+from contextlib import contextmanager
+from pyrogram.errors import FloodWait
+from pyrogram.raw.types import InputPeerUser, InputPeerUserFromMessage
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from config.config import (
+    OUTBOUND_GLOBAL_RATE, OUTBOUND_GLOBAL_BURST, OUTBOUND_CHAT_RATE, OUTBOUND_CHAT_BURST,
+    OUTBOUND_GROUP_RATE, OUTBOUND_GROUP_BURST, OUTBOUND_MAX_FLOOD_WAIT
+)
+from utils import metrics
+from bot.throttle import TokenBucket, BucketMap
+
+# Priority lanes, highest first: replies to the user being served, then
+# notifications (approvals, admin alerts), then broadcasts
+INTERACTIVE = 'interactive'
+NOTIFICATION = 'notification'
+BROADCAST = 'broadcast'
+LANES = (INTERACTIVE, NOTIFICATION, BROADCAST)
+
+# Raw methods that count against Telegram's per-chat and global message limits
+SCHEDULED_METHODS = {'SendMessage', 'SendMedia', 'SendMultiMedia', 'EditMessage', 'ForwardMessages'}
+
+# Waiters looked at per lane when the oldest ones are blocked by their chat's limit
+SCAN_LIMIT = 200
+
+QUEUED = metrics.gauge('telegram_outbound_queued', 'Outgoing messages waiting for a send slot', ['lane'])
+QUEUE_WAIT = metrics.histogram('telegram_outbound_wait_seconds', 'Time outgoing messages waited for a send slot', ['lane'])
+RETRIES = metrics.counter('telegram_outbound_retries_total', 'Outgoing messages retried after a FloodWait', ['lane'])
+
+_current_lane = contextvars.ContextVar('telegram_outbound_lane', default=INTERACTIVE)
+
+@contextmanager
+def lane(name):
+    """Send the messages of the block through a lower (or higher) priority lane"""
+    token = _current_lane.set(name)
+    try:
+        yield
+    finally:
+        _current_lane.reset(token)
+
+def current_lane():
+    return _current_lane.get()
+
+def peer_key(query):
+    """(is_private, id) of the chat a raw query sends to, None if it has no peer"""
+    peer = getattr(query, 'peer', None) or getattr(query, 'to_peer', None)
+    if peer is None:
+        return None
+    if isinstance(peer, (InputPeerUser, InputPeerUserFromMessage)):
+        return (True, peer.user_id)
+    for attribute in ('chat_id', 'channel_id', 'user_id'):
+        value = getattr(peer, attribute, None)
+        if value is not None:
+            return (False, value)
+    return None
+
+class Waiter:
+    __slots__ = ('chat', 'future', 'queued_at')
+
+    def __init__(self, chat, future):
+        self.chat = chat
+        self.future = future
+        self.queued_at = time.monotonic()
+
+class OutboundScheduler:
+    """Hands out send slots within Telegram's global and per-chat message limits.
+
+    Every outgoing message waits in its lane until both the global bucket and
+    its chat's bucket have a token. Higher lanes are always served first, but a
+    waiter whose chat is still limited does not hold up waiters for other
+    chats, so the bot keeps sending at the full global rate. After a FloodWait
+    the chat is paused for the requested time and the background lanes back off
+    entirely, while interactive replies to other chats carry on.
+    """
+
+    def __init__(self, global_rate=OUTBOUND_GLOBAL_RATE, global_burst=OUTBOUND_GLOBAL_BURST,
+                 chat_rate=OUTBOUND_CHAT_RATE, chat_burst=OUTBOUND_CHAT_BURST,
+                 group_rate=OUTBOUND_GROUP_RATE, group_burst=OUTBOUND_GROUP_BURST):
+        self.global_bucket = TokenBucket(global_rate, global_burst)
+        self.chat_buckets = BucketMap(chat_rate, chat_burst)
+        self.group_buckets = BucketMap(group_rate, group_burst)
+        self.queues = {name: deque() for name in LANES}
+        self.background_hold_until = 0.0
+        self._wakeup = None
+        self._pump = None
+        for name in LANES:
+            QUEUED.labels(name).set_function(lambda name=name: len(self.queues[name]))
+
+    def bucket(self, chat):
+        if chat is None:
+            return None
+        private, chat_id = chat
+        return (self.chat_buckets if private else self.group_buckets).get(chat_id)
+
+    def pending(self):
+        return sum(len(queue) for queue in self.queues.values())
+
+    async def acquire(self, chat, lane_name=None):
+        """Wait for a slot to send one message to a chat (None for calls without a chat)"""
+        lane_name = lane_name or current_lane()
+        loop = asyncio.get_running_loop()
+        if self._pump is None or self._pump.done() or self._pump.get_loop() is not loop:
+            self._wakeup = asyncio.Event()
+            self._pump = loop.create_task(self._run())
+
+        waiter = Waiter(chat, loop.create_future())
+        self.queues[lane_name].append(waiter)
+        self._wakeup.set()
+        await waiter.future
+        QUEUE_WAIT.labels(lane_name).observe(time.monotonic() - waiter.queued_at)
+
+    def _grant(self, now):
+        """Resolve the next waiter that may send now; otherwise return seconds to wait"""
+        delay = self.global_bucket.wait_time(1, now)
+        if delay > 0:
+            return delay
+
+        for lane_name in LANES:
+            if lane_name != INTERACTIVE and now < self.background_hold_until:
+                delay = min(delay or float('inf'), self.background_hold_until - now)
+                break
+            queue = self.queues[lane_name]
+            index = 0
+            while index < len(queue) and index < SCAN_LIMIT:
+                waiter = queue[index]
+                if waiter.future.done():
+                    # Cancelled while waiting
+                    del queue[index]
+                    continue
+                bucket = self.bucket(waiter.chat)
+                wait = bucket.wait_time(1, now) if bucket is not None else 0.0
+                if wait == 0:
+                    del queue[index]
+                    if bucket is not None:
+                        bucket.consume(1, now)
+                    self.global_bucket.consume(1, now)
+                    waiter.future.set_result(None)
+                    return 0.0
+                delay = min(delay or float('inf'), wait)
+                index += 1
+        return delay or None
+
+    async def _run(self):
+        while True:
+            delay = self._grant(time.monotonic())
+            if delay == 0:
+                continue
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), delay)
+            except asyncio.TimeoutError:
+                pass
+
+    def flood_wait(self, chat, seconds, lane_name):
+        """Pause a chat (or everything, for calls without a chat) after a FloodWait"""
+        now = time.monotonic()
+        bucket = self.bucket(chat) or self.global_bucket
+        bucket.refill(now)
+        bucket.tokens = min(bucket.tokens, 0) - seconds * bucket.rate
+        if lane_name != INTERACTIVE or chat is None:
+            self.background_hold_until = max(self.background_hold_until, now + seconds)
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    def max_wait(self, lane_name, sleep_threshold):
+        """Longest FloodWait waited out: the client's threshold for replies, longer for the rest"""
+        if lane_name == INTERACTIVE:
+            return sleep_threshold
+        return max(sleep_threshold, OUTBOUND_MAX_FLOOD_WAIT)
+
+scheduler = OutboundScheduler()
+
+def is_scheduled(query):
+    return type(query).__name__ in SCHEDULED_METHODS
@@ -0,0 +1,123 @@
+import os
+import sys
+import gzip
+import hmac
+import json
+import time
+import atexit
+import hashlib
+import datetime
+from pyrogram.types import CallbackQuery
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from config.config import TRAFFIC_RECORD_DIR, TRAFFIC_RECORD_SALT
+
+# Buffered events are flushed to disk at most this often
+FLUSH_INTERVAL = 5.0
+
+# Texts recorded verbatim (keyboard buttons); any other free text only keeps its length
+known_texts = set()
+
+def anonymize(user_id, salt):
+    """Stable pseudonym of a Telegram user id"""
+    return hmac.new(salt, str(user_id).encode(), hashlib.sha256).hexdigest()[:12]
+
+def to_event(update, salt):
+    """Compact, anonymized description of an incoming update, or None for other updates.
+
+    Events look like {"t": 1760000000.123, "u": "3f2a...", "k": "cb", "d": "1cDA"}
+    with k one of cb (callback data in d, p=1 if pressed on a photo message),
+    cmd (command in d, n = length of its arguments), text (button text in d,
+    or just the length n of free text) and photo (payment proof).
+    """
+    if getattr(update, 'from_user', None) is None:
+        return None
+    event = {'t': round(time.time(), 3), 'u': anonymize(update.from_user.id, salt)}
+
+    if isinstance(update, CallbackQuery):
+        event['k'] = 'cb'
+        event['d'] = update.data
+        if update.message is not None and update.message.photo:
+            event['p'] = 1
+    elif update.photo:
+        event['k'] = 'photo'
+    elif update.text is not None:
+        text = update.text
+        if text.startswith('/'):
+            command, _, arguments = text.partition(' ')
+            event['k'] = 'cmd'
+            event['d'] = command.split('@', 1)[0]
+            if arguments:
+                event['n'] = len(arguments)
+        elif text in known_texts:
+            event['k'] = 'text'
+            event['d'] = text
+        else:
+            event['k'] = 'text'
+            event['n'] = len(text)
+    else:
+        return None
+    return event
+
+def traffic_path(directory, day):
+    """Path of the traffic log of one day"""
+    return os.path.join(directory, f"traffic-{day.isoformat()}.jsonl.gz")
+
+class TrafficRecorder:
+    """Appends anonymized update events to daily gzip JSONL files"""
+
+    def __init__(self, directory, salt=None):
+        self.directory = directory
+        # Without a configured salt pseudonyms are only stable until the next restart
+        self.salt = salt.encode() if salt else os.urandom(16)
+        self._file = None
+        self._day = None
+        self._last_flush = 0.0
+        os.makedirs(directory, exist_ok=True)
+
+    def record(self, update):
+        event = to_event(update, self.salt)
+        if event is None:
+            return
+        day = datetime.date.today()
+        if day != self._day:
+            self.close()
+            # Appending starts a new gzip member; readers handle multi-member files
+            self._file = gzip.open(traffic_path(self.directory, day), 'at', encoding='utf-8')
+            self._day = day
+        self._file.write(json.dumps(event, ensure_ascii=False, separators=(',', ':')) + "\n")
+
+        now = time.monotonic()
+        if now - self._last_flush > FLUSH_INTERVAL:
+            self._file.flush()
+            self._last_flush = now
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+recorder = TrafficRecorder(TRAFFIC_RECORD_DIR, TRAFFIC_RECORD_SALT) if TRAFFIC_RECORD_DIR else None
+if recorder is not None:
+    atexit.register(recorder.close)
+
+def record(update):
+    """Record an incoming update if traffic recording is enabled"""
+    if recorder is None:
+        return
+    try:
+        recorder.record(update)
+    except Exception as e:
+        print(f"Error recording update: {e}")
+
+def read_events(paths):
+    """Events of one or more traffic logs, in file order"""
+    for path in paths:
+        try:
+            with gzip.open(path, 'rt', encoding='utf-8') as f:
+                for line in f:
+                    if line.strip():
+                        yield json.loads(line)
+        except (EOFError, gzip.BadGzipFile, json.JSONDecodeError) as e:
+            # The bot was stopped mid-write; everything before that point is still usable
+            print(f"Stopped reading {path} early: {e}")
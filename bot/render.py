@@ -0,0 +1,123 @@
+import os
+import sys
+import asyncio
+import hashlib
+from collections import OrderedDict
+from pyrogram.errors import MessageNotModified
+from pyrogram.types import InlineKeyboardMarkup
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from bot import media
+from utils import metrics
+
+# Longest text Telegram accepts as a photo caption
+CAPTION_LIMIT = 1024
+# Messages whose current screen is remembered
+TRACKED_MESSAGES = 10000
+
+RENDERS = metrics.counter('bot_screen_renders_total', 'Screen changes by the API call that applied them', ['method'])
+
+# (chat_id, message_id) -> (fingerprint of the screen, photo asset) the message shows, most recently used last
+_shown = OrderedDict()
+
+def fingerprint(text, photo, reply_markup, parse_mode):
+    """Digest of a screen, None when it cannot be compared (in-memory photos)"""
+    if photo is not None and not isinstance(photo, str):
+        return None
+    digest = hashlib.sha1()
+    for part in (text, photo or '', str(reply_markup) if reply_markup else '', str(parse_mode)):
+        digest.update(part.encode())
+        digest.update(b'\0')
+    return digest.hexdigest()
+
+def remember(message, screen, photo=None):
+    if message is None:
+        return
+    key = (message.chat.id, message.id)
+    _shown.pop(key, None)
+    if screen is not None:
+        _shown[key] = (screen, photo)
+        if len(_shown) > TRACKED_MESSAGES:
+            _shown.popitem(last=False)
+
+def forget(message):
+    _shown.pop((message.chat.id, message.id), None)
+
+async def replace(client, message, text, photo, reply_markup, parse_mode):
+    """Send the screen as a new message and delete the old one, both at once"""
+    async def delete():
+        try:
+            await message.delete()
+        except Exception as e:
+            print(f"Error deleting message: {e}")
+    forget(message)
+    if photo is not None:
+        send = media.send_photo(client, message.chat.id, photo, caption=text, reply_markup=reply_markup, parse_mode=parse_mode)
+    else:
+        send = client.send_message(chat_id=message.chat.id, text=text, reply_markup=reply_markup, parse_mode=parse_mode)
+    sent, _ = await asyncio.gather(send, delete())
+    return sent
+
+async def show(client, message, text, photo=None, reply_markup=None, parse_mode=None, keep_photo=True, fallback_text=None):
+    """Turn one of the bot's messages into a new screen, in a single API call where Telegram allows it.
+
+    Text screens are edited in place; a photo message showing a text screen
+    keeps its photo and gets the text as caption (unless keep_photo is False);
+    a new photo on a photo message is swapped with edit_message_media. Only a
+    photo on a text message (Telegram cannot add media to it) or a reply
+    keyboard needs a new message. Nothing is sent when the message already
+    shows the same screen. If the photo cannot be sent, fallback_text (or
+    text) is shown without it. Returns the message showing the screen.
+    """
+    if photo is not None and len(text) > CAPTION_LIMIT:
+        photo = None
+    screen = fingerprint(text, photo, reply_markup, parse_mode)
+    shown_screen, shown_photo = _shown.get((message.chat.id, message.id), (None, None))
+    if screen is not None and shown_screen == screen:
+        _shown.move_to_end((message.chat.id, message.id))
+        RENDERS.labels('skipped').inc()
+        return message
+
+    inline = reply_markup is None or isinstance(reply_markup, InlineKeyboardMarkup)
+    has_photo = message.photo is not None
+    try:
+        if not inline or (photo is not None and not has_photo):
+            method = 'resend'
+            shown = await replace(client, message, text, photo, reply_markup, parse_mode)
+        elif photo is not None and photo == shown_photo:
+            # The photo is already there, only the caption changes
+            method = 'edit_caption'
+            shown = await message.edit_caption(text, parse_mode=parse_mode, reply_markup=reply_markup)
+        elif photo is not None:
+            method = 'edit_media'
+            shown = await media.edit_photo(client, message, photo, caption=text, parse_mode=parse_mode, reply_markup=reply_markup)
+        elif has_photo and keep_photo and len(text) <= CAPTION_LIMIT:
+            method = 'edit_caption'
+            shown = await message.edit_caption(text, parse_mode=parse_mode, reply_markup=reply_markup)
+        elif has_photo:
+            method = 'resend'
+            shown = await replace(client, message, text, None, reply_markup, parse_mode)
+        else:
+            method = 'edit_text'
+            shown = await message.edit_text(text, parse_mode=parse_mode, reply_markup=reply_markup)
+    except MessageNotModified:
+        RENDERS.labels('skipped').inc()
+        remember(message, screen, photo or shown_photo)
+        return message
+    except Exception as e:
+        if photo is None:
+            raise
+        print(f"Error showing photo, falling back to text: {e}")
+        text = fallback_text or text
+        if method == 'resend':
+            # The old message is already gone
+            shown = await client.send_message(chat_id=message.chat.id, text=text, reply_markup=reply_markup, parse_mode=parse_mode)
+            RENDERS.labels(method).inc()
+            remember(shown, fingerprint(text, None, reply_markup, parse_mode))
+            return shown
+        return await show(client, message, text, reply_markup=reply_markup, parse_mode=parse_mode, keep_photo=keep_photo)
+
+    RENDERS.labels(method).inc()
+    # A caption edit keeps the photo that was there
+    remember(shown, screen, photo if photo is not None or method != 'edit_caption' else shown_photo)
+    return shown
@@ -0,0 +1,190 @@
+"""Replay recorded bot traffic against a local database.
+
+Feeds traffic logs written by bot/recorder.py (TRAFFIC_RECORD_DIR) back
+through the real handlers using FakeClient, at the recorded pace or faster,
+and reports per-handler latency like bot/loadtest.py:
+
+    python -m bot.replay traffic/traffic-2026-10-*.jsonl.gz --speed 10
+
+Each user's updates are replayed in order; different users run concurrently.
+Without --database a temporary SQLite catalog is seeded with every course and
+category id the recorded callbacks refer to.
+"""
+import os
+import sys
+import json
+import time
+import random
+import asyncio
+import argparse
+import tempfile
+from collections import defaultdict
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from bot.loadtest import (
+    FIRST_USER_ID, Results, configure_environment, seed_catalog, percentile, send, print_report
+)
+
+# Updates starting later than this after their recorded time count as late
+LATE_THRESHOLD = 0.01
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Replay recorded bot traffic through the handlers")
+    parser.add_argument('paths', nargs='+', help="Traffic logs (traffic-YYYY-MM-DD.jsonl.gz)")
+    parser.add_argument('--speed', type=float, default=1.0, help="Replay speed factor, 0 for as fast as possible")
+    parser.add_argument('--workers', type=int, default=None, help="Updates handled at the same time (default: the bot's setting)")
+    parser.add_argument('--latency', type=float, default=0.0, help="Mean simulated Telegram API latency in seconds")
+    parser.add_argument('--jitter', type=float, default=0.0, help="Standard deviation of the simulated latency")
+    parser.add_argument('--seed', type=int, default=1, help="Random seed for filler text and latency")
+    parser.add_argument('--database', default=None, help="Database URL (default: a fresh temporary SQLite file)")
+    parser.add_argument('--json', dest='json_path', default=None, help="Also write the results as JSON to this file")
+    return parser.parse_args(argv)
+
+def referenced_ids(events, bot):
+    """Highest course and category ids the recorded callbacks refer to"""
+    from bot.callbacks import InvalidCallback
+
+    max_course = max_category = 0
+    for event in events:
+        if event['k'] != 'cb':
+            continue
+        try:
+            op, args = bot.router.decode(event.get('d'))
+        except InvalidCallback:
+            # Recorded before the callback format changed; the bot rejects it too
+            continue
+        ids = [arg for arg in args if isinstance(arg, int)]
+        if not ids:
+            continue
+        if op is bot.CB_VIEW_CATEGORY_COURSES:
+            max_category = max(max_category, ids[-1])
+        else:
+            max_course = max(max_course, ids[-1])
+    return max_course, max_category
+
+class Replayer:
+    """Turns recorded events back into updates for one run"""
+
+    def __init__(self, bot_app, client, workers, results, words, rng):
+        self.bot_app = bot_app
+        self.client = client
+        self.workers = workers
+        self.results = results
+        self.words = words or ["course"]
+        self.rng = rng
+        self.lags = []
+
+    def filler(self, length):
+        """Stand-in for anonymized free text: catalog words, so searches still hit rows"""
+        text = self.rng.choice(self.words)
+        while len(text) < length:
+            text += " " + self.rng.choice(self.words)
+        return text
+
+    def update_for(self, event, user):
+        from bot.fake_client import make_text_message, make_photo_message, make_callback_query
+
+        kind = event['k']
+        if kind == 'photo':
+            return make_photo_message(self.client, user)
+        if kind == 'cmd':
+            text = event['d'] + (" " + self.filler(event['n']) if event.get('n') else "")
+            return make_text_message(self.client, user, text)
+        if kind == 'text':
+            return make_text_message(self.client, user, event.get('d') or self.filler(event.get('n', 1)))
+
+        # A callback acts on the bot's last message in the chat; recreate one if it is missing
+        message = self.client.last_reply(user.id)
+        if message is None or bool(message.photo) != bool(event.get('p')):
+            photo = self.client.new_photo() if event.get('p') else None
+            message = self.client.new_message(user.id, text=None if photo else "…", photo=photo)
+        return make_callback_query(self.client, user, message, event['d'])
+
+    async def replay_user(self, user, events, t0, start, speed):
+        loop = asyncio.get_running_loop()
+        for event in events:
+            if speed:
+                delay = start + (event['t'] - t0) / speed - loop.time()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                elif -delay > LATE_THRESHOLD:
+                    self.lags.append(-delay)
+            # Failed or unhandled updates are counted by send(); keep going like the bot would
+            await send(self.bot_app, self.client, self.update_for(event, user), self.results, self.workers)
+
+async def run_replay(replayer, streams, t0, speed):
+    from bot.fake_client import make_user
+
+    await asyncio.sleep(0)  # Let the handler registrations scheduled by @app.on_message run
+    loop = asyncio.get_running_loop()
+    start = loop.time()
+    wall_start = time.perf_counter()
+    await asyncio.gather(*[
+        replayer.replay_user(make_user(FIRST_USER_ID + index), events, t0, start, speed)
+        for index, events in enumerate(streams.values())
+    ])
+    elapsed = time.perf_counter() - wall_start
+
+    pending = [task for task in asyncio.all_tasks() if task is not asyncio.current_task()]
+    for task in pending:
+        task.cancel()
+    await asyncio.gather(*pending, return_exceptions=True)
+    return elapsed
+
+def main(argv=None):
+    args = parse_args(argv)
+    workdir = tempfile.mkdtemp(prefix='bot-replay-')
+    configure_environment(args, workdir)
+
+    # Project modules read the environment at import time
+    from bot.recorder import read_events
+    from bot import bot
+    from bot.fake_client import FakeClient
+    from database.models import get_db, Course
+
+    events = sorted(read_events(args.paths), key=lambda event: event['t'])
+    if not events:
+        raise SystemExit("No events to replay")
+
+    db = get_db()
+    if not args.database:
+        max_course, max_category = referenced_ids(events, bot)
+        seed_catalog(db, max(max_course, 10), max(max_category, 1), random.Random(args.seed))
+    words = sorted({word.lower() for (title,) in db.query(Course.title) for word in title.split() if word.isalpha()})
+
+    streams = defaultdict(list)
+    for event in events:
+        streams[event['u']].append(event)
+
+    client = FakeClient(latency=args.latency, jitter=args.jitter, seed=args.seed)
+    results = Results()
+    workers = asyncio.Semaphore(args.workers or bot.app.workers)
+    replayer = Replayer(bot.app, client, workers, results, words, random.Random(args.seed))
+
+    recorded = events[-1]['t'] - events[0]['t']
+    print(f"Replaying {len(events)} updates from {len(streams)} users ({recorded:.0f}s recorded) "
+          f"at {'full' if not args.speed else f'{args.speed:g}x'} speed against {os.environ['DATABASE_URL']}")
+    elapsed = bot.app.loop.run_until_complete(run_replay(replayer, streams, events[0]['t'], args.speed))
+
+    summary = results.summary(elapsed, len(streams))
+    lags = sorted(replayer.lags)
+    summary['replay'] = {
+        'events': len(events),
+        'recorded_seconds': recorded,
+        'speed': args.speed,
+        'late_updates': len(lags),
+        'lag_p95_ms': percentile(lags, 0.95) * 1000,
+        'lag_max_ms': lags[-1] * 1000 if lags else 0.0
+    }
+    print_report(summary)
+    if lags:
+        print(f"\n{len(lags)} updates started late (p95 {summary['replay']['lag_p95_ms']:.1f}ms, "
+              f"max {summary['replay']['lag_max_ms']:.1f}ms): the handlers could not keep up at this speed")
+
+    if args.json_path:
+        with open(args.json_path, 'w') as f:
+            json.dump(summary, f, indent=2)
+        print(f"\nResults written to {args.json_path}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,138 @@
+import os
+import sys
+import time
+from collections import OrderedDict
+from pyrogram.types import CallbackQuery
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from config.config import (
+    THROTTLE_USER_RATE, THROTTLE_USER_BURST, THROTTLE_CHAT_RATE, THROTTLE_CHAT_BURST,
+    CALLBACK_COALESCE_SECONDS
+)
+
+# Outcomes of admit()
+ADMIT = 'admit'
+LIMITED = 'limited'
+DUPLICATE = 'duplicate'
+
+# Buckets kept per key type; idle users are dropped first (a dropped bucket comes back full)
+MAX_BUCKETS = 50000
+
+LIMITED_NOTICE = "⏳ You're going too fast, please wait a moment."
+
+class TokenBucket:
+    """Allows `rate` events per second on average and bursts of up to `capacity`"""
+    __slots__ = ('rate', 'capacity', 'tokens', 'updated')
+
+    def __init__(self, rate, capacity, now=None):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = float(capacity)
+        self.updated = time.monotonic() if now is None else now
+
+    def refill(self, now=None):
+        now = time.monotonic() if now is None else now
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        return self.tokens
+
+    def consume(self, amount=1, now=None):
+        """Take tokens if there are enough; returns whether it did"""
+        if self.refill(now) < amount:
+            return False
+        self.tokens -= amount
+        return True
+
+    def wait_time(self, amount=1, now=None):
+        """Seconds until `amount` tokens are available"""
+        missing = amount - self.refill(now)
+        return max(0.0, missing / self.rate) if self.rate else float('inf')
+
+class BucketMap:
+    """Token buckets by key with LRU eviction"""
+
+    def __init__(self, rate, capacity, max_size=MAX_BUCKETS):
+        self.rate = rate
+        self.capacity = capacity
+        self.max_size = max_size
+        self.buckets = OrderedDict()
+
+    def get(self, key):
+        bucket = self.buckets.pop(key, None)
+        if bucket is None:
+            bucket = TokenBucket(self.rate, self.capacity)
+        self.buckets[key] = bucket
+        if len(self.buckets) > self.max_size:
+            self.buckets.popitem(last=False)
+        return bucket
+
+user_buckets = BucketMap(THROTTLE_USER_RATE, THROTTLE_USER_BURST)
+chat_buckets = BucketMap(THROTTLE_CHAT_RATE, THROTTLE_CHAT_BURST)
+
+# Callbacks being handled and when identical ones last finished, by (user, message, data)
+_callbacks_in_flight = set()
+_recent_callbacks = OrderedDict()
+
+# Users who were told to slow down since their last admitted update
+_notified_users = set()
+
+def callback_key(callback_query):
+    message_id = callback_query.message.id if callback_query.message else None
+    return (callback_query.from_user.id, message_id, callback_query.data)
+
+def chat_id(update):
+    message = update.message if isinstance(update, CallbackQuery) else update
+    return message.chat.id if message is not None and message.chat else None
+
+def is_duplicate(key, now):
+    """Whether an identical callback is running or finished within the coalescing window"""
+    while _recent_callbacks:
+        _, finished_at = next(iter(_recent_callbacks.items()))
+        if now - finished_at < CALLBACK_COALESCE_SECONDS:
+            break
+        _recent_callbacks.popitem(last=False)
+    return key in _callbacks_in_flight or key in _recent_callbacks
+
+def admit(update):
+    """Decide whether an update is handled: ADMIT, LIMITED or DUPLICATE"""
+    user = getattr(update, 'from_user', None)
+    if user is None:
+        return ADMIT
+    now = time.monotonic()
+
+    if isinstance(update, CallbackQuery) and CALLBACK_COALESCE_SECONDS > 0:
+        key = callback_key(update)
+        if is_duplicate(key, now):
+            return DUPLICATE
+
+    user_bucket = user_buckets.get(user.id)
+    chat = chat_id(update)
+    chat_bucket = chat_buckets.get(chat) if chat is not None and chat != user.id else None
+    if user_bucket.refill(now) < 1 or (chat_bucket is not None and chat_bucket.refill(now) < 1):
+        return LIMITED
+    user_bucket.consume(1, now)
+    if chat_bucket is not None:
+        chat_bucket.consume(1, now)
+
+    _notified_users.discard(user.id)
+    if isinstance(update, CallbackQuery) and CALLBACK_COALESCE_SECONDS > 0:
+        _callbacks_in_flight.add(callback_key(update))
+    return ADMIT
+
+def finished(update):
+    """Mark an admitted callback as done, starting its coalescing window"""
+    if not isinstance(update, CallbackQuery) or CALLBACK_COALESCE_SECONDS <= 0:
+        return
+    key = callback_key(update)
+    _callbacks_in_flight.discard(key)
+    _recent_callbacks.pop(key, None)
+    _recent_callbacks[key] = time.monotonic()
+
+def should_notify(user_id):
+    """Tell a limited user to slow down once per streak of dropped updates"""
+    if user_id in _notified_users:
+        return False
+    _notified_users.add(user_id)
+    if len(_notified_users) > MAX_BUCKETS:
+        _notified_users.clear()
+    return True
@@ -0,0 +1,65 @@
+import os
+import sys
+import time
+from collections import namedtuple
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from config.config import VIEW_CACHE_SECONDS
+from database.models import get_db, get_catalog_version
+from utils import metrics, settings
+
+# A screen as sent to Telegram: text (or caption), parse mode and inline keyboard
+Screen = namedtuple('Screen', ['text', 'parse_mode', 'reply_markup'])
+
+# Everything the course screens need, so handlers do not touch the ORM.
+# photo is None when there is no image Telegram can get; note_text is the
+# details text for when the image cannot be shown.
+CourseView = namedtuple('CourseView', [
+    'course_id', 'title', 'price', 'is_free', 'photo', 'details', 'note_text', 'payment'
+])
+
+VIEW_LOOKUPS = metrics.counter('bot_view_cache_lookups_total', 'Cached screen lookups by result', ['result'])
+
+# key -> view, all built for _version
+_views = {}
+_version = None
+_checked = 0.0
+
+def catalog_version():
+    """Catalog version, read from the database at most every VIEW_CACHE_SECONDS.
+
+    The settings version is part of it, since the payment screens show the
+    payment methods configured on the admin's /settings page.
+    """
+    global _version, _checked
+    now = time.monotonic()
+    if _version is None or now - _checked >= VIEW_CACHE_SECONDS:
+        version = (get_catalog_version(get_db()), settings.version())
+        if version != _version:
+            _views.clear()
+            _version = version
+        _checked = now
+    return _version
+
+def cached(key, build):
+    """View for key at the current catalog version, built by build() on first use.
+
+    Views are shared between all users and must not be modified. None (a
+    missing course) is returned but not cached.
+    """
+    catalog_version()
+    view = _views.get(key)
+    if view is not None:
+        VIEW_LOOKUPS.labels('hit').inc()
+        return view
+    VIEW_LOOKUPS.labels('miss').inc()
+    view = build()
+    if view is not None:
+        _views[key] = view
+    return view
+
+def invalidate():
+    """Drop all views and read the catalog version again on the next lookup"""
+    global _version
+    _views.clear()
+    _version = None
@@ -18,7 +18,7 @@ ADMIN_USERNAME = os.getenv('ADMIN_USERNAME', 'admin')
 ADMIN_PASSWORD = os.getenv('ADMIN_PASSWORD', 'admin123')  # Change in production
 
 # Uploads folder
-UPLOAD_FOLDER = os.path.join(BASE_DIR, 'uploads')
+UPLOAD_FOLDER = os.getenv('UPLOAD_FOLDER', os.path.join(BASE_DIR, 'uploads'))
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
 
 # Database Configuration
@@ -36,6 +36,69 @@ WELCOME_MESSAGE = os.getenv('WELCOME_MESSAGE', 'Welcome to the Course Delivery B
 AUTO_DELETE_SECONDS = int(os.getenv('AUTO_DELETE_SECONDS', '300'))  # Delete messages after 5 minutes by default
 AUTO_APPROVE = os.getenv('AUTO_APPROVE', 'false').lower() == 'true'  # Auto-approve payments (False by default)
 BOT_PASSWORD = ''  # No password by default
+PURCHASES_PAGE_SIZE = int(os.getenv('PURCHASES_PAGE_SIZE', '10'))  # Purchases per page of "👤 My Purchases", keeps each page under Telegram's message length limit
+
+# Log retention
+LOG_RETENTION_DAYS = int(os.getenv('LOG_RETENTION_DAYS', '90'))  # Raw log rows older than this are archived
+LOG_RETENTION_BATCH_SIZE = int(os.getenv('LOG_RETENTION_BATCH_SIZE', '5000'))  # Rows archived and deleted per transaction
+LOG_RETENTION_WEB_BATCHES = int(os.getenv('LOG_RETENTION_WEB_BATCHES', '4'))  # Batches per run from the dashboard, well within the web worker's timeout
+LOG_ARCHIVE_DIR = os.getenv('LOG_ARCHIVE_DIR', os.path.join(BASE_DIR, 'log_archive'))  # Compressed JSONL archives
+
+# Query instrumentation
+QUERY_WARN_COUNT = int(os.getenv('QUERY_WARN_COUNT', '20'))  # Warn when a handler/request runs more queries than this
+QUERY_WARN_MS = float(os.getenv('QUERY_WARN_MS', '250'))  # Warn when a handler/request spends longer than this in SQL
+N_PLUS_ONE_THRESHOLD = int(os.getenv('N_PLUS_ONE_THRESHOLD', '5'))  # Repeats of one statement that count as N+1
+QUERY_STATS_STRICT = os.getenv('QUERY_STATS_STRICT', 'false').lower() == 'true'  # Raise on N+1 patterns (tests)
+
+# Metrics
+TELEGRAM_CALL_BUDGET = int(os.getenv('TELEGRAM_CALL_BUDGET', '3'))  # Telegram API calls one update may cost before it is flagged
+BOT_METRICS_HOST = os.getenv('BOT_METRICS_HOST', '127.0.0.1')
+BOT_METRICS_PORT = int(os.getenv('BOT_METRICS_PORT', '9100'))  # Local port serving the bot's /metrics, 0 to disable
+METRICS_TOKEN = os.getenv('METRICS_TOKEN', '')  # Bearer token for the admin /metrics endpoint (admin login otherwise)
+
+# Rate limiting (see bot/throttle.py)
+THROTTLE_USER_RATE = float(os.getenv('THROTTLE_USER_RATE', '1'))  # Updates per second a user can sustain
+THROTTLE_USER_BURST = int(os.getenv('THROTTLE_USER_BURST', '5'))  # Updates a user can send in a quick burst
+THROTTLE_CHAT_RATE = float(os.getenv('THROTTLE_CHAT_RATE', '2'))  # Updates per second handled per chat
+THROTTLE_CHAT_BURST = int(os.getenv('THROTTLE_CHAT_BURST', '10'))
+CALLBACK_COALESCE_SECONDS = float(os.getenv('CALLBACK_COALESCE_SECONDS', '1.0'))  # Identical button taps within this window run once
+
+# Update dispatching (see bot/dispatcher.py)
+UPDATE_CONCURRENCY = int(os.getenv('UPDATE_CONCURRENCY', '0'))  # Updates handled at once across users, 0 for pyrogram's worker count
+UPDATE_QUEUE_DEPTH = int(os.getenv('UPDATE_QUEUE_DEPTH', '20'))  # Updates of one user waiting their turn; more are dropped
+
+# Outbound message scheduling (see bot/outbound.py)
+OUTBOUND_GLOBAL_RATE = float(os.getenv('OUTBOUND_GLOBAL_RATE', '30'))  # Messages per second the bot sends across all chats
+OUTBOUND_GLOBAL_BURST = int(os.getenv('OUTBOUND_GLOBAL_BURST', '30'))
+OUTBOUND_CHAT_RATE = float(os.getenv('OUTBOUND_CHAT_RATE', '1'))  # Messages per second sent to one private chat
+OUTBOUND_CHAT_BURST = int(os.getenv('OUTBOUND_CHAT_BURST', '3'))
+OUTBOUND_GROUP_RATE = float(os.getenv('OUTBOUND_GROUP_RATE', '0.33'))  # Messages per second sent to one group or channel (20 a minute)
+OUTBOUND_GROUP_BURST = int(os.getenv('OUTBOUND_GROUP_BURST', '3'))
+OUTBOUND_MAX_FLOOD_WAIT = int(os.getenv('OUTBOUND_MAX_FLOOD_WAIT', '600'))  # Longest FloodWait notifications and broadcasts wait out before failing
+
+# Broadcasts (see bot/broadcast.py)
+BROADCAST_BATCH_SIZE = int(os.getenv('BROADCAST_BATCH_SIZE', '100'))  # Users loaded and recorded per batch; at most this many are resent after a crash
+BROADCAST_CONCURRENCY = int(os.getenv('BROADCAST_CONCURRENCY', '30'))  # Broadcast messages in flight at once (the outbound scheduler sets the pace)
+BROADCAST_POLL_SECONDS = float(os.getenv('BROADCAST_POLL_SECONDS', '5'))  # How often the bot checks for new, paused or resumed broadcasts
+
+# Change feed from the admin dashboard (see bot/changes.py)
+CHANGE_FEED_POLL_SECONDS = float(os.getenv('CHANGE_FEED_POLL_SECONDS', '1'))  # How often the bot looks for admin changes without LISTEN/NOTIFY
+CHANGE_FEED_LISTEN_SECONDS = float(os.getenv('CHANGE_FEED_LISTEN_SECONDS', '30'))  # Fallback poll interval on Postgres, where NOTIFY wakes the bot
+CHANGE_FEED_BATCH_SIZE = int(os.getenv('CHANGE_FEED_BATCH_SIZE', '100'))  # Change events read per query
+CHANGE_FEED_MAX_ATTEMPTS = int(os.getenv('CHANGE_FEED_MAX_ATTEMPTS', '5'))  # Tries of an event whose handler fails (e.g. a course that could not be sent)
+CHANGE_FEED_RETRY_SECONDS = float(os.getenv('CHANGE_FEED_RETRY_SECONDS', '30'))  # Wait before the first retry, doubled after each further failure
+
+# Cached screens and settings (see bot/views.py and utils/settings.py)
+VIEW_CACHE_SECONDS = float(os.getenv('VIEW_CACHE_SECONDS', '5'))  # How often the bot checks whether the catalog changed
+SETTINGS_CACHE_SECONDS = float(os.getenv('SETTINGS_CACHE_SECONDS', '5'))  # How often the bot checks whether the admin saved new settings
+
+# Memory diagnostics (see bot/diagnostics.py)
+DIAGNOSTICS_TOKEN = os.getenv('DIAGNOSTICS_TOKEN', '')  # Bearer token for /debug/memory on the bot metrics port, empty to disable
+TRACEMALLOC_FRAMES = int(os.getenv('TRACEMALLOC_FRAMES', '0'))  # Trace allocations from startup with this many frames, 0 to start on first report
+
+# Traffic recording (see bot/recorder.py)
+TRAFFIC_RECORD_DIR = os.getenv('TRAFFIC_RECORD_DIR', '')  # Directory for anonymized update logs, empty to disable
+TRAFFIC_RECORD_SALT = os.getenv('TRAFFIC_RECORD_SALT', '')  # Keeps anonymized user ids stable across restarts
 
 # Payment Options
 PAYMENT_OPTIONS = {
@@ -49,6 +112,28 @@ PAYMENT_OPTIONS = {
 # Bot configuration
 BOT_NAME = os.getenv('BOT_NAME', 'Course Delivery Bot')
 
+# UPI QR codes (see utils/upi_qr.py)
+UPI_PAYEE_NAME = os.getenv('UPI_PAYEE_NAME', BOT_NAME)  # Name the payer's UPI app shows
+UPI_QR_REFERENCE = os.getenv('UPI_QR_REFERENCE', 'false').lower() == 'true'  # Give every UPI payment its own QR with a reference
+QR_CACHE_DIR = os.getenv('QR_CACHE_DIR', os.path.join(BASE_DIR, 'qr_cache'))  # Rendered QR codes, one file per UPI ID and amount
+QR_CACHE_SIZE = int(os.getenv('QR_CACHE_SIZE', '128'))  # Rendered QR codes kept in memory
+
+# Course delivery links (see utils/links.py)
+PUBLIC_BASE_URL = os.getenv('PUBLIC_BASE_URL', '').rstrip('/')  # Public URL of the admin dashboard serving /l/ links, empty to send course links as they are
+LINK_SECRET = os.getenv('LINK_SECRET', '')  # Key signing course links; the bot and the dashboard must share it
+LINK_TTL = int(os.getenv('LINK_TTL', '86400'))  # Seconds a course link works; "My Purchases" hands out fresh ones
+
+# Course files (see bot/delivery.py)
+STORAGE_CHANNEL_ID = int(os.getenv('STORAGE_CHANNEL_ID', '0'))  # Channel (e.g. -1001234567890) holding course files, the bot must be an admin; 0 if unused
+
+# Link shortener for course links when PUBLIC_BASE_URL is not set (see utils/shortener.py)
+SHORTENER_URL = os.getenv('SHORTENER_URL', 'https://tinyurl.com/api-create.php')  # GET ?url=<long url> returns the short URL, empty to disable
+SHORTENER_TIMEOUT = float(os.getenv('SHORTENER_TIMEOUT', '3'))  # Seconds to wait for the provider before sending the long link
+SHORTENER_CACHE_SIZE = int(os.getenv('SHORTENER_CACHE_SIZE', '1024'))  # Short URLs kept in memory in front of the short_urls table
+SHORTENER_CONCURRENCY = int(os.getenv('SHORTENER_CONCURRENCY', '4'))  # Requests to the provider at once
+SHORTENER_FAILURE_THRESHOLD = int(os.getenv('SHORTENER_FAILURE_THRESHOLD', '3'))  # Failures in a row that stop calls to the provider
+SHORTENER_RESET_SECONDS = float(os.getenv('SHORTENER_RESET_SECONDS', '60'))  # Pause before the provider is tried again
+
 # Admin configuration
 ADMIN_EMAIL = os.getenv('ADMIN_EMAIL', 'admin@example.com')
 
@@ -0,0 +1,215 @@
+"""Benchmarks of the hot database queries, admin routes and bot handlers.
+
+Times each benchmark against the database in DATABASE_URL (fill one with
+database/fixtures.py), writes the results as JSON and optionally compares
+them with a stored baseline, exiting with status 1 on regressions:
+
+    python -m database.benchmark --save bench.json
+    python -m database.benchmark --baseline bench.json
+"""
+import os
+import sys
+import json
+import time
+import platform
+import argparse
+import datetime
+import statistics
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+class Context:
+    """What the benchmarks need: an admin test client, the bot and sample inputs"""
+
+    def __init__(self, search):
+        from sqlalchemy import func
+        from admin.app import app as admin_app
+        from bot import bot
+        from bot.fake_client import FakeClient, make_user, make_text_message
+        from database.models import get_db, Admin, User, Payment
+
+        self.bot = bot
+        self.search = search
+        self.client = FakeClient()
+
+        db = get_db()
+        admin = db.query(Admin).first()
+        if admin is None:
+            raise SystemExit("No admin account found; run python -m database.fixtures first")
+        self.admin = admin_app.test_client()
+        with self.admin.session_transaction() as session:
+            session['_user_id'] = str(admin.id)
+            session['_fresh'] = True
+
+        # The user with the most purchases is the worst case for show_purchases
+        heaviest = db.query(Payment.user_id).filter_by(status='approved').group_by(Payment.user_id).order_by(
+            func.count(Payment.id).desc()).first()
+        db_user = db.get(User, heaviest[0]) if heaviest else db.query(User).first()
+        telegram_id = int(db_user.telegram_id) if db_user else 1
+        self.user = make_user(telegram_id)
+        self.message = make_text_message(self.client, self.user, search)
+
+    def get(self, path):
+        response = self.admin.get(path)
+        if response.status_code != 200:
+            raise RuntimeError(f"GET {path} returned {response.status_code}")
+
+    def run(self, coroutine):
+        return self.bot.app.loop.run_until_complete(coroutine)
+
+def admin_route(path):
+    return f"admin GET {path}", lambda ctx: ctx.get(path)
+
+def run_get_stats(ctx):
+    from admin.app import get_stats
+    get_stats()
+
+BENCHMARKS = [
+    ('get_stats', run_get_stats),
+    admin_route('/dashboard'),
+    admin_route('/payments'),
+    admin_route('/payments?status=pending'),
+    admin_route('/users'),
+    admin_route('/logs'),
+    admin_route('/categories'),
+    ('bot handle_course_search', lambda ctx: ctx.run(
+        ctx.bot.handle_course_search(ctx.client, ctx.message, ctx.user, ctx.search))),
+    ('bot show_categories_menu', lambda ctx: ctx.run(ctx.bot.show_categories_menu(ctx.client, ctx.message))),
+    ('bot show_purchases', lambda ctx: ctx.run(ctx.bot.show_purchases(ctx.client, ctx.message))),
+    ('bot courses_command', lambda ctx: ctx.run(ctx.bot.courses_command(ctx.client, ctx.message))),
+]
+
+def time_benchmark(ctx, function, repeat, warmup, max_seconds):
+    """Run a benchmark and summarize its timings; slow ones stop after max_seconds"""
+    from database import query_stats
+    from database.models import session_scope
+
+    timings = []
+    queries = 0
+    spent = 0.0
+    for run in range(warmup + repeat):
+        with session_scope(), query_stats.track('benchmark') as scope:
+            start = time.perf_counter()
+            function(ctx)
+            elapsed = time.perf_counter() - start
+        spent += elapsed
+        if run >= warmup:
+            timings.append(elapsed)
+            queries = scope.count
+        if spent > max_seconds and timings:
+            break
+
+    return {
+        'runs': len(timings),
+        'min_ms': min(timings) * 1000,
+        'median_ms': statistics.median(timings) * 1000,
+        'mean_ms': statistics.fmean(timings) * 1000,
+        'max_ms': max(timings) * 1000,
+        'queries': queries
+    }
+
+def row_counts():
+    from sqlalchemy import func
+    from database.models import get_db, User, Course, Category, Payment, Log
+
+    db = get_db()
+    return {model.__tablename__: db.query(func.count(model.id)).scalar()
+            for model in (User, Course, Category, Payment, Log)}
+
+def run_benchmarks(args):
+    """Run the selected benchmarks and return the results document"""
+    from database.models import engine
+
+    ctx = Context(args.search)
+    results = {}
+    for name, function in BENCHMARKS:
+        if args.only and not any(pattern in name for pattern in args.only):
+            continue
+        if any(pattern in name for pattern in args.skip):
+            continue
+        print(f"Running {name}...", flush=True)
+        try:
+            results[name] = time_benchmark(ctx, function, args.repeat, args.warmup, args.max_seconds)
+        except Exception as e:
+            print(f"  failed: {e}")
+            results[name] = {'error': str(e)}
+
+    return {
+        'meta': {
+            'time': datetime.datetime.now(datetime.UTC).isoformat(),
+            'database': engine.dialect.name,
+            'python': platform.python_version(),
+            'rows': row_counts()
+        },
+        'results': results
+    }
+
+def compare(current, baseline, tolerance, min_delta_ms):
+    """Names of benchmarks whose median got slower than the baseline allows"""
+    regressions = []
+    print(f"\n{'benchmark':<34}{'baseline ms':>13}{'current ms':>13}{'change':>10}")
+    for name, result in current['results'].items():
+        base = baseline.get('results', {}).get(name)
+        if 'error' in result or not base or 'error' in base:
+            print(f"{name:<34}{'-':>13}{result.get('median_ms', 0):>13.2f}{'n/a':>10}")
+            continue
+        change = result['median_ms'] / base['median_ms'] - 1 if base['median_ms'] else 0.0
+        slower = (result['median_ms'] > base['median_ms'] * (1 + tolerance)
+                  and result['median_ms'] - base['median_ms'] > min_delta_ms)
+        if slower:
+            regressions.append(name)
+        print(f"{name:<34}{base['median_ms']:>13.2f}{result['median_ms']:>13.2f}{change:>+10.0%}"
+              f"{'  REGRESSION' if slower else ''}")
+    return regressions
+
+def print_results(document):
+    print(f"\nRows: {document['meta']['rows']}")
+    print(f"\n{'benchmark':<34}{'runs':>6}{'median ms':>12}{'min ms':>10}{'max ms':>10}{'queries':>9}")
+    for name, result in document['results'].items():
+        if 'error' in result:
+            print(f"{name:<34}  error: {result['error']}")
+            continue
+        print(f"{name:<34}{result['runs']:>6}{result['median_ms']:>12.2f}{result['min_ms']:>10.2f}"
+              f"{result['max_ms']:>10.2f}{result['queries']:>9}")
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the hot queries, admin routes and bot handlers")
+    parser.add_argument('--repeat', type=int, default=5, help="Timed runs per benchmark")
+    parser.add_argument('--warmup', type=int, default=1, help="Untimed runs before the timed ones")
+    parser.add_argument('--max-seconds', type=float, default=60.0, help="Stop repeating a benchmark after this long")
+    parser.add_argument('--only', action='append', default=[], help="Only run benchmarks whose name contains this")
+    parser.add_argument('--skip', action='append', default=[], help="Skip benchmarks whose name contains this")
+    parser.add_argument('--search', default='python', help="Query used by the course search benchmark")
+    parser.add_argument('--save', default=None, help="Write the results as JSON to this file")
+    parser.add_argument('--baseline', default=None, help="Compare with the results stored in this file")
+    parser.add_argument('--tolerance', type=float, default=0.2, help="Allowed slowdown of the median (0.2 = 20%%)")
+    parser.add_argument('--min-delta-ms', type=float, default=1.0, help="Ignore slowdowns smaller than this")
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(argv)
+    # No auto-delete timers or metrics server; project modules read these at import time
+    os.environ['AUTO_DELETE_SECONDS'] = '0'
+    os.environ['BOT_METRICS_PORT'] = '0'
+    # The link shortener is a network call, not part of the database layer
+    os.environ['SHORTENER_URL'] = ''
+
+    document = run_benchmarks(args)
+    print_results(document)
+
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump(document, f, indent=2)
+        print(f"\nResults written to {args.save}")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = compare(document, baseline, args.tolerance, args.min_delta_ms)
+        if regressions:
+            print(f"\n{len(regressions)} regression(s): {', '.join(regressions)}")
+            sys.exit(1)
+        print("\nNo regressions")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,238 @@
+"""Scale fixtures for benchmarking the database layer.
+
+Fills the schema from database/models.py with synthetic rows that have
+realistic skew: a few courses and users account for most payments and log
+rows, recent days are busier than old ones, and most payments are approved.
+Rows are appended with explicit ids, so it can run against an existing
+database, but it is meant for a scratch one:
+
+    DATABASE_URL=sqlite:////tmp/bench.db python -m database.fixtures \\
+        --users 1000000 --payments 5000000 --logs 50000000 --courses 10000
+"""
+import os
+import sys
+import math
+import time
+import random
+import argparse
+import datetime
+from sqlalchemy import func, select
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from database.models import engine, Admin, Category, Course, User, Payment, Log, LOG_ACTIONS
+
+TOPICS = [
+    "Python", "JavaScript", "Data Science", "Machine Learning", "Web Development", "Excel",
+    "Digital Marketing", "Photography", "Stock Trading", "Graphic Design", "Video Editing",
+    "Ethical Hacking", "Android Development", "Cloud Computing", "DevOps", "UI/UX Design",
+    "Personal Finance", "Spoken English", "Guitar", "Copywriting"
+]
+LEVELS = ["Beginner", "Complete", "Advanced", "Masterclass", "Bootcamp", "Crash Course", "Zero to Hero"]
+
+PAYMENT_STATUSES = (('approved', 70), ('pending', 20), ('rejected', 10))
+PAYMENT_METHODS = (('upi', 75), ('crypto', 8), ('paypal', 10), ('gift', 5), ('cod', 2))
+
+# Relative frequency of log actions, roughly following the browse -> buy funnel
+LOG_ACTION_WEIGHTS = {
+    'command_start': 12, 'command_courses': 10, 'view_course': 25, 'view_categories_menu': 6,
+    'view_category_courses': 6, 'search_courses': 5, 'command_search': 3, 'payment_method_selected': 6,
+    'payment_submitted': 3, 'view_purchases': 3, 'command_help': 2, 'user_joined': 2,
+    'view_dmca_policy': 1, 'gift_card_selected': 1, 'spam_detected': 1
+}
+COURSE_ACTIONS = {'view_course', 'payment_method_selected', 'payment_submitted', 'gift_card_selected'}
+PAYMENT_ACTIONS = {'payment_submitted'}
+CATEGORY_ACTIONS = {'view_category_courses'}
+
+# Telegram ids of generated users start here, well clear of real accounts
+TELEGRAM_ID_BASE = 7000000000
+
+def skewed_index(rng, n, skew):
+    """Random index in [0, n) where low indices are much more likely (skew 1 = uniform)"""
+    return min(n - 1, int(n * rng.random() ** skew))
+
+def recent_timestamp(rng, now, days):
+    """Random timestamp within the last `days`, busier towards the present"""
+    age = days * (1 - math.sqrt(rng.random()))
+    return now - datetime.timedelta(days=age)
+
+def weighted_picker(rng, weighted):
+    """Function returning a random choice from (value, weight) pairs"""
+    values = [value for value, _ in weighted]
+    cum_weights = []
+    total = 0
+    for _, weight in weighted:
+        total += weight
+        cum_weights.append(total)
+    return lambda: rng.choices(values, cum_weights=cum_weights)[0]
+
+def next_id(conn, model):
+    return (conn.execute(select(func.max(model.id))).scalar() or 0) + 1
+
+def insert_batches(model, count, make_row, batch_size, label):
+    """Insert `count` generated rows in batches of one transaction each"""
+    if count <= 0:
+        return
+    table = model.__table__
+    start = time.perf_counter()
+    done = 0
+    while done < count:
+        size = min(batch_size, count - done)
+        rows = [make_row(done + i) for i in range(size)]
+        with engine.begin() as conn:
+            conn.execute(table.insert(), rows)
+        done += size
+        if done == count or done % (batch_size * 20) == 0:
+            rate = done / (time.perf_counter() - start)
+            print(f"  {label}: {done}/{count} ({rate:.0f} rows/s)")
+
+def generate(users=10000, payments=50000, logs=500000, courses=1000, categories=20,
+             days=365, skew=3.0, batch_size=10000, seed=1):
+    """Generate the fixtures; returns the id ranges of the inserted rows"""
+    if (payments or logs) and (not users or not courses):
+        raise ValueError("Payments and logs need generated users and courses to reference")
+
+    rng = random.Random(seed)
+    now = datetime.datetime.now(datetime.UTC).replace(tzinfo=None)
+
+    with engine.begin() as conn:
+        first = {model: next_id(conn, model) for model in (Category, Course, User, Payment, Log)}
+        if conn.execute(select(func.count(Admin.id))).scalar() == 0:
+            # Lets the benchmark log in to the admin dashboard; '!' never matches a password hash
+            conn.execute(Admin.__table__.insert(), [{
+                'username': 'fixtures', 'password_hash': '!', 'email': 'fixtures@example.com'
+            }])
+
+    # Catalog
+    print(f"Generating {categories} categories and {courses} courses...")
+    category_ids = [first[Category] + i for i in range(categories)]
+    insert_batches(Category, categories, lambda i: {
+        'id': category_ids[i],
+        'name': f"{TOPICS[i % len(TOPICS)]} {category_ids[i]}" if first[Category] > 1 or i >= len(TOPICS)
+                else TOPICS[i]
+    }, batch_size, 'categories')
+
+    course_prices = []
+    course_categories = []
+    for i in range(courses):
+        is_free = rng.random() < 0.05
+        course_prices.append(0.0 if is_free else float(rng.choice([99, 199, 299, 499, 799, 999, 1499, 2999])))
+        course_categories.append(category_ids[skewed_index(rng, categories, 1.5)] if categories else None)
+
+    def make_course(i):
+        topic = TOPICS[i % len(TOPICS)]
+        return {
+            'id': first[Course] + i,
+            'title': f"{topic} {rng.choice(LEVELS)} {i + 1}",
+            'description': f"Learn {topic} step by step. " * rng.randint(2, 30),
+            'price': course_prices[i],
+            'file_link': f"https://example.com/courses/{first[Course] + i}",
+            'category_id': course_categories[i],
+            'image_link': f"https://example.com/images/{first[Course] + i}.jpg" if rng.random() < 0.6 else None,
+            'is_free': course_prices[i] == 0,
+            'is_active': rng.random() < 0.9,
+            'created_date': recent_timestamp(rng, now, days),
+            'updated_date': now
+        }
+    insert_batches(Course, courses, make_course, batch_size, 'courses')
+
+    # Users, joining faster towards the present
+    print(f"Generating {users} users...")
+    insert_batches(User, users, lambda i: {
+        'id': first[User] + i,
+        'telegram_id': str(TELEGRAM_ID_BASE + first[User] + i),
+        'username': f"user{first[User] + i}" if rng.random() < 0.7 else None,
+        'first_name': f"User{first[User] + i}",
+        'last_name': None,
+        'joined_date': recent_timestamp(rng, now, days),
+        'is_banned': rng.random() < 0.002
+    }, batch_size, 'users')
+
+    # Payments: a few heavy buyers and bestselling courses account for most of them
+    print(f"Generating {payments} payments...")
+    paid_courses = [i for i, price in enumerate(course_prices) if price > 0] or list(range(courses))
+    pick_status = weighted_picker(rng, PAYMENT_STATUSES)
+    pick_method = weighted_picker(rng, PAYMENT_METHODS)
+
+    def make_payment(i):
+        course = paid_courses[skewed_index(rng, len(paid_courses), skew)]
+        user_id = first[User] + skewed_index(rng, users, skew)
+        status = pick_status()
+        submitted = recent_timestamp(rng, now, days)
+        return {
+            'id': first[Payment] + i,
+            'user_id': user_id,
+            'course_id': first[Course] + course,
+            'payment_method': pick_method(),
+            'payment_proof': f"{TELEGRAM_ID_BASE + user_id}_fixture.jpg",
+            'amount': course_prices[course],
+            'status': status,
+            'submission_date': submitted,
+            'approval_date': submitted + datetime.timedelta(hours=rng.uniform(0.1, 48)) if status == 'approved' else None,
+            'ip_address': None,
+            'details': None
+        }
+    insert_batches(Payment, payments, make_payment, batch_size, 'payments')
+
+    # Logs
+    print(f"Generating {logs} log rows...")
+    action_names = list(LOG_ACTION_WEIGHTS)
+    pick_action = weighted_picker(rng, [(name, LOG_ACTION_WEIGHTS[name]) for name in action_names])
+
+    def make_log(i):
+        action = pick_action()
+        row = {
+            'id': first[Log] + i,
+            'telegram_id': str(TELEGRAM_ID_BASE + first[User] + skewed_index(rng, users, skew)),
+            'action_code': LOG_ACTIONS[action],
+            'legacy_action': None,
+            'course_id': None,
+            'payment_id': None,
+            'category_id': None,
+            'timestamp': recent_timestamp(rng, now, days),
+            'ip_address': None,
+            'details': None
+        }
+        if action in COURSE_ACTIONS:
+            row['course_id'] = first[Course] + skewed_index(rng, courses, skew)
+        if action in PAYMENT_ACTIONS and payments:
+            row['payment_id'] = first[Payment] + rng.randrange(payments)
+        if action in CATEGORY_ACTIONS and categories:
+            row['category_id'] = category_ids[skewed_index(rng, categories, 1.5)]
+        if action == 'search_courses':
+            row['details'] = f"Searched for: {rng.choice(TOPICS).lower()}, Found: {rng.randint(0, 40)} courses"
+        elif action == 'payment_method_selected':
+            row['details'] = pick_method()
+        return row
+    insert_batches(Log, logs, make_log, batch_size, 'logs')
+
+    return {
+        model.__tablename__: (first[model], first[model] + count - 1)
+        for model, count in ((Category, categories), (Course, courses), (User, users), (Payment, payments), (Log, logs))
+        if count
+    }
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Fill the database with synthetic rows for benchmarking")
+    parser.add_argument('--users', type=int, default=10000)
+    parser.add_argument('--payments', type=int, default=50000)
+    parser.add_argument('--logs', type=int, default=500000)
+    parser.add_argument('--courses', type=int, default=1000)
+    parser.add_argument('--categories', type=int, default=20)
+    parser.add_argument('--days', type=int, default=365, help="Spread timestamps over this many days")
+    parser.add_argument('--skew', type=float, default=3.0,
+                        help="Popularity skew of courses and users (1 = uniform, higher = more concentrated)")
+    parser.add_argument('--batch-size', type=int, default=10000, help="Rows inserted per transaction")
+    parser.add_argument('--seed', type=int, default=1)
+    return parser.parse_args(argv)
+
+if __name__ == "__main__":
+    args = parse_args()
+    print(f"Generating fixtures in {engine.url.render_as_string(hide_password=True)}...")
+    start = time.perf_counter()
+    ranges = generate(
+        users=args.users, payments=args.payments, logs=args.logs, courses=args.courses,
+        categories=args.categories, days=args.days, skew=args.skew, batch_size=args.batch_size, seed=args.seed
+    )
+    for table, (first_id, last_id) in ranges.items():
+        print(f"  {table}: ids {first_id}-{last_id}")
+    print(f"Fixtures generated in {time.perf_counter() - start:.1f}s")
@@ -1,4 +1,5 @@
 import os
+import re
 import sys
 from sqlalchemy import create_engine, text
 from sqlalchemy.orm import sessionmaker
@@ -6,6 +7,142 @@ import sqlalchemy as sa
 
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 from config.config import DATABASE_URL
+from database.models import Log, ChangeEvent, get_log_action_code
+
+# Formatted log details written before logs had structured columns
+LEGACY_COURSE_DETAILS = re.compile(
+    r'^(?:Viewed course|Accessed free course|Selected payment for|Selected gift card payment for course|'
+    r'Submitted gift card for course|Auto-approved payment for course|Submitted payment for course): (?P<title>.+)$'
+)
+LEGACY_METHOD_DETAILS = re.compile(r'^Selected (?P<method>\w+) for course: (?P<title>.+)$')
+LEGACY_CATEGORY_DETAILS = re.compile(r'^Category: (?P<name>.+)$')
+LEGACY_JOIN_DETAILS = re.compile(r'^New user joined: ')
+
+def parse_legacy_details(details, course_ids, category_ids):
+    """Turn a formatted details string into structured log columns"""
+    match = LEGACY_COURSE_DETAILS.match(details)
+    if match and match.group('title') in course_ids:
+        return {'course_id': course_ids[match.group('title')], 'details': None}
+
+    match = LEGACY_METHOD_DETAILS.match(details)
+    if match and match.group('title') in course_ids:
+        return {'course_id': course_ids[match.group('title')], 'details': match.group('method')}
+
+    match = LEGACY_CATEGORY_DETAILS.match(details)
+    if match and match.group('name') in category_ids:
+        return {'category_id': category_ids[match.group('name')], 'details': None}
+
+    if LEGACY_JOIN_DETAILS.match(details):
+        return {'details': None}
+
+    return None
+
+def migrate_log_actions(engine, batch_size=5000):
+    """Move logs from free-text action/details to action codes and structured columns"""
+    inspect = sa.inspect(engine)
+    log_columns_names = [col['name'] for col in inspect.get_columns('logs')]
+
+    for column, column_type in [
+        ('action_code', 'SMALLINT REFERENCES log_actions(id)'),
+        ('course_id', 'INTEGER REFERENCES courses(id)'),
+        ('payment_id', 'INTEGER REFERENCES payments(id)'),
+        ('category_id', 'INTEGER REFERENCES categories(id)')
+    ]:
+        if column not in log_columns_names:
+            print(f"Adding {column} column to logs table...")
+            with engine.connect() as conn:
+                conn.execute(text(f'ALTER TABLE logs ADD COLUMN {column} {column_type}'))
+                conn.commit()
+
+    if 'ix_logs_action_code' not in [index['name'] for index in inspect.get_indexes('logs')]:
+        with engine.connect() as conn:
+            conn.execute(text('CREATE INDEX ix_logs_action_code ON logs (action_code)'))
+            conn.commit()
+
+    Session = sessionmaker(bind=engine)
+    db = Session()
+    try:
+        # Action names -> codes, one UPDATE per distinct name
+        legacy_actions = [row[0] for row in db.execute(text(
+            'SELECT DISTINCT action FROM logs WHERE action_code IS NULL AND action IS NOT NULL'
+        ))]
+        for name in legacy_actions:
+            code = get_log_action_code(db, name)
+            db.execute(text('UPDATE logs SET action_code = :code WHERE action = :name AND action_code IS NULL'),
+                       {'code': code, 'name': name})
+            db.commit()
+            print(f"Backfilled action code {code} for '{name}'")
+
+        # Formatted details -> course/category columns, in id order
+        course_ids = {title: course_id for course_id, title in db.execute(text('SELECT id, title FROM courses'))}
+        category_ids = {name: category_id for category_id, name in db.execute(text('SELECT id, name FROM categories'))}
+
+        last_id = 0
+        backfilled = 0
+        while True:
+            rows = db.execute(text(
+                'SELECT id, details FROM logs WHERE id > :last_id AND details IS NOT NULL '
+                'AND course_id IS NULL AND category_id IS NULL ORDER BY id LIMIT :limit'
+            ), {'last_id': last_id, 'limit': batch_size}).all()
+            if not rows:
+                break
+            last_id = rows[-1][0]
+
+            updates = []
+            for log_id, details in rows:
+                values = parse_legacy_details(details, course_ids, category_ids)
+                if values is not None:
+                    updates.append({'id': log_id, 'course_id': None, 'category_id': None, **values})
+            if updates:
+                db.execute(text(
+                    'UPDATE logs SET course_id = :course_id, category_id = :category_id, details = :details WHERE id = :id'
+                ), updates)
+                db.commit()
+                backfilled += len(updates)
+        print(f"Backfilled structured details for {backfilled} log rows")
+    finally:
+        db.close()
+
+    # The legacy action column is only kept for rows whose action could not be coded
+    action_column = next(col for col in sa.inspect(engine).get_columns('logs') if col['name'] == 'action')
+    if not action_column['nullable']:
+        print("Making logs.action nullable...")
+        if engine.dialect.name == 'sqlite':
+            # SQLite cannot drop NOT NULL in place, so rebuild the table from the model
+            columns = ', '.join(column.name for column in Log.__table__.columns)
+            with engine.begin() as conn:
+                for index in sa.inspect(conn).get_indexes('logs'):
+                    conn.execute(text(f'DROP INDEX {index["name"]}'))
+                conn.execute(text('ALTER TABLE logs RENAME TO logs_old'))
+                Log.__table__.create(conn)
+                conn.execute(text(f'INSERT INTO logs ({columns}) SELECT {columns} FROM logs_old'))
+                conn.execute(text('DROP TABLE logs_old'))
+        else:
+            with engine.begin() as conn:
+                conn.execute(text('ALTER TABLE logs ALTER COLUMN action DROP NOT NULL'))
+
+    with engine.begin() as conn:
+        conn.execute(text('UPDATE logs SET action = NULL WHERE action_code IS NOT NULL AND action IS NOT NULL'))
+    print("Successfully migrated logs to action codes")
+
+def migrate_change_event_ids(engine):
+    """Rebuild change_events on SQLite with AUTOINCREMENT, so ids are never handed out twice"""
+    with engine.begin() as conn:
+        table_sql = conn.execute(text("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = 'change_events'")).scalar()
+        if 'AUTOINCREMENT' in table_sql.upper():
+            return
+        print("Rebuilding change_events table with AUTOINCREMENT ids...")
+        columns = ', '.join(column.name for column in ChangeEvent.__table__.columns)
+        conn.execute(text('ALTER TABLE change_events RENAME TO change_events_old'))
+        ChangeEvent.__table__.create(conn)
+        conn.execute(text(f'INSERT INTO change_events ({columns}) SELECT {columns} FROM change_events_old'))
+        conn.execute(text('DROP TABLE change_events_old'))
+        # The bot's cursor may be past every remaining row; new ids have to start above it
+        cursor = conn.execute(text("SELECT value FROM bot_settings WHERE key = 'change_feed_cursor'")).scalar()
+        last_id = max(int(cursor or 0), conn.execute(text('SELECT MAX(id) FROM change_events')).scalar() or 0)
+        conn.execute(text("DELETE FROM sqlite_sequence WHERE name = 'change_events'"))
+        conn.execute(text("INSERT INTO sqlite_sequence (name, seq) VALUES ('change_events', :seq)"), {'seq': last_id})
+    print("Successfully rebuilt change_events table")
 
 def run_migration():
     """Run database migration to add new fields"""
@@ -42,7 +179,69 @@ def run_migration():
             print("Successfully added details column")
         except Exception as e:
             print(f"Error adding details column: {e}")
-    
+
+    # Index the logs columns used by /logs, user_detail and the retention job
+    log_indexes = [index['name'] for index in inspect.get_indexes('logs')]
+    for index_name, column in [('ix_logs_timestamp', 'timestamp'), ('ix_logs_telegram_id', 'telegram_id')]:
+        if index_name not in log_indexes:
+            print(f"Adding {index_name} index to logs table...")
+            try:
+                with engine.connect() as conn:
+                    conn.execute(text(f'CREATE INDEX {index_name} ON logs ({column})'))
+                    conn.commit()
+                print(f"Successfully added {index_name} index")
+            except Exception as e:
+                print(f"Error adding {index_name} index: {e}")
+
+    # "My Purchases" pages through a user's approved payments by id
+    if 'ix_payments_user_status_id' not in [index['name'] for index in inspect.get_indexes('payments')]:
+        print("Adding ix_payments_user_status_id index to payments table...")
+        try:
+            with engine.connect() as conn:
+                conn.execute(text('CREATE INDEX ix_payments_user_status_id ON payments (user_id, status, id)'))
+                conn.commit()
+            print("Successfully added ix_payments_user_status_id index")
+        except Exception as e:
+            print(f"Error adding ix_payments_user_status_id index: {e}")
+
+    # Users who blocked the bot are skipped by broadcasts
+    user_columns_names = [col['name'] for col in inspect.get_columns('users')]
+    if 'is_blocked' not in user_columns_names:
+        print("Adding is_blocked column to users table...")
+        try:
+            with engine.connect() as conn:
+                conn.execute(text('ALTER TABLE users ADD COLUMN is_blocked BOOLEAN DEFAULT FALSE'))
+                conn.commit()
+            print("Successfully added is_blocked column")
+        except Exception as e:
+            print(f"Error adding is_blocked column: {e}")
+
+    # Failed change events are retried by the bot
+    if inspect.has_table('change_events'):
+        change_event_columns_names = [col['name'] for col in inspect.get_columns('change_events')]
+        for column, column_type in [('attempts', 'INTEGER DEFAULT 0'), ('retry_date', 'TIMESTAMP')]:
+            if column not in change_event_columns_names:
+                print(f"Adding {column} column to change_events table...")
+                try:
+                    with engine.connect() as conn:
+                        conn.execute(text(f'ALTER TABLE change_events ADD COLUMN {column} {column_type}'))
+                        conn.commit()
+                    print(f"Successfully added {column} column")
+                except Exception as e:
+                    print(f"Error adding {column} column: {e}")
+
+        # Change event ids must keep growing after old events are deleted
+        if engine.dialect.name == 'sqlite':
+            try:
+                migrate_change_event_ids(engine)
+            except Exception as e:
+                print(f"Error rebuilding change_events table: {e}")
+
+    try:
+        migrate_log_actions(engine)
+    except Exception as e:
+        print(f"Error migrating logs to action codes: {e}")
+
     print("Migration completed!")
 
 if __name__ == "__main__":
@@ -1,12 +1,18 @@
-from sqlalchemy import Column, Integer, String, Float, Boolean, DateTime, ForeignKey, Text, create_engine
+from sqlalchemy import Column, Integer, SmallInteger, String, Float, Boolean, Date, DateTime, ForeignKey, Text, Index, UniqueConstraint, create_engine, select, text
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import relationship, sessionmaker
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.sql import func
 import datetime
+import time
+import contextvars
 import os
 import sys
+from contextlib import contextmanager
 
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 from config.config import DATABASE_URL
+from database import query_stats
 
 Base = declarative_base()
 
@@ -32,6 +38,7 @@ class User(Base):
     joined_date = Column(DateTime, default=lambda: datetime.datetime.now(datetime.UTC))
     is_banned = Column(Boolean, default=False)
     ban_reason = Column(String(255), nullable=True)
+    is_blocked = Column(Boolean, default=False)  # Blocked the bot or deleted their account; broadcasts skip them
     
     payments = relationship("Payment", back_populates="user")
     
@@ -58,10 +65,32 @@ class Course(Base):
     
     category_obj = relationship("Category", back_populates="courses")
     payments = relationship("Payment", back_populates="course")
+    files = relationship("CourseFile", back_populates="course", order_by="CourseFile.position",
+                         cascade="all, delete-orphan")
     
     def __repr__(self):
         return f"<Course {self.title}>"
 
+class CourseFile(Base):
+    """A Telegram-hosted file sent to the user with the course link"""
+    __tablename__ = 'course_files'
+
+    id = Column(Integer, primary_key=True)
+    course_id = Column(Integer, ForeignKey('courses.id'), nullable=False, index=True)
+    position = Column(Integer, nullable=False, default=0)  # Order in which the files are sent
+    kind = Column(String(20), nullable=False, default='document')  # document, video, audio or photo
+    file_name = Column(String(255), nullable=True)
+    caption = Column(String(1024), nullable=True)
+    storage_message_id = Column(Integer, nullable=True)  # Message in STORAGE_CHANNEL_ID holding the file
+    path = Column(String(255), nullable=True)  # File in UPLOAD_FOLDER, for files uploaded through the dashboard
+    file_id = Column(String(255), nullable=True)  # Telegram file_id, filled in by the bot on the first delivery
+    created_date = Column(DateTime, default=lambda: datetime.datetime.now(datetime.UTC))
+
+    course = relationship("Course", back_populates="files")
+
+    def __repr__(self):
+        return f"<CourseFile {self.file_name or self.id} of course {self.course_id}>"
+
 class Payment(Base):
     __tablename__ = 'payments'
     
@@ -79,6 +108,9 @@ class Payment(Base):
     
     user = relationship("User", back_populates="payments")
     course = relationship("Course", back_populates="payments")
+
+    # A user's payments by status in id order, for the paginated "My Purchases" view
+    __table_args__ = (Index('ix_payments_user_status_id', 'user_id', 'status', 'id'),)
     
     def __repr__(self):
         return f"<Payment {self.id} - {self.status}>"
@@ -94,19 +126,108 @@ class Payment(Base):
             return code
         return None
 
+# Small-int codes stored in Log.action_code. Never renumber an entry, only append new ones;
+# names missing from this table are registered in log_actions on first use.
+LOG_ACTIONS = {
+    'user_joined': 1,
+    'command_start': 2,
+    'command_courses': 3,
+    'command_help': 4,
+    'command_search': 5,
+    'view_course': 6,
+    'get_free_course': 7,
+    'select_payment': 8,
+    'gift_card_selected': 9,
+    'payment_method_selected': 10,
+    'gift_card_submitted': 11,
+    'password_correct': 12,
+    'password_incorrect': 13,
+    'spam_detected': 14,
+    'view_purchases': 15,
+    'duplicate_payment_detected': 16,
+    'payment_auto_approved': 17,
+    'payment_submitted': 18,
+    'search_courses': 19,
+    'view_categories_menu': 20,
+    'view_category_courses': 21,
+    'view_dmca_policy': 22,
+    'pressed_request_course_button': 23,
+    'cancelled_course_request': 24,
+    'submitted_course_request': 25,
+    'course_link_opened': 26,
+    'course_link_refused': 27,
+}
+
+# In-process copies of the log_actions table, filled lazily
+_log_action_codes = dict(LOG_ACTIONS)
+_log_action_names = {code: name for name, code in LOG_ACTIONS.items()}
+
+class LogAction(Base):
+    __tablename__ = 'log_actions'
+
+    id = Column(SmallInteger, primary_key=True, autoincrement=False)
+    name = Column(String(100), unique=True, nullable=False)
+
+    def __repr__(self):
+        return f"<LogAction {self.id}={self.name}>"
+
 class Log(Base):
     __tablename__ = 'logs'
     
     id = Column(Integer, primary_key=True)
-    telegram_id = Column(String(50), nullable=True)
-    action = Column(String(255), nullable=False)
-    timestamp = Column(DateTime, default=lambda: datetime.datetime.now(datetime.UTC))
+    telegram_id = Column(String(50), nullable=True, index=True)
+    action_code = Column(SmallInteger, ForeignKey('log_actions.id'), nullable=True, index=True)
+    legacy_action = Column('action', String(255), nullable=True)  # Free-text action of rows written before action codes
+    course_id = Column(Integer, ForeignKey('courses.id'), nullable=True)
+    payment_id = Column(Integer, ForeignKey('payments.id'), nullable=True)
+    category_id = Column(Integer, ForeignKey('categories.id'), nullable=True)
+    timestamp = Column(DateTime, default=lambda: datetime.datetime.now(datetime.UTC), index=True)
     ip_address = Column(String(50), nullable=True)
-    details = Column(Text, nullable=True)
+    details = Column(Text, nullable=True)  # Free text only (search queries, request text, ...)
+
+    course = relationship("Course")
+    payment = relationship("Payment")
+    category = relationship("Category")
+
+    @property
+    def action(self):
+        """Action name, resolved from the action code"""
+        if self.action_code is not None:
+            return get_log_action_name(self.action_code)
+        return self.legacy_action
+
+    @property
+    def summary(self):
+        """Human readable details built from the structured columns"""
+        parts = []
+        if self.course_id:
+            parts.append(f"Course: {self.course.title}" if self.course else f"Course #{self.course_id}")
+        if self.category_id:
+            parts.append(f"Category: {self.category.name}" if self.category else f"Category #{self.category_id}")
+        if self.payment_id:
+            parts.append(f"Payment #{self.payment_id}")
+        if self.details:
+            parts.append(self.details)
+        return " | ".join(parts) if parts else None
     
     def __repr__(self):
         return f"<Log {self.action} at {self.timestamp}>"
 
+class LogRollup(Base):
+    """Daily per-user/per-action counts of log rows that have been archived"""
+    __tablename__ = 'log_rollups'
+
+    id = Column(Integer, primary_key=True)
+    day = Column(Date, nullable=False, index=True)
+    telegram_id = Column(String(50), nullable=False, default='')  # '' for rows without a user
+    action = Column(String(255), nullable=False)
+    count = Column(Integer, nullable=False, default=0)
+
+    __table_args__ = (UniqueConstraint('day', 'telegram_id', 'action', name='uq_log_rollups_day_user_action'),)
+
+    def __repr__(self):
+        return f"<LogRollup {self.day} {self.action} x{self.count}>"
+
 class Admin(Base):
     __tablename__ = 'admins'
     
@@ -120,6 +241,10 @@ class Admin(Base):
     def __repr__(self):
         return f"<Admin {self.username}>"
 
+# bot_settings keys of the catalog and settings versions, see bump_catalog_version()
+CATALOG_VERSION_KEY = 'catalog_version'
+SETTINGS_VERSION_KEY = 'settings_version'
+
 class BotSetting(Base):
     __tablename__ = 'bot_settings'
 
@@ -144,14 +269,222 @@ class CourseRequest(Base):
     def __repr__(self):
         return f"<CourseRequest by {self.user_id} for {self.request_text[:50]}...>"
 
+class MediaCache(Base):
+    __tablename__ = 'media_cache'
+
+    id = Column(Integer, primary_key=True)
+    asset = Column(String(500), nullable=False)  # Path relative to the project (qr/99.png, uploads/...) or remote URL
+    content_hash = Column(String(64), nullable=False, default='')  # sha256 of local files, '' for URLs
+    file_id = Column(String(255), nullable=False)  # Telegram file_id to resend the asset without uploading it
+    created_date = Column(DateTime, default=lambda: datetime.datetime.now(datetime.UTC))
+
+    __table_args__ = (UniqueConstraint('asset', 'content_hash', name='uq_media_cache_asset_hash'),)
+
+    def __repr__(self):
+        return f"<MediaCache {self.asset}>"
+
+# Postgres channel notified of new change events, see record_change()
+CHANGE_CHANNEL = 'change_events'
+
+class ChangeEvent(Base):
+    """Outbox of admin changes the bot reacts to (bot/changes.py); ids are the feed's sequence numbers"""
+    __tablename__ = 'change_events'
+    # Without AUTOINCREMENT SQLite reuses ids once the newest rows are pruned, and the feed skips ids at or below its cursor
+    __table_args__ = {'sqlite_autoincrement': True}
+
+    id = Column(Integer, primary_key=True)
+    topic = Column(String(50), nullable=False)  # catalog, settings, payment_approved, payment_rejected, user_banned, user_unbanned, broadcast
+    entity_id = Column(Integer, nullable=True)  # Payment, user or broadcast the change is about
+    created_date = Column(DateTime, default=lambda: datetime.datetime.now(datetime.UTC))
+    attempts = Column(Integer, default=0)  # Failed attempts to handle the event
+    retry_date = Column(DateTime, nullable=True)  # When a failed event is handled again; None once handled or given up
+
+    def __repr__(self):
+        return f"<ChangeEvent {self.id} {self.topic} {self.entity_id}>"
+
+class ShortUrl(Base):
+    __tablename__ = 'short_urls'
+
+    id = Column(Integer, primary_key=True)
+    url_hash = Column(String(64), unique=True, nullable=False)  # sha256 of long_url, which is too long to index
+    long_url = Column(Text, nullable=False)
+    short_url = Column(String(255), nullable=False)
+    created_date = Column(DateTime, default=lambda: datetime.datetime.now(datetime.UTC))
+
+    def __repr__(self):
+        return f"<ShortUrl {self.short_url}>"
+
+class Broadcast(Base):
+    __tablename__ = 'broadcasts'
+
+    id = Column(Integer, primary_key=True)
+    text = Column(Text, nullable=False)
+    course_id = Column(Integer, ForeignKey('courses.id'), nullable=True)  # Course announced, adds a button to it
+    status = Column(String(20), default='running')  # running, paused, completed, cancelled
+    created_by = Column(String(100), nullable=True)
+    created_date = Column(DateTime, default=lambda: datetime.datetime.now(datetime.UTC))
+    finished_date = Column(DateTime, nullable=True)
+    updated_date = Column(DateTime, nullable=True)  # Last batch sent
+    last_user_id = Column(Integer, nullable=False, default=0)  # Keyset cursor: users up to this id are done
+    total_users = Column(Integer, nullable=False, default=0)  # Recipients when the broadcast was created
+    sent_count = Column(Integer, nullable=False, default=0)
+    failed_count = Column(Integer, nullable=False, default=0)
+    blocked_count = Column(Integer, nullable=False, default=0)
+    rate = Column(Float, nullable=True)  # Messages per second of the last batch
+
+    course = relationship("Course")
+
+    @property
+    def processed(self):
+        return self.sent_count + self.failed_count + self.blocked_count
+
+    def __repr__(self):
+        return f"<Broadcast {self.id} {self.status}>"
+
+class BroadcastDelivery(Base):
+    __tablename__ = 'broadcast_deliveries'
+
+    id = Column(Integer, primary_key=True)
+    broadcast_id = Column(Integer, ForeignKey('broadcasts.id'), nullable=False)
+    user_id = Column(Integer, ForeignKey('users.id'), nullable=False)
+    status = Column(String(20), nullable=False)  # sent, failed, blocked
+    error = Column(String(255), nullable=True)
+    sent_date = Column(DateTime, default=lambda: datetime.datetime.now(datetime.UTC))
+
+    user = relationship("User")
+
+    __table_args__ = (UniqueConstraint('broadcast_id', 'user_id', name='uq_broadcast_deliveries_broadcast_user'),)
+
+    def __repr__(self):
+        return f"<BroadcastDelivery {self.broadcast_id}:{self.user_id} {self.status}>"
+
+def seed_log_actions(engine):
+    """Make sure every known action code exists in the log_actions table"""
+    with engine.begin() as conn:
+        existing = {row[0] for row in conn.execute(select(LogAction.__table__.c.id))}
+        missing = [{'id': code, 'name': name} for name, code in LOG_ACTIONS.items() if code not in existing]
+        if missing:
+            conn.execute(LogAction.__table__.insert(), missing)
+
+def get_log_action_code(db, name, attempts=5):
+    """Get the code of an action name, registering unknown names in log_actions.
+
+    Call it before adding anything else to db: when the bot and the dashboard
+    register a name at the same time, the loser's transaction is rolled back
+    and the code is read again.
+    """
+    code = _log_action_codes.get(name)
+    if code is not None:
+        return code
+
+    for attempt in range(attempts):
+        action = db.query(LogAction).filter_by(name=name).first()
+        if action:
+            break
+        # Dynamic codes start above the static table so they never collide with future entries
+        max_code = db.query(func.max(LogAction.id)).scalar() or 0
+        action = LogAction(id=max(max_code, 999) + 1, name=name)
+        db.add(action)
+        try:
+            db.flush()
+            break
+        except IntegrityError:
+            # The other process took this name or this code first
+            db.rollback()
+            if attempt == attempts - 1:
+                raise
+
+    _log_action_codes[name] = action.id
+    _log_action_names[action.id] = name
+    return action.id
+
+def get_log_action_name(code):
+    """Get the name of an action code"""
+    name = _log_action_names.get(code)
+    if name is None:
+        db = get_db()
+        action = db.query(LogAction).filter_by(id=code).first()
+        name = action.name if action else f"action_{code}"
+        _log_action_names[code] = name
+    return name
+
+def get_version(db, key):
+    setting = db.query(BotSetting).filter_by(key=key).first()
+    return setting.value if setting else ''
+
+def bump_version(db, key):
+    """Give a version row a new value in the caller's transaction"""
+    version = str(time.time_ns())
+    if not db.query(BotSetting).filter_by(key=key).update({'value': version}):
+        db.add(BotSetting(key=key, value=version))
+    return version
+
+def record_change(db, topic, entity_id=None):
+    """Add a change event in the caller's transaction, so the bot sees it exactly when the change commits.
+
+    On Postgres the bot's LISTEN connection is notified at commit time; on
+    other databases the bot polls the change_events table.
+    """
+    db.add(ChangeEvent(topic=topic, entity_id=entity_id))
+    if db.get_bind().dialect.name == 'postgresql':
+        db.execute(text("SELECT pg_notify(:channel, :topic)"), {'channel': CHANGE_CHANNEL, 'topic': topic})
+
+def get_catalog_version(db):
+    """Current catalog version; changes whenever the admin edits courses or categories"""
+    return get_version(db, CATALOG_VERSION_KEY)
+
+def bump_catalog_version(db):
+    """Give the catalog a new version in the caller's transaction, so cached bot screens are rebuilt"""
+    record_change(db, 'catalog')
+    return bump_version(db, CATALOG_VERSION_KEY)
+
+def get_settings_version(db):
+    """Current settings version; changes whenever the admin saves the /settings page"""
+    return get_version(db, SETTINGS_VERSION_KEY)
+
+def bump_settings_version(db):
+    """Give the settings a new version in the caller's transaction, so the bot reloads them"""
+    record_change(db, 'settings')
+    return bump_version(db, SETTINGS_VERSION_KEY)
+
 # Initialize the database
 engine = create_engine(DATABASE_URL)
+query_stats.install(engine)
 Base.metadata.create_all(engine)
+seed_log_actions(engine)
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+# Sessions handed out by get_db() inside a session_scope()
+_scope_sessions = contextvars.ContextVar('scope_sessions', default=None)
+
 def get_db():
     db = SessionLocal()
+    sessions = _scope_sessions.get()
+    if sessions is not None:
+        sessions.append(db)
     try:
         return db
     finally:
-        db.close() 
\ No newline at end of file
+        db.close()
+
+@contextmanager
+def session_scope():
+    """Close the sessions get_db() hands out inside the block when it ends.
+
+    Callers keep using the session get_db() returns, which checks a connection
+    out again until the session is garbage collected. Bot handlers wrap each
+    update in a scope so their connections go back to the pool right away
+    instead of piling up under load.
+    """
+    if _scope_sessions.get() is not None:
+        yield
+        return
+
+    token = _scope_sessions.set([])
+    try:
+        yield
+    finally:
+        sessions = _scope_sessions.get()
+        _scope_sessions.reset(token)
+        for db in sessions:
+            db.close() 
\ No newline at end of file
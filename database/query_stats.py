@@ -0,0 +1,124 @@
+import os
+import re
+import sys
+import time
+import contextvars
+from collections import Counter
+from contextlib import contextmanager
+from functools import lru_cache
+from sqlalchemy import event
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from config.config import QUERY_WARN_COUNT, QUERY_WARN_MS, N_PLUS_ONE_THRESHOLD, QUERY_STATS_STRICT
+
+# Scope of the bot handler or admin request currently running (per asyncio task / per thread)
+_current_scope = contextvars.ContextVar('query_scope', default=None)
+
+# Fail scopes with detected N+1 patterns instead of only warning (for tests)
+strict_mode = QUERY_STATS_STRICT
+
+class NPlusOneError(Exception):
+    """Raised in strict mode when a scope repeats the same statement too often"""
+
+class QueryScope:
+    """Query count, SQL time and statement fingerprints of one handler or request"""
+
+    def __init__(self, name):
+        self.name = name
+        self.count = 0
+        self.total_time = 0.0
+        self.fingerprints = Counter()
+
+    def record(self, statement, duration):
+        self.count += 1
+        self.total_time += duration
+        self.fingerprints[fingerprint(statement)] += 1
+
+    def repeated_statements(self):
+        """Statements executed often enough to look like an N+1 pattern"""
+        return [(statement, count) for statement, count in self.fingerprints.most_common()
+                if count >= N_PLUS_ONE_THRESHOLD]
+
+    def __repr__(self):
+        return f"<QueryScope {self.name}: {self.count} queries in {self.total_time * 1000:.1f}ms>"
+
+@lru_cache(maxsize=2048)
+def fingerprint(statement):
+    """Normalize a SQL statement so executions differing only in literals compare equal"""
+    statement = re.sub(r"'(?:[^']|'')*'", "?", statement)
+    statement = re.sub(r"%\(\w+\)s|\$\d+|:\w+", "?", statement)
+    statement = re.sub(r"\b\d+(?:\.\d+)?\b", "?", statement)
+    statement = re.sub(r"\(\s*\?(?:\s*,\s*\?)*\s*\)", "(?)", statement)
+    return re.sub(r"\s+", " ", statement).strip()
+
+def shorten(statement, length=200):
+    """Shorten a statement for display, dropping the SELECT column list"""
+    statement = re.sub(r"^SELECT .*? FROM ", "SELECT ... FROM ", statement)
+    return statement if len(statement) <= length else statement[:length] + "..."
+
+def current_scope():
+    """Get the scope of the running handler or request, if any"""
+    return _current_scope.get()
+
+def start_scope(name):
+    """Start tracking queries; returns a token for finish_scope (None if already inside a scope)"""
+    if _current_scope.get() is not None:
+        return None
+    return _current_scope.set(QueryScope(name))
+
+def finish_scope(token, raise_errors=True):
+    """Stop tracking queries, report the scope and return it"""
+    if token is None:
+        return None
+    scope = _current_scope.get()
+    _current_scope.reset(token)
+    report(scope, raise_errors=raise_errors)
+    return scope
+
+@contextmanager
+def track(name):
+    """Track the queries run inside the block; nested blocks count towards the outer scope"""
+    token = start_scope(name)
+    try:
+        yield _current_scope.get()
+    except BaseException:
+        finish_scope(token, raise_errors=False)
+        raise
+    finish_scope(token)
+
+def report(scope, raise_errors=True):
+    """Warn about scopes that cross the configured thresholds"""
+    total_ms = scope.total_time * 1000
+    repeated = scope.repeated_statements()
+
+    if scope.count > QUERY_WARN_COUNT or total_ms > QUERY_WARN_MS:
+        print(f"[query-stats] {scope.name}: {scope.count} queries, {total_ms:.1f}ms SQL time")
+
+    for statement, count in repeated:
+        print(f"[query-stats] {scope.name}: possible N+1, {count}x {shorten(statement)}")
+
+    if repeated and strict_mode and raise_errors:
+        statement, count = repeated[0]
+        raise NPlusOneError(f"{scope.name} ran the same statement {count} times: {shorten(statement)}")
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if _current_scope.get() is not None:
+        conn.info.setdefault('query_stats_start', []).append(time.perf_counter())
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    scope = _current_scope.get()
+    starts = conn.info.get('query_stats_start')
+    if scope is not None and starts:
+        scope.record(statement, time.perf_counter() - starts.pop())
+
+def _handle_error(exception_context):
+    connection = exception_context.connection
+    starts = connection.info.get('query_stats_start') if connection is not None else None
+    if starts:
+        starts.pop()
+
+def install(engine):
+    """Hook query tracking into an engine"""
+    event.listen(engine, 'before_cursor_execute', _before_cursor_execute)
+    event.listen(engine, 'after_cursor_execute', _after_cursor_execute)
+    event.listen(engine, 'handle_error', _handle_error)
@@ -0,0 +1,162 @@
+import os
+import sys
+import gzip
+import json
+import datetime
+from collections import Counter
+from sqlalchemy import func
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from config.config import LOG_RETENTION_DAYS, LOG_RETENTION_BATCH_SIZE, LOG_ARCHIVE_DIR
+from database.models import get_db, Log, LogRollup
+
+def archive_path(day):
+    """Path of the compressed JSONL archive holding the raw logs of one day"""
+    return os.path.join(
+        LOG_ARCHIVE_DIR,
+        f"{day.year:04d}",
+        f"{day.month:02d}",
+        f"logs-{day.isoformat()}.jsonl.gz"
+    )
+
+def log_to_record(log):
+    """Serialize a log row into a JSON-friendly dict"""
+    return {
+        'id': log.id,
+        'telegram_id': log.telegram_id,
+        'action': log.action,
+        'course_id': log.course_id,
+        'payment_id': log.payment_id,
+        'category_id': log.category_id,
+        'timestamp': log.timestamp.isoformat() if log.timestamp else None,
+        'ip_address': log.ip_address,
+        'details': log.details
+    }
+
+def write_archives(logs):
+    """Append raw log rows to their daily archive files"""
+    by_day = {}
+    for log in logs:
+        by_day.setdefault(log.timestamp.date(), []).append(log)
+
+    for day, day_logs in by_day.items():
+        path = archive_path(day)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Appending creates a new gzip member; gzip.open reads multi-member files transparently
+        with gzip.open(path, 'at', encoding='utf-8') as f:
+            for log in day_logs:
+                f.write(json.dumps(log_to_record(log), ensure_ascii=False) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+
+def add_rollups(db, logs):
+    """Add the daily per-user/per-action counts of a batch to the rollup table"""
+    counts = Counter((log.timestamp.date(), log.telegram_id or '', log.action) for log in logs)
+    days = {key[0] for key in counts}
+    telegram_ids = {key[1] for key in counts}
+
+    existing = db.query(LogRollup).filter(
+        LogRollup.day.in_(days),
+        LogRollup.telegram_id.in_(telegram_ids)
+    ).all()
+    existing_by_key = {(r.day, r.telegram_id, r.action): r for r in existing}
+
+    for key, count in counts.items():
+        rollup = existing_by_key.get(key)
+        if rollup:
+            rollup.count += count
+        else:
+            day, telegram_id, action = key
+            db.add(LogRollup(day=day, telegram_id=telegram_id, action=action, count=count))
+
+def run_retention(days=LOG_RETENTION_DAYS, batch_size=LOG_RETENTION_BATCH_SIZE, max_batches=None):
+    """Roll up, archive and delete log rows older than the retention window.
+
+    Stops after max_batches batches when given; expired_logs_remain() tells
+    whether another run is needed. Each batch is written to the archive before the rollup and delete are
+    committed together, so a crash can at worst archive a row twice (search
+    de-duplicates by id) but never lose or double-count it.
+    """
+    cutoff = datetime.datetime.now(datetime.UTC) - datetime.timedelta(days=days)
+    db = get_db()
+    total = 0
+    batches = 0
+
+    try:
+        while max_batches is None or batches < max_batches:
+            logs = db.query(Log).filter(Log.timestamp < cutoff).order_by(Log.id).limit(batch_size).all()
+            if not logs:
+                break
+
+            write_archives(logs)
+            add_rollups(db, logs)
+            db.query(Log).filter(Log.id.in_([log.id for log in logs])).delete(synchronize_session=False)
+            db.commit()
+            db.expunge_all()
+
+            total += len(logs)
+            batches += 1
+            print(f"Archived {total} log rows so far...")
+    except Exception as e:
+        db.rollback()
+        print(f"Error during log retention: {e}")
+        raise
+    finally:
+        db.close()
+
+    return total
+
+def expired_logs_remain(days=LOG_RETENTION_DAYS):
+    """Whether any log row is older than the retention window"""
+    cutoff = datetime.datetime.now(datetime.UTC) - datetime.timedelta(days=days)
+    db = get_db()
+    try:
+        return db.query(Log.id).filter(Log.timestamp < cutoff).first() is not None
+    finally:
+        db.close()
+
+def search_archives(start_date, end_date, telegram_id=None, action=None, text=None, limit=200):
+    """Search archived log rows between two dates (inclusive), newest day first"""
+    results = []
+    seen_ids = set()
+    text = text.lower() if text else None
+
+    day = end_date
+    while day >= start_date and len(results) < limit:
+        path = archive_path(day)
+        if os.path.exists(path):
+            day_results = []
+            with gzip.open(path, 'rt', encoding='utf-8') as f:
+                for line in f:
+                    record = json.loads(line)
+                    if record['id'] in seen_ids:
+                        continue
+                    if telegram_id and record['telegram_id'] != telegram_id:
+                        continue
+                    if action and record['action'] != action:
+                        continue
+                    if text and text not in (record['details'] or '').lower():
+                        continue
+                    seen_ids.add(record['id'])
+                    day_results.append(record)
+            day_results.sort(key=lambda r: r['timestamp'] or '', reverse=True)
+            results.extend(day_results)
+        day -= datetime.timedelta(days=1)
+
+    return results[:limit]
+
+def get_rollup_totals(start_date, end_date, telegram_id=None):
+    """Get per-action totals from the daily rollups between two dates (inclusive)"""
+    db = get_db()
+    query = db.query(LogRollup.action, func.sum(LogRollup.count)).filter(
+        LogRollup.day >= start_date,
+        LogRollup.day <= end_date
+    )
+    if telegram_id:
+        query = query.filter(LogRollup.telegram_id == telegram_id)
+    return query.group_by(LogRollup.action).order_by(func.sum(LogRollup.count).desc()).all()
+
+if __name__ == "__main__":
+    print(f"Archiving logs older than {LOG_RETENTION_DAYS} days to {LOG_ARCHIVE_DIR}...")
+    archived = run_retention()
+    print(f"Log retention completed! Archived {archived} rows.")
@@ -9,7 +9,7 @@ from pathlib import Path
 sys.path.append(os.path.dirname(os.path.abspath(__file__)))
 
 # Import bot and admin components
-from bot.bot import app as bot_app
+from bot.bot import run as run_bot_app
 from database.init_db import initialize_database
 
 def start_admin_dashboard():
@@ -21,7 +21,7 @@ def start_admin_dashboard():
 def run_bot():
     """Run the Telegram bot"""
     print("Starting Telegram bot...")
-    bot_app.run()
+    run_bot_app()
 
 def main():
     """Main entry point for the application"""
@@ -3,7 +3,6 @@ import sys
 import hashlib
 import datetime
 import requests
-import pyshorteners
 import random
 import string
 from PIL import Image
@@ -11,14 +10,21 @@ from io import BytesIO
 
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 from config.config import UPLOAD_FOLDER
-from database.models import Log, get_db
+from database.models import Log, get_db, get_log_action_code
 
-def log_action(telegram_id, action, ip_address=None, details=None):
-    """Log user actions to the database"""
+def log_action(telegram_id, action, ip_address=None, details=None, course_id=None, payment_id=None, category_id=None):
+    """Log user actions to the database.
+
+    Pass related records as course_id/payment_id/category_id rather than
+    formatting their names into details.
+    """
     db = get_db()
     log = Log(
         telegram_id=telegram_id,
-        action=action,
+        action_code=get_log_action_code(db, action),
+        course_id=course_id,
+        payment_id=payment_id,
+        category_id=category_id,
         ip_address=ip_address,
         details=details
     )
@@ -52,15 +58,6 @@ def random_string(length=8):
     letters = string.ascii_lowercase + string.digits
     return ''.join(random.choice(letters) for i in range(length))
 
-def shorten_url(url):
-    """Shorten a URL using TinyURL"""
-    try:
-        s = pyshorteners.Shortener()
-        return s.tinyurl.short(url)
-    except Exception as e:
-        print(f"Error shortening URL: {e}")
-        return url
-
 def is_valid_image(file_data):
     """Check if the file is a valid image"""
     try:
@@ -113,4 +110,15 @@ def format_course_info(course):
     )
     
     # We'll handle image display separately in the bot.py file
-    return course_text 
\ No newline at end of file
+    return course_text
+
+def guess_file_kind(filename):
+    """How Telegram should send a course file: 'photo', 'video', 'audio' or 'document'"""
+    extension = filename.rsplit('.', 1)[-1].lower() if '.' in filename else ''
+    if extension in ('jpg', 'jpeg', 'png'):
+        return 'photo'
+    if extension in ('mp4', 'mov'):
+        return 'video'
+    if extension in ('mp3', 'm4a', 'ogg', 'flac'):
+        return 'audio'
+    return 'document'
@@ -0,0 +1,67 @@
+import os
+import sys
+import hmac
+import time
+import base64
+import struct
+import hashlib
+import binascii
+from collections import namedtuple
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from config.config import PUBLIC_BASE_URL, LINK_SECRET, LINK_TTL
+
+# Format version, Telegram user id, payment id (0 for free courses), course id, expiry (unix time)
+_PAYLOAD = struct.Struct('>BQIII')
+TOKEN_VERSION = 1
+# Truncated HMAC-SHA256; 96 bits is plenty against forging a link online
+MAC_BYTES = 12
+
+Link = namedtuple('Link', ['telegram_id', 'payment_id', 'course_id', 'expires'])
+
+class InvalidLink(ValueError):
+    """A token that is not accepted; reason is 'disabled', 'malformed', 'signature' or 'expired'"""
+
+    def __init__(self, reason):
+        super().__init__(f"{reason} course link")
+        self.reason = reason
+
+def enabled():
+    """Whether course links go through the dashboard's /l/ route"""
+    return bool(PUBLIC_BASE_URL and LINK_SECRET)
+
+def _mac(payload):
+    if not LINK_SECRET:
+        # An empty key would let anyone sign links
+        raise ValueError("LINK_SECRET is not set")
+    return hmac.new(LINK_SECRET.encode(), payload, hashlib.sha256).digest()[:MAC_BYTES]
+
+def make_token(telegram_id, course_id, payment_id=None, ttl=LINK_TTL, now=None):
+    """Signed token for one user's access to a course, bought with payment_id (None for free courses)"""
+    expires = int((now or time.time()) + ttl)
+    payload = _PAYLOAD.pack(TOKEN_VERSION, int(telegram_id), payment_id or 0, course_id, expires)
+    return base64.urlsafe_b64encode(payload + _mac(payload)).rstrip(b'=').decode()
+
+def read_token(token, now=None):
+    """Link a token stands for; raises InvalidLink for forged, damaged or expired tokens"""
+    if not LINK_SECRET:
+        raise InvalidLink('disabled')
+    try:
+        raw = base64.urlsafe_b64decode(token + '=' * (-len(token) % 4))
+    except (binascii.Error, ValueError):
+        raise InvalidLink('malformed')
+    if len(raw) != _PAYLOAD.size + MAC_BYTES:
+        raise InvalidLink('malformed')
+    payload, mac = raw[:_PAYLOAD.size], raw[_PAYLOAD.size:]
+    if not hmac.compare_digest(mac, _mac(payload)):
+        raise InvalidLink('signature')
+    version, telegram_id, payment_id, course_id, expires = _PAYLOAD.unpack(payload)
+    if version != TOKEN_VERSION:
+        raise InvalidLink('malformed')
+    if (now or time.time()) >= expires:
+        raise InvalidLink('expired')
+    return Link(telegram_id, payment_id or None, course_id, expires)
+
+def course_url(telegram_id, course_id, payment_id=None):
+    """Short link to a course on the dashboard; computed locally, no network round-trip"""
+    return f"{PUBLIC_BASE_URL}/l/{make_token(telegram_id, course_id, payment_id)}"
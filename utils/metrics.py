@@ -0,0 +1,226 @@
+import bisect
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Latency buckets in seconds, from a cache hit to a slow Telegram round-trip
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+def _escape(value):
+    """Escape a label value for the text format"""
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+class Metric:
+    """Base class for metrics with optional labels.
+
+    Updates are plain attribute/list increments without locks. The bot runs its
+    handlers on a single event loop and each gunicorn sync worker serves one
+    request at a time, so no increment is lost within a process; with threaded
+    servers an occasional one may be, which is fine for monitoring. The
+    registry is per process: with several gunicorn workers each holds its own
+    counts, and a scrape only sees the worker that answered it.
+    """
+    type_name = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._children = {}
+        self._lock = threading.Lock()  # Only taken when a new label combination is created
+
+    def labels(self, *values):
+        """Get the child metric for a combination of label values"""
+        values = tuple(str(value) for value in values)
+        child = self._children.get(values)
+        if child is None:
+            with self._lock:
+                child = self._children.setdefault(values, self._new_child())
+        return child
+
+    def _new_child(self):
+        raise NotImplementedError
+
+    def _label_string(self, values, extra=None):
+        pairs = list(zip(self.labelnames, values)) + ([extra] if extra else [])
+        if not pairs:
+            return ""
+        return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}"
+
+    def _samples(self):
+        raise NotImplementedError
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type_name}"]
+        lines.extend(self._samples())
+        return "\n".join(lines)
+
+class _CounterChild:
+    __slots__ = ('value',)
+
+    def __init__(self):
+        self.value = 0.0
+
+    def inc(self, amount=1):
+        self.value += amount
+
+class Counter(Metric):
+    type_name = 'counter'
+
+    def _new_child(self):
+        return _CounterChild()
+
+    def inc(self, amount=1):
+        self.labels().inc(amount)
+
+    def _samples(self):
+        for values, child in list(self._children.items()):
+            yield f"{self.name}{self._label_string(values)} {child.value}"
+
+class _GaugeChild:
+    __slots__ = ('value', 'function')
+
+    def __init__(self):
+        self.value = 0.0
+        self.function = None
+
+    def inc(self, amount=1):
+        self.value += amount
+
+    def dec(self, amount=1):
+        self.value -= amount
+
+    def set(self, value):
+        self.value = value
+
+    def set_function(self, function):
+        """Compute the value at scrape time (e.g. a queue length)"""
+        self.function = function
+
+    def get(self):
+        if self.function is not None:
+            try:
+                return float(self.function())
+            except Exception as e:
+                print(f"Error reading gauge: {e}")
+                return float('nan')
+        return self.value
+
+class Gauge(Metric):
+    type_name = 'gauge'
+
+    def _new_child(self):
+        return _GaugeChild()
+
+    def inc(self, amount=1):
+        self.labels().inc(amount)
+
+    def dec(self, amount=1):
+        self.labels().dec(amount)
+
+    def set(self, value):
+        self.labels().set(value)
+
+    def set_function(self, function):
+        self.labels().set_function(function)
+
+    def _samples(self):
+        for values, child in list(self._children.items()):
+            yield f"{self.name}{self._label_string(values)} {child.get()}"
+
+class _HistogramChild:
+    __slots__ = ('buckets', 'counts', 'sum', 'count')
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # Last slot is +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+class Histogram(Metric):
+    type_name = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def _new_child(self):
+        return _HistogramChild(self.buckets)
+
+    def observe(self, value):
+        self.labels().observe(value)
+
+    def _samples(self):
+        for values, child in list(self._children.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), list(child.counts)):
+                cumulative += count
+                le = '+Inf' if bound == float('inf') else repr(bound)
+                yield f"{self.name}_bucket{self._label_string(values, ('le', le))} {cumulative}"
+            yield f"{self.name}_sum{self._label_string(values)} {child.sum}"
+            yield f"{self.name}_count{self._label_string(values)} {child.count}"
+
+# Metrics of this process, in registration order
+REGISTRY = {}
+
+def _register(metric):
+    return REGISTRY.setdefault(metric.name, metric)
+
+def counter(name, documentation, labelnames=()):
+    return _register(Counter(name, documentation, labelnames))
+
+def gauge(name, documentation, labelnames=()):
+    return _register(Gauge(name, documentation, labelnames))
+
+def histogram(name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+    return _register(Histogram(name, documentation, labelnames, buckets))
+
+def render():
+    """Render every registered metric in the Prometheus text format"""
+    return "\n".join(metric.render() for metric in list(REGISTRY.values())) + "\n"
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# Extra pages served by the local HTTP server: path -> function(request) returning (content_type, body).
+# The request is the BaseHTTPRequestHandler, for routes that need headers; raise PermissionError to deny access.
+http_routes = {
+    '/metrics': lambda request: (CONTENT_TYPE, render())
+}
+
+class _RequestHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        path = self.path.split('?', 1)[0]
+        route = http_routes.get(path)
+        if route is None:
+            self.send_error(404)
+            return
+        try:
+            content_type, body = route(self)
+        except PermissionError:
+            self.send_error(403)
+            return
+        except Exception as e:
+            print(f"Error serving {path}: {e}")
+            self.send_error(500)
+            return
+        body = body.encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass  # Scrapes every few seconds would flood the output
+
+def start_http_server(port, host='127.0.0.1'):
+    """Serve /metrics (and other http_routes) from a background thread"""
+    server = ThreadingHTTPServer((host, port), _RequestHandler)
+    thread = threading.Thread(target=server.serve_forever, name='metrics-http', daemon=True)
+    thread.start()
+    print(f"Metrics available on http://{host}:{port}/metrics")
+    return server
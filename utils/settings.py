@@ -0,0 +1,70 @@
+import os
+import sys
+import time
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from config.config import WELCOME_MESSAGE, PAYMENT_OPTIONS, SETTINGS_CACHE_SECONDS
+from database.models import get_db, BotSetting, get_settings_version
+
+# Settings the admin can change on the /settings page, with their defaults
+# from the environment; a row in bot_settings overrides the default
+DEFAULTS = {
+    'welcome_message': WELCOME_MESSAGE,
+    'dmca_policy_text': '',
+    'upi_id': PAYMENT_OPTIONS['UPI'],
+    'crypto_address': PAYMENT_OPTIONS['CRYPTO'],
+    'paypal_id': PAYMENT_OPTIONS['PAYPAL'],
+    'cod_enabled': 'true' if PAYMENT_OPTIONS['COD'] else 'false',
+    'gift_card_enabled': 'true' if PAYMENT_OPTIONS['GIFT_CARD'] else 'false',
+}
+
+# key -> value of every bot_settings row, loaded for _version
+_values = {}
+_payment_options = None
+_version = None
+_checked = 0.0
+
+def version():
+    """Settings version, read from the database at most every SETTINGS_CACHE_SECONDS"""
+    global _version, _checked, _payment_options
+    now = time.monotonic()
+    if _version is None or now - _checked >= SETTINGS_CACHE_SECONDS:
+        db = get_db()
+        current = get_settings_version(db)
+        if current != _version:
+            _values.clear()
+            _values.update({row.key: row.value for row in db.query(BotSetting).all()})
+            _payment_options = None
+            _version = current
+        # Nothing loaded here outlives the session; give its connection back right away
+        db.close()
+        _checked = now
+    return _version
+
+def get(key):
+    """Current value of a setting, without a query except when the settings changed"""
+    version()
+    value = _values.get(key)
+    return value if value is not None else DEFAULTS.get(key, '')
+
+def flag(key):
+    return get(key).lower() == 'true'
+
+def payment_options():
+    """Enabled payment methods, shaped like config.PAYMENT_OPTIONS"""
+    global _payment_options
+    version()
+    if _payment_options is None:
+        _payment_options = {
+            'UPI': get('upi_id'),
+            'CRYPTO': get('crypto_address'),
+            'PAYPAL': get('paypal_id'),
+            'COD': flag('cod_enabled'),
+            'GIFT_CARD': flag('gift_card_enabled'),
+        }
+    return _payment_options
+
+def invalidate():
+    """Load all settings again on the next lookup"""
+    global _version
+    _version = None
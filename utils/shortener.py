@@ -0,0 +1,180 @@
+import os
+import sys
+import time
+import asyncio
+import hashlib
+from collections import OrderedDict
+import requests
+from sqlalchemy.exc import IntegrityError
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from config.config import (
+    SHORTENER_URL, SHORTENER_TIMEOUT, SHORTENER_CACHE_SIZE, SHORTENER_CONCURRENCY,
+    SHORTENER_FAILURE_THRESHOLD, SHORTENER_RESET_SECONDS
+)
+from database.models import get_db, ShortUrl
+from utils import metrics
+
+LOOKUPS = metrics.counter('shortener_lookups_total', 'Links shortened, by where the short URL came from', ['source'])
+
+def url_hash(url):
+    return hashlib.sha256(url.encode()).hexdigest()
+
+class CircuitBreaker:
+    """Stops calls to a failing service for a while.
+
+    After `threshold` failures in a row the circuit opens and allow() is False
+    for `reset_seconds`; then one trial call is let through, and its success
+    closes the circuit again.
+    """
+
+    def __init__(self, threshold, reset_seconds):
+        self.threshold = threshold
+        self.reset_seconds = reset_seconds
+        self.failures = 0
+        self.opened_at = None
+        self.trial = False
+
+    def allow(self, now=None):
+        if self.opened_at is None:
+            return True
+        if self.trial or (now or time.monotonic()) - self.opened_at < self.reset_seconds:
+            return False
+        self.trial = True
+        return True
+
+    def success(self):
+        self.failures = 0
+        self.opened_at = None
+        self.trial = False
+
+    def failure(self, now=None):
+        self.failures += 1
+        self.trial = False
+        if self.failures >= self.threshold or self.opened_at is not None:
+            self.opened_at = now or time.monotonic()
+
+    @property
+    def is_open(self):
+        return self.opened_at is not None
+
+class Shortener:
+    """Memoized URL shortener that never holds up the event loop for long.
+
+    Short URLs come from memory, then the short_urls table, then the provider
+    (a TinyURL-style GET endpoint returning the short URL as text), called in
+    a thread with a timeout. When the provider fails or times out, and while
+    its circuit is open, the long URL is returned as it is.
+    """
+
+    def __init__(self, api_url=SHORTENER_URL, timeout=SHORTENER_TIMEOUT, cache_size=SHORTENER_CACHE_SIZE,
+                 concurrency=SHORTENER_CONCURRENCY, breaker=None):
+        self.api_url = api_url
+        self.timeout = timeout
+        self.cache_size = cache_size
+        self.concurrency = concurrency
+        self.breaker = breaker or CircuitBreaker(SHORTENER_FAILURE_THRESHOLD, SHORTENER_RESET_SECONDS)
+        self._cache = OrderedDict()  # long -> short, most recently used last
+        self._pending = {}  # long -> task, so concurrent lookups of one URL call the provider once
+        self._slots = None
+
+    def remember(self, url, short):
+        self._cache[url] = short
+        self._cache.move_to_end(url)
+        if len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+
+    def cached(self, url):
+        short = self._cache.get(url)
+        if short is not None:
+            self._cache.move_to_end(url)
+        return short
+
+    def load(self, urls):
+        """Short URLs stored for any of urls, in one query"""
+        hashes = {url_hash(url): url for url in urls}
+        rows = get_db().query(ShortUrl.url_hash, ShortUrl.short_url).filter(ShortUrl.url_hash.in_(list(hashes))).all()
+        found = {}
+        for row_hash, short in rows:
+            found[hashes[row_hash]] = short
+            self.remember(hashes[row_hash], short)
+        return found
+
+    def store(self, url, short):
+        self.remember(url, short)
+        db = get_db()
+        db.add(ShortUrl(url_hash=url_hash(url), long_url=url, short_url=short))
+        try:
+            db.commit()
+        except IntegrityError:
+            # Stored by the other process first
+            db.rollback()
+
+    def request(self, url):
+        response = requests.get(self.api_url, params={'url': url}, timeout=self.timeout)
+        response.raise_for_status()
+        short = response.text.strip()
+        if not short.startswith(('http://', 'https://')) or len(short) > 255:
+            raise ValueError(f"Unexpected shortener response: {short[:100]!r}")
+        return short
+
+    async def fetch(self, url):
+        """Short URL from the provider, or url itself when it cannot be had right now"""
+        if not self.breaker.allow():
+            LOOKUPS.labels('fallback').inc()
+            return url
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(self.concurrency)
+        try:
+            async with self._slots:
+                loop = asyncio.get_running_loop()
+                short = await asyncio.wait_for(loop.run_in_executor(None, self.request, url), self.timeout)
+        except Exception as e:
+            print(f"Error shortening URL: {e!r}")
+            self.breaker.failure()
+            LOOKUPS.labels('fallback').inc()
+            return url
+        self.breaker.success()
+        LOOKUPS.labels('provider').inc()
+        self.store(url, short)
+        return short
+
+    def fetch_once(self, url):
+        task = self._pending.get(url)
+        if task is None:
+            task = self._pending[url] = asyncio.ensure_future(self.fetch(url))
+            task.add_done_callback(lambda _: self._pending.pop(url, None))
+        return task
+
+    async def shorten_many(self, urls):
+        """{long: short} for urls; the provider is asked for all unknown ones at once"""
+        result = {}
+        missing = []
+        for url in dict.fromkeys(urls):
+            short = self.cached(url) if self.api_url and url else url
+            if short is not None:
+                result[url] = short
+                LOOKUPS.labels('memory' if self.api_url and url else 'disabled').inc()
+            else:
+                missing.append(url)
+        if missing:
+            stored = self.load(missing)
+            LOOKUPS.labels('database').inc(len(stored))
+            result.update(stored)
+            missing = [url for url in missing if url not in stored]
+        if missing:
+            shorts = await asyncio.gather(*[asyncio.shield(self.fetch_once(url)) for url in missing])
+            result.update(zip(missing, shorts))
+        return result
+
+    async def shorten(self, url):
+        return (await self.shorten_many([url]))[url]
+
+shortener = Shortener()
+
+async def shorten(url):
+    """Short URL for a link, or the link itself if the shortener is disabled or unavailable"""
+    return await shortener.shorten(url)
+
+async def shorten_many(urls):
+    return await shortener.shorten_many(urls)
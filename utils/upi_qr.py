@@ -0,0 +1,96 @@
+import os
+import sys
+import hashlib
+import tempfile
+from io import BytesIO
+from collections import OrderedDict
+from urllib.parse import urlencode, quote
+import qrcode
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from config.config import UPI_PAYEE_NAME, QR_CACHE_DIR, QR_CACHE_SIZE
+from utils import settings
+
+# Rendered PNGs by (UPI ID, amount), most recently used last
+_images = OrderedDict()
+
+def format_amount(amount):
+    return f"{float(amount):.2f}"
+
+def upi_uri(amount, reference=None, note=None, payee=None, name=UPI_PAYEE_NAME):
+    """upi://pay link for an exact amount in INR"""
+    params = {'pa': payee or settings.get('upi_id'), 'pn': name, 'am': format_amount(amount), 'cu': 'INR'}
+    if note:
+        params['tn'] = note[:50]
+    if reference:
+        params['tr'] = reference[:35]
+    return "upi://pay?" + urlencode(params, safe="@", quote_via=quote)
+
+def render(uri):
+    """PNG bytes of a QR code"""
+    code = qrcode.QRCode(error_correction=qrcode.constants.ERROR_CORRECT_M, box_size=10, border=4)
+    code.add_data(uri)
+    code.make(fit=True)
+    buffer = BytesIO()
+    code.make_image(fill_color="black", back_color="white").save(buffer, format='PNG')
+    return buffer.getvalue()
+
+def cache_path(amount, payee=None):
+    """File of the QR code for an amount; the UPI ID is part of the name so changing it renders new codes"""
+    payee = payee or settings.get('upi_id')
+    payee_hash = hashlib.sha256(payee.encode()).hexdigest()[:10]
+    return os.path.join(QR_CACHE_DIR, f"upi-{payee_hash}-{format_amount(amount)}.png")
+
+def write(path, data):
+    """Write then rename so a concurrent reader never sees half a file"""
+    os.makedirs(QR_CACHE_DIR, exist_ok=True)
+    # A file of its own per writer: the prewarm thread and requests may render the same amount at once
+    with tempfile.NamedTemporaryFile(dir=QR_CACHE_DIR, suffix='.tmp', delete=False) as f:
+        f.write(data)
+    os.replace(f.name, path)
+
+def qr_png(amount):
+    """QR code for an amount from memory, disk or freshly rendered"""
+    key = (settings.get('upi_id'), format_amount(amount))
+    data = _images.pop(key, None)
+    if data is None:
+        path = cache_path(amount)
+        if os.path.exists(path):
+            with open(path, 'rb') as f:
+                data = f.read()
+        else:
+            data = render(upi_uri(amount))
+            write(path, data)
+    _images[key] = data
+    if len(_images) > QR_CACHE_SIZE:
+        _images.popitem(last=False)
+    return data
+
+def qr_file(amount):
+    """Path of the cached QR code for an amount, rendering it first if needed"""
+    path = cache_path(amount)
+    if not os.path.exists(path):
+        data = qr_png(amount)
+        # The bytes came from memory, so nothing was written
+        if not os.path.exists(path):
+            write(path, data)
+    return path
+
+def qr_with_reference(amount, reference, note=None):
+    """QR code for one payment; never cached since the reference is unique"""
+    data = BytesIO(render(upi_uri(amount, reference=reference, note=note)))
+    data.name = f"upi-{reference}.png"
+    return data
+
+def prewarm(amounts):
+    """Render the QR codes of the given amounts ahead of the first request"""
+    if not settings.get('upi_id'):
+        return 0
+    rendered = 0
+    for amount in sorted(set(amounts)):
+        try:
+            qr_file(amount)
+            rendered += 1
+        except Exception as e:
+            print(f"Error rendering UPI QR code for {amount}: {e}")
+    return rendered